@@ -38,6 +38,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'gestion.middleware.PerfiladoMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware', 
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -47,6 +48,15 @@ MIDDLEWARE = [
     'gestion.middleware.PrimerLoginMiddleware',
 ]
 
+# Perfilado por pedido (SQL, plantillas, total): cabecera Server-Timing para staff y
+# estadísticas por vista en /gestion/rendimiento/. Liviano, pensado para dejarlo prendido.
+PERFILADO_ACTIVO = os.getenv('PERFILADO_ACTIVO', 'True') == 'True'
+PERFILADO_VENTANA = int(os.getenv('PERFILADO_VENTANA', 200))
+
+# Porcentaje mínimo de cada departamento que debe seguir trabajando al mover vacaciones en lote
+# desde el planificador (api_vacaciones_mover_lote)
+CAPACIDAD_MINIMA_PCT = int(os.getenv('CAPACIDAD_MINIMA_PCT', 50))
+
 # Ajusta el nombre de tu proyecto principal según tu estructura real
 ROOT_URLCONF = 'controlDeVacaciones.urls' 
 WSGI_APPLICATION = 'controlDeVacaciones.wsgi.application'
@@ -101,6 +111,31 @@ if 'DATABASE_URL' in os.environ:
         ssl_require=True
     )
 
+# ==============================================================================
+# CACHE
+# ==============================================================================
+
+# Las versiones de notificaciones, capacidad, feriados y configuración de email viven en el cache.
+# Con REDIS_URL se comparten entre todos los procesos (varios workers de gunicorn, procesar_correos).
+# Sin REDIS_URL se usa LocMemCache, que es de cada proceso: en ese caso la app debe correr en UN solo
+# proceso (gunicorn con 1 worker y varios hilos, ver Dockerfile); con más de uno, lo que invalida un
+# worker no lo ven los demás.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+CACHE_COMPARTIDO = bool(REDIS_URL)
+
 
 # ==============================================================================
 # AUTENTICACIÓN Y CONTRASEÑAS
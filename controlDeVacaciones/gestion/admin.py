@@ -29,6 +29,10 @@ class SaldoVacacionesAdmin(admin.ModelAdmin):
     search_fields = ('empleado__legajo', 'empleado__apellido')
     list_editable = ('dias_adicionales',)  # Permite editar días adicionales directamente desde la lista
 
+    def get_queryset(self, request):
+        # Saldos anotados en la misma consulta para que 'total_disponible' no consulte por fila
+        return super().get_queryset(request).with_balances()
+
 # Registro de los modelos en el sitio de administración
 admin.site.register(Departamento)
 admin.site.register(Empleado, EmpleadoAdmin)
@@ -0,0 +1,265 @@
+from collections import defaultdict, namedtuple
+from datetime import date, timedelta
+from functools import lru_cache
+
+from django.db.models import Q, Sum
+
+from .ciclos import desde_anio
+from .models import Empleado, SaldoVacaciones, RegistroVacaciones
+
+
+MESES_ESPANOL = {
+    1: 'Ene', 2: 'Feb', 3: 'Mar', 4: 'Abr', 5: 'May', 6: 'Jun',
+    7: 'Jul', 8: 'Ago', 9: 'Sep', 10: 'Oct', 11: 'Nov', 12: 'Dic'
+}
+
+# Esqueleto del calendario: registros inmutables, compartidos entre requests desde el cache.
+# 'dias' es la tupla de las 7 fechas (lunes a domingo); 'mes' es el mes al que se asigna la semana.
+Semana = namedtuple('Semana', ['dias', 'inicio', 'fin', 'mes', 'rango'])
+MesCalendario = namedtuple('MesCalendario', ['numero', 'nombre', 'semanas', 'total_semanas'])
+
+# Celda precalculada de la grilla: días de ausencia en la semana y estado dominante
+# ('aprobada', 'pendiente' o None si la semana está libre).
+CeldaSemana = namedtuple('CeldaSemana', ['dias', 'estado'])
+
+CELDA_VACIA = CeldaSemana(0, None)
+
+_UN_DIA = timedelta(days=1)
+_UNA_SEMANA = timedelta(days=7)
+
+
+def _formatear_rango(inicio, fin):
+    if inicio.month == fin.month and inicio.year == fin.year:
+        return f"{inicio.day}-{fin.day}"
+    if inicio.year != fin.year:
+        # Si cruza de año, mostrar año corto (ej: 29/12/24-4/1/25)
+        return f"{inicio.day}/{inicio.month}/{str(inicio.year)[-2:]}-{fin.day}/{fin.month}/{str(fin.year)[-2:]}"
+    return f"{inicio.day}/{inicio.month}-{fin.day}/{fin.month}"
+
+
+@lru_cache(maxsize=32)
+def esqueleto_anio(anio):
+    """
+    Semanas completas (lunes a domingo) que tocan el año, agrupadas por mes.
+    Cada semana va al mes en que comienza; la que empieza el año anterior va a Enero.
+    Devuelve una tupla de MesCalendario (solo meses con semanas). Es puro por año, así que se cachea.
+    """
+    primer_dia = date(anio, 1, 1)
+    ultimo_dia = date(anio, 12, 31)
+    semanas_por_mes = defaultdict(list)
+
+    inicio = primer_dia - timedelta(days=primer_dia.weekday())
+    while inicio <= ultimo_dia:
+        fin = inicio + timedelta(days=6)
+        mes = inicio.month if inicio.year == anio else 1
+        dias = tuple(inicio + timedelta(days=i) for i in range(7))
+        semanas_por_mes[mes].append(Semana(dias, inicio, fin, mes, _formatear_rango(inicio, fin)))
+        inicio += _UNA_SEMANA
+
+    return tuple(
+        MesCalendario(numero, MESES_ESPANOL[numero], tuple(semanas_por_mes[numero]), len(semanas_por_mes[numero]))
+        for numero in range(1, 13) if semanas_por_mes[numero]
+    )
+
+
+@lru_cache(maxsize=16)
+def meses_de_anios(anios):
+    """
+    Meses de varios años seguidos (vista 'todos'), con el año corto en el nombre (ej: "Ene 25").
+    'anios' debe ser una tupla. Los meses renombrados son tuplas nuevas que comparten las semanas
+    del esqueleto, así que el cache de esqueleto_anio nunca se modifica.
+    """
+    return tuple(
+        mes._replace(nombre=f"{mes.nombre} {str(anio)[-2:]}")
+        for anio in anios
+        for mes in esqueleto_anio(anio)
+    )
+
+
+def _fusionar_intervalos(intervalos):
+    """Une intervalos [inicio, fin] (inclusive) ya ordenados por inicio en segmentos disjuntos."""
+    segmentos = []
+    for inicio, fin in intervalos:
+        if segmentos and inicio <= segmentos[-1][1] + _UN_DIA:
+            if fin > segmentos[-1][1]:
+                segmentos[-1][1] = fin
+        else:
+            segmentos.append([inicio, fin])
+    return segmentos
+
+
+def _dias_cubiertos_por_semana(semanas, segmentos):
+    """
+    Cuenta, para cada semana, los días cubiertos por los segmentos disjuntos.
+    Barrido único: las semanas vienen ordenadas por inicio, así que los segmentos que
+    terminan antes de la semana actual se descartan para siempre.
+    """
+    conteos = []
+    primero = 0
+    for semana in semanas:
+        inicio_sem, fin_sem = semana.inicio, semana.fin
+        while primero < len(segmentos) and segmentos[primero][1] < inicio_sem:
+            primero += 1
+
+        dias = 0
+        i = primero
+        while i < len(segmentos) and segmentos[i][0] <= fin_sem:
+            desde = max(segmentos[i][0], inicio_sem)
+            hasta = min(segmentos[i][1], fin_sem)
+            dias += (hasta - desde).days + 1
+            i += 1
+        conteos.append(dias)
+    return conteos
+
+
+def calcular_ocupacion_semanal(semanas, vacaciones):
+    """
+    Devuelve una lista de CeldaSemana alineada con 'semanas' (Semana en lista plana, ordenada por inicio).
+    Los días se cuentan sobre la unión de todas las vacaciones (aprobadas y pendientes);
+    el estado es 'aprobada' si algún día de la semana está aprobado, si no 'pendiente'.
+    """
+    if not vacaciones:
+        return [CELDA_VACIA] * len(semanas)
+
+    ordenadas = sorted(vacaciones, key=lambda v: (v.fecha_inicio, v.fecha_fin))
+    todos = _fusionar_intervalos((v.fecha_inicio, v.fecha_fin) for v in ordenadas)
+    aprobados = _fusionar_intervalos(
+        (v.fecha_inicio, v.fecha_fin) for v in ordenadas
+        if v.estado == RegistroVacaciones.ESTADO_APROBADA
+    )
+
+    dias_totales = _dias_cubiertos_por_semana(semanas, todos)
+    dias_aprobados = _dias_cubiertos_por_semana(semanas, aprobados) if aprobados else [0] * len(semanas)
+
+    celdas = []
+    for dias, aprobadas in zip(dias_totales, dias_aprobados):
+        if not dias:
+            celdas.append(CELDA_VACIA)
+        else:
+            celdas.append(CeldaSemana(dias, 'aprobada' if aprobadas else 'pendiente'))
+    return celdas
+
+
+def _empleados_visibles(usuario):
+    """
+    Empleados que el usuario puede ver en la planificación anual.
+    - Superusuario: todos.
+    - Manager: los de su equipo directo dentro de un departamento, más los que no tienen departamento.
+    """
+    empleados = Empleado.objects.select_related('departamento', 'manager_aprobador')
+    if not usuario.is_superuser:
+        empleados = empleados.filter(
+            Q(departamento__isnull=True) | Q(manager_aprobador=usuario.empleado)
+        )
+    return list(empleados.order_by('apellido', 'nombre'))
+
+
+def saldos_por_empleado(empleados, anio_saldo, con_balances=False):
+    """
+    Devuelve {empleado_id: SaldoVacaciones} para el ciclo indicado.
+    Los saldos faltantes se crean en bloque con la base LCT (equivalente al get_or_create por empleado).
+    Con 'con_balances' los saldos existentes vienen anotados (SaldoVacacionesQuerySet.with_balances).
+    """
+    saldos_qs = SaldoVacaciones.objects.filter(empleado__in=empleados, ciclo=anio_saldo)
+    if con_balances:
+        saldos_qs = saldos_qs.with_balances()
+    saldos = {s.empleado_id: s for s in saldos_qs}
+
+    faltantes = [
+        SaldoVacaciones(empleado=emp, ciclo=anio_saldo, dias_iniciales=emp.dias_base_lct(anio_saldo))
+        for emp in empleados if emp.id not in saldos
+    ]
+    if faltantes:
+        SaldoVacaciones.objects.bulk_create(faltantes, ignore_conflicts=True)
+        # Releer lo creado con la misma consulta: así también viene anotado (y con pk, que bulk_create
+        # con ignore_conflicts no devuelve); si no, total_disponible() consultaría el libro fila por fila
+        for saldo in saldos_qs.filter(empleado_id__in=[s.empleado_id for s in faltantes]):
+            saldos[saldo.empleado_id] = saldo
+
+    # Reusar la instancia ya cargada para que dias_base_ciclo() no consulte el empleado
+    for emp in empleados:
+        saldos[emp.id].empleado = emp
+    return saldos
+
+
+def construir_datos_calendario(usuario, anios_a_mostrar, semanas=None):
+    """
+    Arma la lista 'departamentos_data' de calendario_global con un número constante de consultas,
+    sin importar la cantidad de empleados:
+    1 empleados, 1-2 saldos, 1 consumo aprobado, 1 vacaciones del rango y 1 vacaciones futuras.
+
+    Si se pasan las 'semanas' visibles (lista plana ordenada), cada empleado incluye además
+    'ocupacion': la fila de celdas precalculadas de la grilla.
+    """
+    fecha_inicio_total = date(anios_a_mostrar[0], 1, 1)
+    fecha_fin_total = date(anios_a_mostrar[-1], 12, 31)
+    hoy = date.today()
+
+    # Año para el saldo (usar el actual o el primero de la lista)
+    anio_saldo = hoy.year if hoy.year in anios_a_mostrar else anios_a_mostrar[0]
+
+    empleados = _empleados_visibles(usuario)
+    if not empleados:
+        return []
+
+    saldos = saldos_por_empleado(empleados, anio_saldo)
+
+    # Consumo "visual" (incluye vacaciones puente que terminan en el ciclo)
+    consumo_visual = dict(
+        RegistroVacaciones.objects.filter(
+            desde_anio('fecha_fin', anio_saldo),
+            empleado__in=empleados,
+            estado=RegistroVacaciones.ESTADO_APROBADA
+        ).values('empleado_id').annotate(total=Sum('dias_solicitados')).values_list('empleado_id', 'total')
+    )
+
+    # Vacaciones en el rango TOTAL (aprobadas y pendientes)
+    vacaciones_por_empleado = defaultdict(list)
+    for vac in RegistroVacaciones.objects.filter(
+        empleado__in=empleados,
+        estado__in=[RegistroVacaciones.ESTADO_APROBADA, RegistroVacaciones.ESTADO_PENDIENTE],
+        fecha_inicio__lte=fecha_fin_total,
+        fecha_fin__gte=fecha_inicio_total
+    ):
+        vacaciones_por_empleado[vac.empleado_id].append(vac)
+
+    # Vacaciones futuras aprobadas (para el selector PDF)
+    futuras_por_empleado = defaultdict(list)
+    for vac in RegistroVacaciones.objects.filter(
+        empleado__in=empleados,
+        estado=RegistroVacaciones.ESTADO_APROBADA,
+        fecha_fin__gte=hoy
+    ).order_by('fecha_inicio'):
+        futuras_por_empleado[vac.empleado_id].append(vac)
+
+    # Agrupar por departamento en memoria (orden por nombre, "sin departamento" al final)
+    grupos = defaultdict(list)
+    departamentos = {}
+    for emp in empleados:
+        saldo = saldos[emp.id]
+        consumido = consumo_visual.get(emp.id) or 0
+        vacaciones = vacaciones_por_empleado.get(emp.id, [])
+
+        grupos[emp.departamento_id].append({
+            'empleado': emp,
+            # Días base del ciclo actual (sin acumulados) - columna "Disponible"
+            'dias_disponibles': saldo.dias_base_ciclo(),
+            # Días acumulados restantes: lo que había menos lo consumido, piso 0
+            'dias_acumulados': max(0, (saldo.dias_adicionales or 0) - consumido),
+            # Días restantes totales - columna "Restan"
+            'dias_restantes': saldo.dias_totales() - consumido,
+            'vacaciones': vacaciones,
+            'vacaciones_futuras': futuras_por_empleado.get(emp.id, []),
+            'ocupacion': calcular_ocupacion_semanal(semanas, vacaciones) if semanas is not None else None,
+        })
+        if emp.departamento_id is not None:
+            departamentos[emp.departamento_id] = emp.departamento
+
+    departamentos_data = [
+        {'departamento': depto, 'empleados': grupos[depto.id]}
+        for depto in sorted(departamentos.values(), key=lambda d: d.nombre)
+    ]
+    if None in grupos:
+        departamentos_data.append({'departamento': None, 'empleados': grupos[None]})
+
+    return departamentos_data
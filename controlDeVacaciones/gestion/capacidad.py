@@ -0,0 +1,245 @@
+import heapq
+import uuid
+from collections import defaultdict, namedtuple
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+from .calendario import _fusionar_intervalos
+from .models import Empleado, RegistroVacaciones
+
+
+# Intervalo de ausencia ya cargado (aprobado o pendiente) de un departamento
+Ausencia = namedtuple('Ausencia', ['id', 'inicio', 'fin', 'nombre', 'apellido', 'estado'])
+
+ESTADOS_OCUPAN = [RegistroVacaciones.ESTADO_APROBADA, RegistroVacaciones.ESTADO_PENDIENTE]
+
+# Cache de líneas de capacidad: una entrada por (departamento, año). Las claves incluyen una versión
+# por departamento y una generación global; invalidar es cambiar la versión (las entradas viejas vencen solas).
+CLAVE_GENERACION = 'capacidad:generacion'
+CLAVE_VERSION = 'capacidad:version:{}'
+# Con cache compartido (REDIS_URL) las invalidaciones llegan a todos los procesos y las líneas pueden durar
+# horas. Con LocMemCache solo llegan al proceso que escribió (los comandos de gestión corren aparte):
+# el TTL corto, igual que el de los feriados, acota cuánto puede verse una línea vieja.
+TTL_LINEA = 60 * 60 * 6 if getattr(settings, 'CACHE_COMPARTIDO', False) else 300
+
+
+class LineaCapacidad:
+    """
+    Personas de un departamento ausentes cada día de un año (vacaciones aprobadas y pendientes).
+    Se arma con un arreglo de diferencias (+1 al inicio, -1 al día siguiente al fin) y su suma acumulada;
+    cada empleado cuenta una sola vez por día aunque tenga pedidos superpuestos.
+    """
+    __slots__ = ('anio', 'ausentes', 'aprobados')
+
+    def __init__(self, anio, intervalos_por_empleado):
+        self.anio = anio
+        inicio_anio = date(anio, 1, 1)
+        largo = (date(anio, 12, 31) - inicio_anio).days + 1
+        self.ausentes = self._acumular(inicio_anio, largo, intervalos_por_empleado, solo_aprobadas=False)
+        self.aprobados = self._acumular(inicio_anio, largo, intervalos_por_empleado, solo_aprobadas=True)
+
+    @staticmethod
+    def _acumular(inicio_anio, largo, intervalos_por_empleado, solo_aprobadas):
+        diferencias = [0] * (largo + 1)
+        for intervalos in intervalos_por_empleado.values():
+            segmentos = _fusionar_intervalos(
+                (inicio, fin) for inicio, fin, estado in intervalos
+                if not solo_aprobadas or estado == RegistroVacaciones.ESTADO_APROBADA
+            )
+            for inicio, fin in segmentos:
+                desde = max((inicio - inicio_anio).days, 0)
+                hasta = min((fin - inicio_anio).days, largo - 1)
+                if desde <= hasta:
+                    diferencias[desde] += 1
+                    diferencias[hasta + 1] -= 1
+        conteos = []
+        actual = 0
+        for delta in diferencias[:largo]:
+            actual += delta
+            conteos.append(actual)
+        return tuple(conteos)
+
+    def _tramo(self, serie, desde, hasta):
+        inicio_anio = date(self.anio, 1, 1)
+        i = max((desde - inicio_anio).days, 0)
+        j = min((hasta - inicio_anio).days, len(serie) - 1)
+        return serie[i:j + 1] if i <= j else ()
+
+    def ausentes_en(self, fecha):
+        return self.ausentes[(fecha - date(self.anio, 1, 1)).days]
+
+    def serie(self, desde, hasta, solo_aprobadas=False):
+        """Ausentes por día en [desde, hasta] (recortado al año de la línea)."""
+        return list(self._tramo(self.aprobados if solo_aprobadas else self.ausentes, desde, hasta))
+
+    def maximo(self, desde, hasta, solo_aprobadas=False):
+        """Pico de ausentes simultáneos en [desde, hasta] (recortado al año de la línea)."""
+        return max(self._tramo(self.aprobados if solo_aprobadas else self.ausentes, desde, hasta), default=0)
+
+
+def _versiones(depto_ids):
+    """Generación global y versión de cada departamento; las que falten se crean con un valor nuevo."""
+    claves = [CLAVE_GENERACION] + [CLAVE_VERSION.format(d) for d in depto_ids]
+    valores = cache.get_many(claves)
+    for clave in claves:
+        if clave not in valores:
+            cache.add(clave, uuid.uuid4().hex, None)
+            valores[clave] = cache.get(clave)
+    return valores[CLAVE_GENERACION], {d: valores[CLAVE_VERSION.format(d)] for d in depto_ids}
+
+
+def invalidar_capacidad(depto_id=None):
+    """
+    Descarta las líneas de un departamento (o de todos, si no se indica).
+    Se llama desde las señales de RegistroVacaciones y Empleado.
+    La versión cambia al confirmarse la transacción: antes, otro pedido podría armar la línea con los
+    datos todavía sin confirmar y guardarla bajo la versión nueva.
+    """
+    clave = CLAVE_GENERACION if depto_id is None else CLAVE_VERSION.format(depto_id)
+    transaction.on_commit(lambda: cache.set(clave, uuid.uuid4().hex, None))
+
+
+def lineas_capacidad(depto_ids, anios):
+    """
+    Devuelve {(depto_id, anio): LineaCapacidad}. Las que no estén en cache se arman juntas
+    con una sola consulta de intervalos.
+    """
+    depto_ids = sorted(set(depto_ids))
+    anios = sorted(set(anios))
+    if not depto_ids or not anios:
+        return {}
+
+    generacion, versiones = _versiones(depto_ids)
+    claves = {
+        (d, a): f'capacidad:{generacion}:{d}:{versiones[d]}:{a}'
+        for d in depto_ids for a in anios
+    }
+    en_cache = cache.get_many(claves.values())
+    lineas = {par: en_cache[clave] for par, clave in claves.items() if clave in en_cache}
+
+    faltantes = [par for par in claves if par not in lineas]
+    if faltantes:
+        deptos_faltantes = {d for d, _ in faltantes}
+        anios_faltantes = {a for _, a in faltantes}
+        intervalos = defaultdict(lambda: defaultdict(list))
+        for depto_id, empleado_id, inicio, fin, estado in RegistroVacaciones.objects.filter(
+            empleado__departamento_id__in=deptos_faltantes,
+            estado__in=ESTADOS_OCUPAN,
+            fecha_inicio__lte=date(max(anios_faltantes), 12, 31),
+            fecha_fin__gte=date(min(anios_faltantes), 1, 1),
+        ).order_by('fecha_inicio', 'fecha_fin').values_list(
+            'empleado__departamento_id', 'empleado_id', 'fecha_inicio', 'fecha_fin', 'estado'
+        ):
+            intervalos[depto_id][empleado_id].append((inicio, fin, estado))
+
+        nuevas = {}
+        for depto_id, anio in faltantes:
+            linea = LineaCapacidad(anio, intervalos.get(depto_id, {}))
+            lineas[(depto_id, anio)] = linea
+            nuevas[claves[(depto_id, anio)]] = linea
+        cache.set_many(nuevas, TTL_LINEA)
+
+    return lineas
+
+
+def pico_ausentes(lineas, depto_id, desde, hasta):
+    """Pico de ausentes simultáneos del departamento en [desde, hasta], aunque el rango cruce años."""
+    return max(
+        (lineas[(depto_id, anio)].maximo(desde, hasta) for anio in range(desde.year, hasta.year + 1)),
+        default=0
+    )
+
+
+def _solapamientos(ausencias, consultas):
+    """
+    Barrido por fecha de inicio: para cada consulta (inicio, fin) devuelve las ausencias que la tocan.
+    'ausencias' y 'consultas' vienen ordenadas por inicio. Un heap por fecha de fin descarta
+    las ausencias que ya terminaron antes de la consulta actual (tampoco tocan a las siguientes),
+    así que cada consulta solo revisa las ausencias activas a esa altura.
+    """
+    resultados = []
+    activas = {}
+    por_fin = []
+    siguiente = 0
+    for inicio, fin in consultas:
+        while siguiente < len(ausencias) and ausencias[siguiente].inicio <= fin:
+            ausencia = ausencias[siguiente]
+            activas[siguiente] = ausencia
+            heapq.heappush(por_fin, (ausencia.fin, siguiente))
+            siguiente += 1
+        while por_fin and por_fin[0][0] < inicio:
+            del activas[heapq.heappop(por_fin)[1]]
+        # Las activas pudieron entrar por una consulta anterior más larga: filtrar por inicio
+        resultados.append([a for _, a in sorted(activas.items()) if a.inicio <= fin])
+    return resultados
+
+
+def analizar_conflictos(solicitudes):
+    """
+    Asistente de conflictos de aprobacion_manager, para toda la lista de una vez.
+    Completa en cada solicitud:
+    - overlap_count / overlap_names: otras vacaciones (aprobadas o pendientes) del mismo departamento
+      que se superponen con el pedido.
+    - capacidad_pct: porcentaje del departamento que seguiría trabajando el peor día del pedido.
+    Usa dos consultas en total (intervalos y dotación por departamento), sin importar la cantidad de pedidos,
+    más una para las líneas de capacidad que no estén en cache.
+    """
+    solicitudes = list(solicitudes)
+    con_depto = [sol for sol in solicitudes if sol.empleado.departamento_id is not None]
+    for sol in solicitudes:
+        sol.overlap_count = 0
+        sol.overlap_names = []
+        sol.capacidad_pct = 100
+    if not con_depto:
+        return solicitudes
+
+    deptos = {sol.empleado.departamento_id for sol in con_depto}
+    desde = min(sol.fecha_inicio for sol in con_depto)
+    hasta = max(sol.fecha_fin for sol in con_depto)
+
+    ausencias_por_depto = defaultdict(list)
+    for fila in RegistroVacaciones.objects.filter(
+        empleado__departamento_id__in=deptos,
+        estado__in=ESTADOS_OCUPAN,
+        fecha_inicio__lte=hasta,
+        fecha_fin__gte=desde,
+    ).order_by('fecha_inicio', 'id').values_list(
+        'empleado__departamento_id', 'id', 'fecha_inicio', 'fecha_fin',
+        'empleado__nombre', 'empleado__apellido', 'estado'
+    ):
+        ausencias_por_depto[fila[0]].append(Ausencia(*fila[1:]))
+
+    dotacion = dict(
+        Empleado.objects.filter(departamento_id__in=deptos)
+        .values('departamento_id').annotate(total=Count('id'))
+        .values_list('departamento_id', 'total')
+    )
+
+    lineas = lineas_capacidad(deptos, range(desde.year, hasta.year + 1))
+
+    solicitudes_por_depto = defaultdict(list)
+    for sol in con_depto:
+        solicitudes_por_depto[sol.empleado.departamento_id].append(sol)
+
+    for depto_id, pedidos in solicitudes_por_depto.items():
+        pedidos.sort(key=lambda s: (s.fecha_inicio, s.fecha_fin))
+        encontrados = _solapamientos(
+            ausencias_por_depto[depto_id], [(s.fecha_inicio, s.fecha_fin) for s in pedidos]
+        )
+        total_equipo = dotacion.get(depto_id, 0)
+        for sol, ausencias in zip(pedidos, encontrados):
+            otras = [a for a in ausencias if a.id != sol.id]
+            sol.overlap_count = len(otras)
+            # Lista de nombres con su estado para el tooltip
+            sol.overlap_names = [f"{a.nombre} {a.apellido} ({a.estado})" for a in otras]
+            if total_equipo > 0:
+                # Peor día del pedido: ausentes simultáneos (aprobados y pendientes, incluido el solicitante)
+                ausentes = max(pico_ausentes(lineas, depto_id, sol.fecha_inicio, sol.fecha_fin), 1)
+                personal_activo = total_equipo - ausentes
+                sol.capacidad_pct = max(int((personal_activo / total_equipo) * 100), 0)
+
+    return solicitudes
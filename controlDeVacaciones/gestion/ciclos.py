@@ -0,0 +1,45 @@
+from datetime import date
+
+from django.db import models
+from django.db.models import Q
+
+
+# Filtros por año/ciclo expresados como rangos de fechas semiabiertos [1/1/año, 1/1/año+1).
+# Comparan la columna directamente, así el motor puede usar los índices por fecha
+# (EXTRACT(YEAR FROM columna) obliga a recorrer todas las filas).
+
+
+class InicioDeAnio(models.Func):
+    """1 de enero del año dado por una expresión entera (p. ej. OuterRef('ciclo')), calculado en la base."""
+    output_field = models.DateField()
+    arity = 1
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='MAKEDATE(%(expressions)s, 1)', **extra_context)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template='MAKE_DATE(%(expressions)s, 1, 1)', **extra_context)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="DATE(%(expressions)s || '-01-01')", **extra_context)
+
+
+def inicio_anio(anio):
+    """date(anio, 1, 1), o su equivalente en SQL si 'anio' es una expresión."""
+    return date(anio, 1, 1) if isinstance(anio, int) else InicioDeAnio(anio)
+
+
+def rango_anio(anio):
+    """(desde, hasta) del año: desde inclusive, hasta exclusive."""
+    return date(anio, 1, 1), date(anio + 1, 1, 1)
+
+
+def en_anio(campo, anio):
+    """Q equivalente a campo__year=anio."""
+    desde, hasta = rango_anio(anio)
+    return Q(**{f'{campo}__gte': desde, f'{campo}__lt': hasta})
+
+
+def desde_anio(campo, anio):
+    """Q equivalente a campo__year__gte=anio (acepta también OuterRef/F para subconsultas por ciclo)."""
+    return Q(**{f'{campo}__gte': inicio_anio(anio)})
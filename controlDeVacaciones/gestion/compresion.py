@@ -0,0 +1,85 @@
+from functools import wraps
+
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+# brotli es opcional: si el módulo está instalado se ofrece 'br', si no solo gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Por debajo de este tamaño comprimir no compensa (mismo umbral que GZipMiddleware de Django)
+MINIMO_BYTES = 200
+
+
+def codificaciones_aceptadas(accept_encoding):
+    """Codificaciones del header Accept-Encoding, descartando las marcadas con q=0."""
+    aceptadas = set()
+    for parte in accept_encoding.lower().split(','):
+        nombre, _, parametros = parte.partition(';')
+        nombre = nombre.strip()
+        if not nombre:
+            continue
+        calidad = parametros.strip()
+        if calidad.startswith('q='):
+            try:
+                if float(calidad[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        aceptadas.add(nombre)
+    return aceptadas
+
+
+def elegir_codificacion(accept_encoding):
+    """'br' si el cliente lo acepta y brotli está instalado; si no 'gzip'; None si no acepta ninguna."""
+    aceptadas = codificaciones_aceptadas(accept_encoding)
+    if brotli is not None and 'br' in aceptadas:
+        return 'br'
+    if 'gzip' in aceptadas:
+        return 'gzip'
+    return None
+
+
+def comprimir(contenido, codificacion):
+    if codificacion == 'br':
+        return brotli.compress(contenido)
+    return compress_string(contenido)
+
+
+def comprimir_respuesta(vista):
+    """
+    Decorador de vistas JSON: comprime la respuesta con brotli o gzip según Accept-Encoding.
+    Se aplica solo a las vistas que lo piden (no es middleware) para no tocar las páginas con
+    tokens CSRF ni las descargas en streaming. Los 304 pasan sin cambios.
+    """
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        respuesta = vista(request, *args, **kwargs)
+        if respuesta.streaming or respuesta.has_header('Content-Encoding'):
+            return respuesta
+
+        patch_vary_headers(respuesta, ('Accept-Encoding',))
+        if respuesta.status_code != 200 or len(respuesta.content) < MINIMO_BYTES:
+            return respuesta
+
+        codificacion = elegir_codificacion(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if codificacion is None:
+            return respuesta
+
+        comprimido = comprimir(respuesta.content, codificacion)
+        if len(comprimido) >= len(respuesta.content):
+            return respuesta
+
+        respuesta.content = comprimido
+        respuesta['Content-Length'] = str(len(comprimido))
+        respuesta['Content-Encoding'] = codificacion
+        # El cuerpo ya no es byte a byte el de la huella: el ETag pasa a ser débil (como hace GZipMiddleware)
+        etag = respuesta.get('ETag')
+        if etag and etag.startswith('"'):
+            respuesta['ETag'] = 'W/' + etag
+        return respuesta
+
+    return envoltura
@@ -1,43 +1,32 @@
-from .models import Notificacion, RegistroVacaciones
+from django.utils.functional import SimpleLazyObject
+
+from .notificaciones import resumen_cacheado
+
+RESUMEN_VACIO = {'no_leidas': 0, 'tareas_pendientes': 0, 'last_id': 0}
 
 def notificaciones_context(request):
-    if request.user.is_authenticated:
-        # Notificaciones de sistema
-        notif_qs = request.user.notificaciones.filter(leida=False)
-        notif_count = notif_qs.count()
-        
-        # Tareas pendientes (solo para managers)
-        tareas_pendientes = 0
-        if hasattr(request.user, 'empleado') and request.user.empleado.es_manager:
-            from django.db.models import Q
-            # Si es superusuario (Administrador), ve TODAS las solicitudes pendientes de la empresa
-            if request.user.is_superuser:
-                filter_q = Q() 
-            else:
-                # Si no es superusuario, SOLO ve las que tiene asignadas directamente a él
-                filter_q = Q(manager_aprobador=request.user.empleado)
-                
-            tareas_pendientes = RegistroVacaciones.objects.filter(
-                filter_q,
-                estado=RegistroVacaciones.ESTADO_PENDIENTE
-            ).count()
+    """
+    Variables de la campana del navbar. Son todas perezosas: el resumen (cache o base) se carga
+    recién cuando un template usa alguna, así que los renders que no muestran el navbar no pagan nada.
+    """
+    def cargar_resumen():
+        if not request.user.is_authenticated:
+            return RESUMEN_VACIO
+        # Contadores desde el resumen cacheado por usuario (invalidado por señales)
+        return resumen_cacheado(request.user)[1]
+
+    resumen = SimpleLazyObject(cargar_resumen)
+
+    def ultimas_notificaciones():
+        # Traer las últimas 5 para el dropdown rápido (solo si hay no leídas)
+        if not resumen['no_leidas']:
+            return []
+        return list(request.user.notificaciones.filter(leida=False)[:5])
 
-        # Traer las últimas 5 para el dropdown rápido
-        ultimas_notif = notif_qs[:5]
-        
-        # ID de la última notificación para el polling
-        last_notif = request.user.notificaciones.order_by('-id').first()
-        notif_last_id = last_notif.id if last_notif else 0
-        
-        return {
-            'notif_count': notif_count + tareas_pendientes,
-            'notif_list_preview': ultimas_notif,
-            'tareas_pendientes_count': tareas_pendientes,
-            'notif_last_id': notif_last_id
-        }
     return {
-        'notif_count': 0,
-        'notif_list_preview': [],
-        'tareas_pendientes_count': 0
+        'notif_count': SimpleLazyObject(lambda: resumen['no_leidas'] + resumen['tareas_pendientes']),
+        'notif_list_preview': SimpleLazyObject(ultimas_notificaciones),
+        'tareas_pendientes_count': SimpleLazyObject(lambda: resumen['tareas_pendientes']),
+        # ID de la última notificación para el long-poll
+        'notif_last_id': SimpleLazyObject(lambda: resumen['last_id']),
     }
-
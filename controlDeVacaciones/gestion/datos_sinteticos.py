@@ -0,0 +1,177 @@
+import random
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from .capacidad import invalidar_capacidad
+from .dias_habiles import invalidar_festivos
+from .models import (
+    ConsumoVacaciones, Departamento, DiasFestivos, Empleado, Notificacion, RegistroVacaciones, SaldoVacaciones
+)
+from .notificaciones import avisar_notificaciones, avisar_tareas
+
+
+# Todo lo generado lleva estas marcas, así se puede borrar sin tocar los datos reales
+PREFIJO_USUARIO = 'sint_'
+PREFIJO_DNI = 'SINT-'
+PREFIJO_TEXTO = 'SINT '
+USUARIO_ADMIN = 'sint_admin'
+CLAVE_USUARIOS = 'sintetico'
+
+# Feriados fijos de cada año (mes, día); se suman algunos móviles al azar
+FERIADOS_FIJOS = [(1, 1), (3, 24), (4, 2), (5, 1), (5, 25), (6, 20), (7, 9), (12, 8), (12, 25)]
+
+
+def _estado_al_azar(azar, anio, anio_actual):
+    """Años pasados casi todo aprobado; el año en curso y los siguientes con pendientes."""
+    tirada = azar.random()
+    if anio < anio_actual:
+        if tirada < 0.8:
+            return RegistroVacaciones.ESTADO_APROBADA
+        return RegistroVacaciones.ESTADO_RECHAZADA if tirada < 0.9 else RegistroVacaciones.ESTADO_CANCELADA
+    if tirada < 0.55:
+        return RegistroVacaciones.ESTADO_APROBADA
+    if tirada < 0.85:
+        return RegistroVacaciones.ESTADO_PENDIENTE
+    return RegistroVacaciones.ESTADO_RECHAZADA if tirada < 0.95 else RegistroVacaciones.ESTADO_CANCELADA
+
+
+def _rangos_sin_solape(azar, anio, cantidad):
+    """Hasta 'cantidad' rangos (inicio, fin) del año que no se pisan entre sí."""
+    rangos = []
+    for _ in range(cantidad * 3):
+        if len(rangos) == cantidad:
+            break
+        inicio = date(anio, 1, 1) + timedelta(days=azar.randrange(350))
+        fin = inicio + timedelta(days=azar.choice([0, 2, 4, 6, 9, 13]))
+        if fin.year == anio and all(fin < i or inicio > f for i, f in rangos):
+            rangos.append((inicio, fin))
+    return sorted(rangos)
+
+
+def generar_dataset(departamentos=10, empleados=300, anios=3, solicitudes_por_anio=3,
+                    notificaciones_por_usuario=30, semilla=1):
+    """
+    Crea un set de datos sintético y realista: departamentos con su manager, empleados con usuario,
+    saldos y vacaciones de los últimos 'anios' años (más el siguiente), feriados, notificaciones y
+    el libro de consumos coherente con lo aprobado. Todo se escribe con bulk_create, así que al final
+    se invalidan a mano los caches que normalmente mantienen las señales.
+    Devuelve un dict con la cantidad de filas creadas por tabla.
+    """
+    azar = random.Random(semilla)
+    anio_actual = date.today().year
+    lista_anios = list(range(anio_actual - anios + 1, anio_actual + 2))
+    clave = make_password(CLAVE_USUARIOS)  # un solo hash para todos: make_password es caro a propósito
+
+    with transaction.atomic():
+        # bulk_create no devuelve ids en MySQL: las filas base se releen por su marca
+        Departamento.objects.bulk_create(
+            [Departamento(nombre=f'{PREFIJO_TEXTO}Depto {i + 1}') for i in range(departamentos)]
+        )
+        deptos = list(Departamento.objects.filter(nombre__startswith=PREFIJO_TEXTO).order_by('id'))
+
+        User.objects.bulk_create(
+            [User(username=USUARIO_ADMIN, password=clave, is_superuser=True, is_staff=True,
+                  email='admin@sintetico.test')]
+            + [User(username=f'{PREFIJO_USUARIO}{i}', password=clave, email=f'empleado{i}@sintetico.test')
+               for i in range(empleados)]
+        )
+        usuarios = {u.username: u for u in User.objects.filter(username__startswith=PREFIJO_USUARIO)}
+
+        # El primer empleado de cada departamento es su manager
+        nuevos = [Empleado(
+            user=usuarios[USUARIO_ADMIN], legajo='SINADMIN', dni=f'{PREFIJO_DNI}ADMIN', nombre='Admin',
+            apellido='Sintético', fecha_ingreso=date(2005, 1, 1), es_manager=True, primer_login=False
+        )]
+        for i in range(empleados):
+            nuevos.append(Empleado(
+                user=usuarios[f'{PREFIJO_USUARIO}{i}'], legajo=f'SIN{i:05d}', dni=f'{PREFIJO_DNI}{i}',
+                nombre=azar.choice(['Ana', 'Juan', 'Lucía', 'Martín', 'Sofía', 'Diego', 'Carla', 'Pablo']),
+                apellido=f'Empleado {i}', departamento=deptos[i % len(deptos)],
+                fecha_ingreso=date(2000, 1, 1) + timedelta(days=azar.randrange(365 * 22)),
+                es_manager=i < len(deptos), primer_login=False
+            ))
+        Empleado.objects.bulk_create(nuevos)
+        plantel = list(Empleado.objects.filter(dni__startswith=PREFIJO_DNI).exclude(legajo='SINADMIN').order_by('id'))
+        managers = {e.departamento_id: e for e in plantel if e.es_manager}
+        for empleado in plantel:
+            if not empleado.es_manager:
+                empleado.manager_aprobador = managers[empleado.departamento_id]
+        Empleado.objects.bulk_update(plantel, ['manager_aprobador'], batch_size=1000)
+
+        saldos = []
+        registros = []
+        aprobados = defaultdict(list)  # empleado_id -> [(anio de inicio, días)]
+        for empleado in plantel:
+            for anio in lista_anios:
+                saldos.append(SaldoVacaciones(
+                    empleado=empleado, ciclo=anio, dias_iniciales=empleado.dias_base_lct(anio),
+                    dias_adicionales=azar.choice([0, 0, 0, 2, 5])
+                ))
+                for inicio, fin in _rangos_sin_solape(azar, anio, solicitudes_por_anio):
+                    estado = _estado_al_azar(azar, anio, anio_actual)
+                    dias = (fin - inicio).days + 1
+                    registros.append(RegistroVacaciones(
+                        empleado=empleado, fecha_inicio=inicio, fecha_fin=fin, dias_solicitados=dias,
+                        estado=estado, fecha_solicitud=inicio - timedelta(days=azar.randint(15, 60)),
+                        fecha_aprobacion=inicio - timedelta(days=10) if estado == RegistroVacaciones.ESTADO_APROBADA else None,
+                        manager_aprobador=empleado.manager_aprobador
+                    ))
+                    if estado == RegistroVacaciones.ESTADO_APROBADA:
+                        aprobados[empleado.id].append((anio, dias))
+        SaldoVacaciones.objects.bulk_create(saldos, batch_size=1000)
+        RegistroVacaciones.objects.bulk_create(registros, batch_size=1000)
+
+        # Libro de consumos igual al que dejaría save(): lo aprobado desde cada ciclo en adelante
+        ConsumoVacaciones.objects.bulk_create([
+            ConsumoVacaciones(
+                empleado_id=empleado.id, ciclo=ciclo,
+                dias_consumidos=sum(dias for anio, dias in aprobados[empleado.id] if anio >= ciclo)
+            )
+            for empleado in plantel for ciclo in lista_anios
+        ], batch_size=1000)
+
+        festivos = []
+        for anio in lista_anios:
+            fechas = {date(anio, mes, dia) for mes, dia in FERIADOS_FIJOS}
+            fechas.update(date(anio, 1, 1) + timedelta(days=azar.randrange(365)) for _ in range(5))
+            festivos.extend(DiasFestivos(fecha=f, descripcion=f'{PREFIJO_TEXTO}Feriado') for f in sorted(fechas))
+        DiasFestivos.objects.bulk_create(festivos, ignore_conflicts=True)
+
+        Notificacion.objects.bulk_create([
+            Notificacion(
+                usuario=usuario, titulo='Novedad de vacaciones', mensaje='Notificación generada para pruebas de carga.',
+                leida=azar.random() < 0.8, url='gestion:historial_personal'
+            )
+            for usuario in usuarios.values() for _ in range(notificaciones_por_usuario)
+        ], batch_size=1000)
+
+    invalidar_capacidad()
+    invalidar_festivos()
+    avisar_tareas()
+    avisar_notificaciones([u.id for u in usuarios.values()])
+
+    return {
+        'departamentos': len(deptos),
+        'empleados': len(plantel) + 1,
+        'saldos': len(saldos),
+        'registros': len(registros),
+        'festivos': len(festivos),
+        'notificaciones': len(usuarios) * notificaciones_por_usuario,
+    }
+
+
+def existe_dataset():
+    return User.objects.filter(username=USUARIO_ADMIN).exists()
+
+
+def limpiar_dataset():
+    """Borra todo lo generado por generar_dataset() (las señales se ocupan de los caches)."""
+    with transaction.atomic():
+        Empleado.objects.filter(dni__startswith=PREFIJO_DNI).delete()
+        User.objects.filter(username__startswith=PREFIJO_USUARIO).delete()
+        Departamento.objects.filter(nombre__startswith=PREFIJO_TEXTO).delete()
+        DiasFestivos.objects.filter(descripcion__startswith=PREFIJO_TEXTO).delete()
@@ -0,0 +1,104 @@
+import threading
+import time
+from datetime import date
+
+from .models import DiasFestivos
+
+
+# Segundos que un año de festivos cargado se considera vigente. Las altas y bajas de este
+# proceso invalidan al instante (señales); el TTL cubre los cambios hechos por otros workers.
+TTL_FESTIVOS = 300
+
+# {anio: (bitmap, cargado_en)}. Bit i encendido = el día i del año (0 = 1 de enero)
+# es feriado y cae de lunes a viernes (los feriados en fin de semana no restan nada).
+_festivos_por_anio = {}
+_lock = threading.Lock()
+
+
+def invalidar_festivos():
+    """Descarta todos los años cacheados (se llama al guardar o borrar un DiasFestivos)."""
+    with _lock:
+        _festivos_por_anio.clear()
+
+
+def _bitmaps_de(anios):
+    """
+    Devuelve {anio: bitmap} para los años pedidos.
+    Los que falten (o hayan vencido) en el cache se cargan juntos en una sola consulta.
+    """
+    ahora = time.monotonic()
+    vigentes = {}
+    with _lock:
+        for anio in set(anios):
+            entrada = _festivos_por_anio.get(anio)
+            if entrada and ahora - entrada[1] <= TTL_FESTIVOS:
+                vigentes[anio] = entrada[0]
+    faltantes = sorted(set(anios) - set(vigentes))
+    if not faltantes:
+        return vigentes
+
+    bitmaps = dict.fromkeys(faltantes, 0)
+    for fecha in DiasFestivos.objects.filter(
+        fecha__range=(date(faltantes[0], 1, 1), date(faltantes[-1], 12, 31))
+    ).values_list('fecha', flat=True):
+        if fecha.year in bitmaps and fecha.weekday() < 5:
+            bitmaps[fecha.year] |= 1 << (fecha.timetuple().tm_yday - 1)
+
+    with _lock:
+        for anio, bitmap in bitmaps.items():
+            _festivos_por_anio[anio] = (bitmap, ahora)
+    vigentes.update(bitmaps)
+    return vigentes
+
+
+def _dias_semana(fecha_inicio, fecha_fin):
+    """Días de lunes a viernes en [fecha_inicio, fecha_fin]: semanas completas más el resto."""
+    semanas, resto = divmod((fecha_fin - fecha_inicio).days + 1, 7)
+    primero = fecha_inicio.weekday()
+    return semanas * 5 + sum(1 for i in range(resto) if (primero + i) % 7 < 5)
+
+
+def _festivos_en_rango(bitmaps, fecha_inicio, fecha_fin):
+    """Feriados de lunes a viernes dentro del rango, contando bits del bitmap de cada año."""
+    total = 0
+    for anio in range(fecha_inicio.year, fecha_fin.year + 1):
+        bitmap = bitmaps[anio]
+        if not bitmap:
+            continue
+        desde = fecha_inicio.timetuple().tm_yday - 1 if anio == fecha_inicio.year else 0
+        hasta = fecha_fin.timetuple().tm_yday - 1 if anio == fecha_fin.year else 365
+        mascara = (1 << (hasta - desde + 1)) - 1
+        total += bin((bitmap >> desde) & mascara).count('1')
+    return total
+
+
+def contar_dias_habiles(fecha_inicio, fecha_fin):
+    """
+    Días hábiles entre dos fechas (inclusive), excluyendo sábados, domingos y feriados.
+    Devuelve 0 si el rango está invertido.
+    """
+    return contar_dias_habiles_lote([(fecha_inicio, fecha_fin)])[0]
+
+
+def contar_dias_habiles_lote(rangos):
+    """
+    Versión en lote de contar_dias_habiles: recibe una lista de (fecha_inicio, fecha_fin)
+    y devuelve la lista de días hábiles en el mismo orden.
+    Los feriados de todos los años involucrados se cargan con a lo sumo una consulta.
+    """
+    rangos = list(rangos)
+    anios = set()
+    for fecha_inicio, fecha_fin in rangos:
+        if fecha_inicio <= fecha_fin:
+            anios.update(range(fecha_inicio.year, fecha_fin.year + 1))
+    bitmaps = _bitmaps_de(anios)
+
+    resultados = []
+    for fecha_inicio, fecha_fin in rangos:
+        if fecha_inicio > fecha_fin:
+            resultados.append(0)
+        else:
+            resultados.append(
+                _dias_semana(fecha_inicio, fecha_fin) - _festivos_en_rango(bitmaps, fecha_inicio, fecha_fin)
+            )
+    return resultados
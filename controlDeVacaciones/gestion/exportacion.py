@@ -0,0 +1,239 @@
+import logging
+import os
+import tempfile
+from collections import defaultdict
+from datetime import date
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.image import Image
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+from .calendario import saldos_por_empleado, calcular_ocupacion_semanal
+from .models import Empleado, RegistroVacaciones
+
+logger = logging.getLogger(__name__)
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Columnas fijas: Empleado, Disponible, Acumuladas, Restan. Las semanas empiezan en la 5.
+COL_OFFSET = 5
+HEADER_START_ROW = 5
+CHUNK_SIZE = 64 * 1024
+
+
+def _registrar_estilos(wb):
+    """
+    Registra los estilos con nombre del calendario.
+    Cada celda referencia el estilo por nombre, en lugar de crear un Font/Border propio.
+    """
+    borde = Side(style='thin', color='000000')
+    thin_border = Border(left=borde, right=borde, top=borde, bottom=borde)
+    center_align = Alignment(horizontal="center", vertical="center")
+    left_align = Alignment(horizontal="left", vertical="center")
+
+    def relleno(color):
+        return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+    estilos = [
+        NamedStyle('cal_titulo', font=Font(bold=True, size=14), alignment=left_align),
+        NamedStyle('cal_subtitulo', font=Font(bold=True, size=11), alignment=left_align),
+        NamedStyle('cal_header', fill=relleno("764ba2"), font=Font(bold=True, color="FFFFFF", size=11),
+                   alignment=center_align, border=thin_border),
+        NamedStyle('cal_semana', fill=relleno("c2e9fb"), font=Font(bold=True, color="2c3e50", size=7),
+                   alignment=Alignment(horizontal="center", vertical="center", wrap_text=True), border=thin_border),
+        NamedStyle('cal_depto', fill=relleno("f5576c"), font=Font(bold=True, color="FFFFFF", size=10),
+                   alignment=left_align, border=thin_border),
+        NamedStyle('cal_empleado', fill=relleno("fcb69f"), font=Font(bold=False, color="2c3e50", size=10),
+                   alignment=left_align, border=thin_border),
+        NamedStyle('cal_disponible', fill=relleno("fdcb6e"), font=Font(bold=True, color="2c3e50"),
+                   alignment=center_align, border=thin_border),
+        NamedStyle('cal_acumuladas', fill=relleno("56ab2f"), font=Font(bold=True, color="FFFFFF"),
+                   alignment=center_align, border=thin_border),
+        NamedStyle('cal_restan', fill=relleno("9b59b6"), font=Font(bold=True, color="FFFFFF"),
+                   alignment=center_align, border=thin_border),
+        NamedStyle('cal_celda', alignment=center_align, border=thin_border),
+        NamedStyle('cal_aprobada', fill=relleno("38ef7d"), font=Font(bold=True, color="000000"),
+                   alignment=center_align, border=thin_border),
+        NamedStyle('cal_pendiente', fill=relleno("ffd93d"), font=Font(bold=True, color="000000"),
+                   alignment=center_align, border=thin_border),
+        NamedStyle('cal_total_label', fill=relleno("ecf0f1"), font=Font(bold=True, color="2c3e50"),
+                   alignment=Alignment(horizontal="right", vertical="center"), border=thin_border),
+        NamedStyle('cal_total', fill=relleno("ecf0f1"), font=Font(bold=True, color="2c3e50"),
+                   alignment=center_align, border=thin_border),
+    ]
+    for estilo in estilos:
+        wb.add_named_style(estilo)
+
+
+def _celda(ws, valor, estilo):
+    cell = WriteOnlyCell(ws, value=valor)
+    cell.style = estilo
+    return cell
+
+
+def _insertar_logo(ws):
+    # Usamos la misma ruta que en el PDF
+    logo_path = os.path.join(settings.BASE_DIR.parent, 'gestion', 'imagenes', 'logo', 'logo.png')
+    if not os.path.exists(logo_path):
+        logo_path = os.path.join(settings.BASE_DIR.parent, 'gestion', 'imagenes', 'logo', 'logo.jpg')
+
+    if os.path.exists(logo_path):
+        try:
+            img = Image(logo_path)
+            img.width = 220
+            img.height = 50
+            ws.add_image(img, 'A1')
+        except Exception as e:
+            logger.error(f"Error al insertar logo en Excel: {e}")
+
+
+def _filas_empleados(ws, semanas, anios_a_mostrar, totales_por_columna):
+    """
+    Genera, departamento por departamento, las filas (fila, es_departamento) ya estilizadas.
+    Los datos se cargan en bloque (consultas constantes) y cada fila se arma recién
+    cuando el worksheet la pide, así que no se guardan celdas en memoria.
+    """
+    fecha_inicio_total = date(anios_a_mostrar[0], 1, 1)
+    fecha_fin_total = date(anios_a_mostrar[-1], 12, 31)
+    anio_saldo = date.today().year if date.today().year in anios_a_mostrar else anios_a_mostrar[0]
+
+    empleados = list(
+        Empleado.objects.filter(departamento__isnull=False)
+        .select_related('departamento')
+        .order_by('departamento__nombre', 'apellido', 'nombre')
+    )
+    if not empleados:
+        return
+
+    saldos = saldos_por_empleado(empleados, anio_saldo, con_balances=True)
+
+    vacaciones_por_empleado = defaultdict(list)
+    for vac in RegistroVacaciones.objects.filter(
+        empleado__in=empleados,
+        estado__in=[RegistroVacaciones.ESTADO_APROBADA, RegistroVacaciones.ESTADO_PENDIENTE],
+        fecha_inicio__lte=fecha_fin_total,
+        fecha_fin__gte=fecha_inicio_total
+    ).only('empleado', 'fecha_inicio', 'fecha_fin', 'estado'):
+        vacaciones_por_empleado[vac.empleado_id].append(vac)
+
+    depto_actual = None
+    for emp in empleados:
+        if emp.departamento_id != depto_actual:
+            depto_actual = emp.departamento_id
+            yield [_celda(ws, emp.departamento.nombre.upper(), 'cal_depto')], True
+
+        saldo = saldos[emp.id]
+
+        fila = [
+            _celda(ws, f"{emp.apellido}, {emp.nombre}", 'cal_empleado'),
+            _celda(ws, saldo.dias_base_ciclo(), 'cal_disponible'),
+            _celda(ws, saldo.dias_acumulados_restantes(), 'cal_acumuladas'),
+            _celda(ws, saldo.total_disponible(), 'cal_restan'),
+        ]
+
+        celdas = calcular_ocupacion_semanal(semanas, vacaciones_por_empleado.pop(emp.id, []))
+        for indice, celda in enumerate(celdas):
+            if celda.estado == 'aprobada':
+                fila.append(_celda(ws, celda.dias, 'cal_aprobada'))
+                totales_por_columna[indice] += 1
+            elif celda.estado == 'pendiente':
+                fila.append(_celda(ws, celda.dias, 'cal_pendiente'))
+                totales_por_columna[indice] += 1
+            else:
+                fila.append(_celda(ws, None, 'cal_celda'))
+        yield fila, False
+
+
+def _escribir_hoja(wb, anio_param, anios_a_mostrar, meses_globales):
+    ws = wb.create_sheet(title=f"Calendario {anio_param}")
+    semanas = [semana for mes in meses_globales for semana in mes.semanas]
+
+    # En modo write-only, anchos de columna y alto de filas van antes de la primera fila
+    ws.column_dimensions['A'].width = 30
+    for letra in 'BCD':
+        ws.column_dimensions[letra].width = 12
+    for col in range(COL_OFFSET, COL_OFFSET + len(semanas)):
+        ws.column_dimensions[get_column_letter(col)].width = 5
+    ws.row_dimensions[HEADER_START_ROW + 1].height = 35
+
+    # === ENCABEZADO CORPORATIVO ===
+    _insertar_logo(ws)
+    ws.merged_cells.add("E2:O2")
+    ws.merged_cells.add("E3:O3")
+    ws.append([])
+    ws.append([None] * 4 + [_celda(ws, f"Planilla de VACACIONES CICLO {anio_param}", 'cal_titulo')])
+    ws.append([None] * 4 + [_celda(ws, f"PLANILLA ENTREGADA {date.today().strftime('%d-%m-%y')}", 'cal_subtitulo')])
+    ws.append([])
+
+    # FILA DE MESES: columnas fijas combinadas verticalmente
+    for col in range(1, COL_OFFSET):
+        letra = get_column_letter(col)
+        ws.merged_cells.add(f"{letra}{HEADER_START_ROW}:{letra}{HEADER_START_ROW + 1}")
+    fila_meses = [_celda(ws, titulo, 'cal_header') for titulo in ("Empleado", "Disponible", "Acumuladas", "Restan")]
+    current_col = COL_OFFSET
+    for mes in meses_globales:
+        num_semanas = len(mes.semanas)
+        if num_semanas > 0:
+            ws.merged_cells.add(
+                f"{get_column_letter(current_col)}{HEADER_START_ROW}:"
+                f"{get_column_letter(current_col + num_semanas - 1)}{HEADER_START_ROW}"
+            )
+            fila_meses.append(_celda(ws, mes.nombre, 'cal_header'))
+            fila_meses.extend([None] * (num_semanas - 1))
+            current_col += num_semanas
+    ws.append(fila_meses)
+
+    # FILA DE SEMANAS
+    ws.append([None] * (COL_OFFSET - 1) + [_celda(ws, semana.rango, 'cal_semana') for semana in semanas])
+
+    # FILAS DE EMPLEADOS (se escriben a medida que se generan)
+    ultima_columna = get_column_letter(COL_OFFSET + len(semanas) - 1)
+    current_row = HEADER_START_ROW + 2
+    totales_por_columna = [0] * len(semanas)
+    for fila, es_departamento in _filas_empleados(ws, semanas, anios_a_mostrar, totales_por_columna):
+        if es_departamento:
+            ws.merged_cells.add(f"A{current_row}:{ultima_columna}{current_row}")
+        ws.append(fila)
+        current_row += 1
+
+    # --- FILA DE TOTALES POR SEMANA ---
+    ws.merged_cells.add(f"A{current_row}:D{current_row}")
+    ws.append(
+        [_celda(ws, "TOTAL PERSONAS EN VACACIONES", 'cal_total_label')] + [None] * (COL_OFFSET - 2)
+        + [_celda(ws, total, 'cal_total') for total in totales_por_columna]
+    )
+
+
+def _leer_en_bloques(archivo):
+    try:
+        archivo.seek(0)
+        while True:
+            bloque = archivo.read(CHUNK_SIZE)
+            if not bloque:
+                break
+            yield bloque
+    finally:
+        archivo.close()
+
+
+def exportar_calendario_stream(anio_param, anios_a_mostrar, meses_globales):
+    """
+    Genera el Excel del calendario con un workbook write-only y lo devuelve como StreamingHttpResponse.
+    Las filas se vuelcan al XML temporal de openpyxl a medida que se calculan y el archivo final
+    se envía en bloques, así que la memoria no depende de la cantidad de empleados.
+    """
+    wb = Workbook(write_only=True)
+    _registrar_estilos(wb)
+    _escribir_hoja(wb, anio_param, anios_a_mostrar, meses_globales)
+
+    archivo = tempfile.TemporaryFile()
+    wb.save(archivo)
+
+    response = StreamingHttpResponse(_leer_en_bloques(archivo), content_type=XLSX_CONTENT_TYPE)
+    response['Content-Length'] = archivo.tell()
+    response['Content-Disposition'] = f'attachment; filename="calendario_vacaciones_{anio_param}.xlsx"'
+    return response
@@ -0,0 +1,103 @@
+import statistics
+import time
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from gestion.datos_sinteticos import PREFIJO_DNI, USUARIO_ADMIN, existe_dataset, generar_dataset
+from gestion.models import Empleado, Notificacion, RegistroVacaciones
+
+
+class Command(BaseCommand):
+    help = (
+        'Muestra el plan (EXPLAIN) y la latencia de las consultas más usadas sobre RegistroVacaciones y '
+        'Notificacion, con un set de datos sintético que se descarta al terminar. Para comparar antes/después '
+        'de los índices compuestos: correr, "migrate gestion 0010", correr de nuevo y volver a "migrate".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--empleados', type=int, default=500, help='Empleados sintéticos (default: 500).')
+        parser.add_argument('--anios', type=int, default=5, help='Años de historia (default: 5).')
+        parser.add_argument('--solicitudes', type=int, default=6, help='Solicitudes por empleado y año (default: 6).')
+        parser.add_argument('--notificaciones', type=int, default=200, help='Notificaciones por usuario (default: 200).')
+        parser.add_argument('--repeticiones', type=int, default=30, help='Ejecuciones por consulta (default: 30).')
+        parser.add_argument('--semilla', type=int, default=1, help='Semilla del generador, para repetir el mismo set.')
+        parser.add_argument(
+            '--analizar', action='store_true',
+            help='EXPLAIN ANALYZE (ejecuta la consulta; MySQL 8.0.18+ / PostgreSQL).'
+        )
+
+    def handle(self, *args, **options):
+        if existe_dataset():
+            raise CommandError('Hay datos sintéticos cargados (generar_datos_sinteticos): borralos con --limpiar antes.')
+        # Todo dentro de una transacción que se revierte: la base queda como estaba
+        with transaction.atomic():
+            muestra = self._generar_datos(options)
+            totales = muestra['totales']
+            self.stdout.write(
+                f"Datos sintéticos: {totales['empleados']} empleados, {totales['registros']} solicitudes, "
+                f"{totales['notificaciones']} notificaciones ({connection.vendor})."
+            )
+            for nombre, queryset, ejecutar in self._consultas(muestra):
+                self._medir(nombre, queryset, ejecutar, options)
+            transaction.set_rollback(True)
+
+    def _generar_datos(self, options):
+        totales = generar_dataset(
+            departamentos=max(options['empleados'] // 25, 1),
+            empleados=options['empleados'],
+            anios=options['anios'],
+            solicitudes_por_anio=options['solicitudes'],
+            notificaciones_por_usuario=options['notificaciones'],
+            semilla=options['semilla'],
+        )
+        usuario = User.objects.get(username=USUARIO_ADMIN)
+        empleados = Empleado.objects.filter(dni__startswith=PREFIJO_DNI)
+        return {
+            'totales': totales,
+            'empleado': empleados.filter(es_manager=False).order_by('id').first(),
+            'manager': empleados.filter(es_manager=True, departamento__isnull=False).order_by('id').first(),
+            'usuario': usuario,
+            'ultima_notificacion': usuario.notificaciones.order_by('-id').values_list('id', flat=True).first(),
+        }
+
+    def _consultas(self, muestra):
+        """(nombre, queryset, cómo ejecutarlo) de los caminos calientes."""
+        anio = date.today().year - 1
+        empleado = muestra['empleado']
+        usuario = muestra['usuario']
+        aprobadas_en_anio = RegistroVacaciones.objects.filter(
+            empleado=empleado, estado=RegistroVacaciones.ESTADO_APROBADA,
+            fecha_inicio__lte=date(anio, 12, 31), fecha_fin__gte=date(anio, 1, 1)
+        )
+        pendientes_manager = RegistroVacaciones.objects.filter(
+            estado=RegistroVacaciones.ESTADO_PENDIENTE, manager_aprobador=muestra['manager']
+        ).order_by('-fecha_solicitud')
+        no_leidas = Notificacion.objects.filter(usuario=usuario, leida=False).order_by()
+        nuevas = Notificacion.objects.filter(
+            usuario=usuario, id__gt=muestra['ultima_notificacion'] - 20
+        ).order_by('id')
+        return [
+            ('Aprobadas de un empleado en un año', aprobadas_en_anio, list),
+            ('Pendientes de un manager', pendientes_manager, list),
+            ('No leídas de un usuario (count)', no_leidas, lambda qs: qs.count()),
+            ('Notificaciones nuevas desde un id', nuevas, list),
+        ]
+
+    def _medir(self, nombre, queryset, ejecutar, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n{nombre}'))
+        self.stdout.write(queryset.explain(analyze=True) if options['analizar'] else queryset.explain())
+
+        tiempos = []
+        for _ in range(options['repeticiones']):
+            inicio = time.perf_counter()
+            # queryset.all(): sin resultados cacheados del queryset entre repeticiones
+            ejecutar(queryset.all())
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        tiempos.sort()
+        p95 = tiempos[min(int(len(tiempos) * 0.95), len(tiempos) - 1)]
+        self.stdout.write(self.style.SUCCESS(
+            f'mediana {statistics.median(tiempos):.2f} ms | p95 {p95:.2f} ms | {len(tiempos)} ejecuciones'
+        ))
@@ -0,0 +1,121 @@
+import json
+import statistics
+import time
+import tracemalloc
+from datetime import date
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from gestion.datos_sinteticos import USUARIO_ADMIN
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide las vistas principales con el cliente de pruebas de Django (latencia p50/p90/p95/p99, '
+        'consultas SQL y pico de memoria) y emite el resultado en JSON. '
+        'Pensado para correr sobre los datos de generar_datos_sinteticos.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticiones', type=int, default=20, help='Mediciones por vista (default: 20).')
+        parser.add_argument(
+            '--calentamiento', type=int, default=2,
+            help='Pedidos previos sin medir, para llenar caches (default: 2).'
+        )
+        parser.add_argument('--usuario', default=USUARIO_ADMIN, help=f'Usuario con el que se navega (default: {USUARIO_ADMIN}).')
+        parser.add_argument('--anio', type=int, default=None, help='Año de calendario/exportación (default: el actual).')
+        parser.add_argument('--salida', help='Archivo donde guardar el JSON (por defecto, salida estándar).')
+
+    def handle(self, *args, **options):
+        usuario = User.objects.filter(username=options['usuario']).first()
+        if usuario is None:
+            raise CommandError(
+                f"No existe el usuario '{options['usuario']}'. Generá datos con 'generar_datos_sinteticos' o indicá --usuario."
+            )
+
+        cliente = Client()
+        cliente.force_login(usuario)
+
+        resultado = {
+            'fecha': timezone.now().isoformat(),
+            'motor': connection.vendor,
+            'usuario': usuario.username,
+            'repeticiones': options['repeticiones'],
+            'vistas': {},
+        }
+        for nombre, url, parametros in self._vistas(options['anio'] or date.today().year):
+            resultado['vistas'][nombre] = self._medir(cliente, url, parametros, options)
+
+        salida = json.dumps(resultado, indent=2, ensure_ascii=False)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as archivo:
+                archivo.write(salida)
+            self.stdout.write(self.style.SUCCESS(f"Resultado guardado en {options['salida']}"))
+        else:
+            self.stdout.write(salida)
+
+    def _vistas(self, anio):
+        ventana = {'start': date(anio, 1, 1).isoformat(), 'end': date(anio, 12, 31).isoformat()}
+        return [
+            ('dashboard', reverse('gestion:dashboard'), {}),
+            ('calendario_global', reverse('gestion:calendario_global'), {'anio': anio}),
+            ('exportar_calendario_excel', reverse('gestion:exportar_calendario_excel'), {'anio': anio}),
+            ('aprobacion_manager', reverse('gestion:aprobacion_manager'), {}),
+            ('api_vacaciones_listar', reverse('gestion:api_vacaciones_listar'), ventana),
+            ('api_vacaciones_listar_compacto', reverse('gestion:api_vacaciones_listar'), {
+                **ventana, 'formato': 'compacto'
+            }),
+            ('api_check_notificaciones', reverse('gestion:api_check_notificaciones'), {'last_id': 0}),
+        ]
+
+    @staticmethod
+    def _pedir(cliente, url, parametros):
+        respuesta = cliente.get(url, parametros)
+        # Las respuestas en streaming (Excel) se consumen completas: eso también es parte del costo
+        cuerpo = b''.join(respuesta.streaming_content) if respuesta.streaming else respuesta.content
+        return respuesta.status_code, len(cuerpo)
+
+    def _medir(self, cliente, url, parametros, options):
+        for _ in range(options['calentamiento']):
+            self._pedir(cliente, url, parametros)
+
+        tiempos = []
+        for _ in range(options['repeticiones']):
+            inicio = time.perf_counter()
+            estado, tamanio = self._pedir(cliente, url, parametros)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+
+        # Consultas y memoria en un pedido aparte: tracemalloc distorsiona los tiempos
+        tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as consultas:
+                self._pedir(cliente, url, parametros)
+            _, pico = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        if estado != 200:
+            self.stderr.write(self.style.WARNING(f'{url} respondió {estado}'))
+
+        percentiles = statistics.quantiles(tiempos, n=100, method='inclusive') if len(tiempos) > 1 else tiempos * 99
+        return {
+            'url': url,
+            'estado': estado,
+            'bytes': tamanio,
+            'latencia_ms': {
+                'p50': round(percentiles[49], 2),
+                'p90': round(percentiles[89], 2),
+                'p95': round(percentiles[94], 2),
+                'p99': round(percentiles[98], 2),
+                'max': round(max(tiempos), 2),
+                'media': round(statistics.fmean(tiempos), 2),
+            },
+            'consultas': len(consultas),
+            'memoria_pico_kb': round(pico / 1024, 1),
+        }
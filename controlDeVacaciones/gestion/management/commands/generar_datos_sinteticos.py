@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from gestion.datos_sinteticos import CLAVE_USUARIOS, USUARIO_ADMIN, existe_dataset, generar_dataset, limpiar_dataset
+
+
+class Command(BaseCommand):
+    help = 'Genera (o borra) un set de datos sintético para pruebas de carga y benchmarks (ver benchmark_vistas)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--departamentos', type=int, default=10, help='Departamentos (default: 10).')
+        parser.add_argument('--empleados', type=int, default=300, help='Empleados (default: 300).')
+        parser.add_argument('--anios', type=int, default=3, help='Años de historia hasta el actual (default: 3).')
+        parser.add_argument('--solicitudes', type=int, default=3, help='Solicitudes por empleado y año (default: 3).')
+        parser.add_argument('--notificaciones', type=int, default=30, help='Notificaciones por usuario (default: 30).')
+        parser.add_argument('--semilla', type=int, default=1, help='Semilla del generador, para repetir el mismo set.')
+        parser.add_argument(
+            '--limpiar', action='store_true',
+            help='Borra el set sintético existente (y no genera nada nuevo).'
+        )
+
+    def handle(self, *args, **options):
+        if options['limpiar']:
+            limpiar_dataset()
+            self.stdout.write(self.style.SUCCESS('Datos sintéticos eliminados.'))
+            return
+
+        if existe_dataset():
+            raise CommandError('Ya hay datos sintéticos cargados. Borralos primero con --limpiar.')
+        if options['departamentos'] < 1 or options['empleados'] < options['departamentos']:
+            raise CommandError('Se necesita al menos un departamento y un empleado (manager) por departamento.')
+
+        totales = generar_dataset(
+            departamentos=options['departamentos'],
+            empleados=options['empleados'],
+            anios=options['anios'],
+            solicitudes_por_anio=options['solicitudes'],
+            notificaciones_por_usuario=options['notificaciones'],
+            semilla=options['semilla'],
+        )
+        for tabla, cantidad in totales.items():
+            self.stdout.write(f'{tabla}: {cantidad}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Datos generados. Usuario administrador: {USUARIO_ADMIN} / {CLAVE_USUARIOS}"
+        ))
@@ -0,0 +1,90 @@
+import time
+from datetime import timedelta
+
+from django.core.mail import EmailMultiAlternatives
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from gestion.models import CorreoSaliente
+from gestion.utils import conexion_smtp_activa, reservar_correos
+
+
+def espera_reintento(intentos):
+    """Espera antes del próximo intento: 1, 2, 4, 8... minutos, con tope de una hora."""
+    return timedelta(seconds=min(60 * 2 ** (intentos - 1), 3600))
+
+
+class Command(BaseCommand):
+    help = 'Envía los correos de la bandeja de salida en lotes, por una única conexión SMTP y con reintentos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--una-vez',
+            action='store_true',
+            help='Vacía la cola una vez y termina (para cron). Sin esta opción queda escuchando.'
+        )
+        parser.add_argument('--lote', type=int, default=50, help='Correos por lote (default: 50).')
+        parser.add_argument(
+            '--intervalo', type=float, default=10,
+            help='Segundos de espera cuando la cola está vacía (default: 10).'
+        )
+        parser.add_argument(
+            '--max-intentos', type=int, default=6,
+            help='Intentos antes de marcar un correo como fallido (default: 6).'
+        )
+
+    def handle(self, *args, **options):
+        conexion = None
+        remitente = None
+        try:
+            while True:
+                correos = reservar_correos(options['lote'])
+                if not correos:
+                    # Cola vacía: soltar la conexión SMTP hasta que vuelva a haber trabajo
+                    if conexion is not None:
+                        conexion.close()
+                        conexion = None
+                    if options['una_vez']:
+                        break
+                    time.sleep(options['intervalo'])
+                    continue
+
+                if conexion is None:
+                    conexion, remitente = conexion_smtp_activa()
+                enviados, fallidos = self._enviar_lote(conexion, remitente, correos, options['max_intentos'])
+                self.stdout.write(f'Lote procesado: {enviados} enviados, {fallidos} con error.')
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if conexion is not None:
+                conexion.close()
+
+    def _enviar_lote(self, conexion, remitente, correos, max_intentos):
+        enviados = fallidos = 0
+        for correo in correos:
+            mensaje = EmailMultiAlternatives(
+                correo.asunto, correo.cuerpo_texto, remitente, correo.lista_destinatarios(), connection=conexion
+            )
+            if correo.cuerpo_html:
+                mensaje.attach_alternative(correo.cuerpo_html, "text/html")
+            try:
+                # open() no hace nada si la conexión ya está abierta; la reabre si un error anterior la cerró
+                conexion.open()
+                mensaje.send(fail_silently=False)
+            except Exception as e:
+                fallidos += 1
+                conexion.close()
+                correo.intentos += 1
+                correo.ultimo_error = str(e)
+                if correo.intentos >= max_intentos:
+                    correo.estado = CorreoSaliente.ESTADO_FALLIDO
+                    self.stderr.write(self.style.ERROR(f'Correo {correo.id} descartado tras {correo.intentos} intentos: {e}'))
+                else:
+                    correo.proximo_intento = timezone.now() + espera_reintento(correo.intentos)
+                correo.save(update_fields=['intentos', 'ultimo_error', 'estado', 'proximo_intento'])
+            else:
+                enviados += 1
+                correo.estado = CorreoSaliente.ESTADO_ENVIADO
+                correo.fecha_envio = timezone.now()
+                correo.save(update_fields=['estado', 'fecha_envio'])
+        return enviados, fallidos
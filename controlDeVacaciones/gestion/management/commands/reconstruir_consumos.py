@@ -0,0 +1,75 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import ExtractYear
+
+from gestion.models import ConsumoVacaciones, RegistroVacaciones, SaldoVacaciones
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye (o verifica) el libro de consumos de vacaciones a partir de las solicitudes aprobadas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Solo compara el libro con los registros y lista las diferencias, sin modificar nada.'
+        )
+
+    def handle(self, *args, **options):
+        verificar = options['verificar']
+
+        # 1. Pares (empleado, ciclo) a materializar: todos los saldos y las filas ya existentes del libro
+        libro = {
+            (c.empleado_id, c.ciclo): c
+            for c in ConsumoVacaciones.objects.all()
+        }
+        pares = set(libro) | set(SaldoVacaciones.objects.values_list('empleado_id', 'ciclo'))
+
+        # 2. Días aprobados por empleado y año de inicio (una sola consulta agregada)
+        aprobados = defaultdict(list)
+        for fila in (
+            RegistroVacaciones.objects.filter(estado=RegistroVacaciones.ESTADO_APROBADA)
+            .annotate(anio=ExtractYear('fecha_inicio'))
+            .values('empleado_id', 'anio')
+            .annotate(total=Sum('dias_solicitados'))
+        ):
+            aprobados[fila['empleado_id']].append((fila['anio'], fila['total'] or 0))
+
+        # 3. Consumo real de cada ciclo: vacaciones que empiezan en el ciclo o después
+        diferencias = []
+        nuevos = []
+        for empleado_id, ciclo in sorted(pares):
+            real = sum(dias for anio, dias in aprobados.get(empleado_id, []) if anio >= ciclo)
+            consumo = libro.get((empleado_id, ciclo))
+            if consumo is None:
+                nuevos.append(ConsumoVacaciones(empleado_id=empleado_id, ciclo=ciclo, dias_consumidos=real))
+            elif consumo.dias_consumidos != real:
+                diferencias.append((consumo, real))
+
+        for consumo, real in diferencias:
+            self.stdout.write(self.style.WARNING(
+                f'Empleado {consumo.empleado_id} ciclo {consumo.ciclo}: libro={consumo.dias_consumidos} real={real}'
+            ))
+
+        if verificar:
+            self.stdout.write(
+                f'{len(pares)} ciclos revisados, {len(diferencias)} con diferencias, {len(nuevos)} sin materializar.'
+            )
+            if diferencias:
+                raise CommandError('El libro de consumos no coincide con los registros aprobados.')
+            self.stdout.write(self.style.SUCCESS('El libro de consumos es consistente.'))
+            return
+
+        # 4. Corregir diferencias y crear las filas faltantes
+        with transaction.atomic():
+            for consumo, real in diferencias:
+                consumo.dias_consumidos = real
+            ConsumoVacaciones.objects.bulk_update([c for c, _ in diferencias], ['dias_consumidos'])
+            ConsumoVacaciones.objects.bulk_create(nuevos, ignore_conflicts=True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Libro reconstruido: {len(diferencias)} ciclos corregidos, {len(nuevos)} creados.'
+        ))
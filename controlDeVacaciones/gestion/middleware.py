@@ -1,6 +1,11 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
 from django.shortcuts import redirect
 from django.urls import reverse
 
+from . import perfilado
+
 class PrimerLoginMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
@@ -27,3 +32,34 @@ class PrimerLoginMiddleware:
         
         response = self.get_response(request)
         return response
+
+
+class PerfiladoMiddleware:
+    """
+    Mide cada pedido: cantidad y tiempo de SQL, tiempo de render de plantillas y tiempo total.
+    Lo agrega a la tabla de estadísticas por vista (ver estadisticas_rendimiento) y, para usuarios
+    staff, lo devuelve en la cabecera Server-Timing (visible en la pestaña Network del navegador).
+    Se activa con PERFILADO_ACTIVO; apagado, Django lo saca de la cadena y no cuesta nada.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'PERFILADO_ACTIVO', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        perfilado.instrumentar_plantillas()
+
+    def __call__(self, request):
+        medicion, token = perfilado.iniciar()
+        try:
+            with connection.execute_wrapper(perfilado.medir_consulta):
+                response = self.get_response(request)
+        finally:
+            perfilado.terminar(token)
+        # En respuestas en streaming (Excel) no incluye la generación del contenido, que ocurre después
+        total_ms = medicion.total_ms()
+
+        if request.resolver_match is not None:
+            perfilado.registrar(request.resolver_match.view_name, medicion, total_ms)
+        usuario = getattr(request, 'user', None)
+        if usuario is not None and usuario.is_staff:
+            response['Server-Timing'] = perfilado.cabecera_server_timing(medicion, total_ms)
+        return response
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0008_alter_backup_tipo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumoVacaciones',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ciclo', models.IntegerField()),
+                ('dias_consumidos', models.IntegerField(default=0)),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+                ('empleado', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='consumos', to='gestion.empleado')),
+            ],
+            options={
+                'verbose_name': 'Consumo de Vacaciones',
+                'verbose_name_plural': 'Consumos de Vacaciones',
+                'unique_together': {('empleado', 'ciclo')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0010_correosaliente'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificacion',
+            index=models.Index(fields=['usuario', 'leida'], name='notif_usuario_leida_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificacion',
+            index=models.Index(fields=['usuario', 'id'], name='notif_usuario_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrovacaciones',
+            index=models.Index(fields=['empleado', 'estado', 'fecha_inicio', 'fecha_fin'], name='registro_emp_estado_fechas_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='registrovacaciones',
+            index=models.Index(fields=['estado', 'manager_aprobador', 'fecha_solicitud'], name='registro_estado_manager_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0011_indices_compuestos'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registrovacaciones',
+            name='fecha_modificacion',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gestion', '0012_registro_fecha_modificacion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='registrovacaciones',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
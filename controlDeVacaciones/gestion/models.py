@@ -1,7 +1,12 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_save
 from django.contrib.auth.models import User
-from django.db.models import Sum
+from django.db.models import Sum, F, Exists, ExpressionWrapper, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from datetime import date, datetime 
+
+from .ciclos import desde_anio
 # NOTA: Se ha eliminado la importación circular "from .models import Empleado, ...".
 
 # Función auxiliar para calcular días base de vacaciones según LCT (Ley de Contrato de Trabajo, Argentina)
@@ -19,6 +24,8 @@ def calcular_dias_lct(antiguedad_anos):
 
 class Departamento(models.Model):
     nombre = models.CharField(max_length=100, unique=True)
+    # Última edición: forma parte del ETag del planificador (views._etag_vacaciones)
+    fecha_modificacion = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return self.nombre
@@ -36,6 +43,8 @@ class Empleado(models.Model):
     # Manager que aprueba sus solicitudes (opcional)
     manager_aprobador = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='empleados_a_cargo')
     primer_login = models.BooleanField(default=True, help_text="Indica si el usuario debe cambiar su contraseña en el próximo inicio de sesión.")
+    # Última edición: forma parte del ETag del planificador (views._etag_vacaciones)
+    fecha_modificacion = models.DateTimeField(auto_now=True)
 
     def antiguedad_en_anos(self, fecha_referencia=None):
         """
@@ -61,24 +70,67 @@ class Empleado(models.Model):
     
 
 
+class SaldoVacacionesQuerySet(models.QuerySet):
+
+    def with_balances(self):
+        """
+        Anota los saldos en la misma consulta que los lista (sin N+1):
+        - dias_consumidos_anotados: del libro de consumos, o el Sum de aprobadas si el ciclo aún no se materializó.
+        - acumulados_restantes_anotados: dias_adicionales - consumidos.
+        Con esto, dias_consumidos_total(), dias_acumulados_restantes(), total_disponible() y saldo_total
+        no vuelven a consultar la base.
+        """
+        return self.select_related('empleado').anotar_consumo()
+
+    def anotar_consumo(self):
+        """
+        Las anotaciones de with_balances() sin el join a empleado. No combinarlo con select_for_update():
+        la subconsulta no ve el consumo que confirmó quien tenía el bloqueo (ver transiciones.bloquear_saldos).
+        """
+        consumo_libro = ConsumoVacaciones.objects.filter(
+            empleado=OuterRef('empleado'),
+            ciclo=OuterRef('ciclo')
+        ).values('dias_consumidos')[:1]
+
+        consumo_registros = RegistroVacaciones.objects.filter(
+            desde_anio('fecha_inicio', OuterRef('ciclo')),
+            empleado=OuterRef('empleado'),
+            estado=RegistroVacaciones.ESTADO_APROBADA
+        ).values('empleado').annotate(total=Sum('dias_solicitados')).values('total')
+
+        return self.annotate(
+            dias_consumidos_anotados=Coalesce(
+                Subquery(consumo_libro), Subquery(consumo_registros), Value(0),
+                output_field=models.IntegerField()
+            ),
+        ).annotate(
+            acumulados_restantes_anotados=ExpressionWrapper(
+                Coalesce(F('dias_adicionales'), Value(0)) - F('dias_consumidos_anotados'),
+                output_field=models.IntegerField()
+            ),
+        )
+
+
 class SaldoVacaciones(models.Model):
     empleado = models.ForeignKey(Empleado, on_delete=models.CASCADE)
     ciclo = models.IntegerField()  # Año del ciclo
     dias_iniciales = models.IntegerField(default=0)
     dias_adicionales = models.IntegerField(default=0, null=True, blank=True)
 
+    objects = SaldoVacacionesQuerySet.as_manager()
+
     class Meta:
         unique_together = ('empleado', 'ciclo')
 
     def dias_consumidos_total(self):
-        """Días de vacaciones consumidos en este ciclo."""
-        consumido = RegistroVacaciones.objects.filter(
-            empleado=self.empleado,
-            fecha_inicio__year__gte=self.ciclo,
-            estado='Aprobada'  # Solo contar solicitudes aprobadas
-        ).aggregate(Sum('dias_solicitados'))['dias_solicitados__sum']
-        
-        return consumido or 0
+        """
+        Días de vacaciones consumidos en este ciclo.
+        Usa la anotación de with_balances() si existe; si no, lee el libro de consumos (ConsumoVacaciones).
+        """
+        anotado = getattr(self, 'dias_consumidos_anotados', None)
+        if anotado is not None:
+            return anotado
+        return ConsumoVacaciones.objects.obtener(self.empleado_id, self.ciclo)
     
     def dias_base_ciclo(self):
         """
@@ -94,6 +146,10 @@ class SaldoVacaciones(models.Model):
         Los días consumidos se restan PRIMERO de los acumulados.
         Este valor se muestra en la columna "Acumuladas" del calendario.
         """
+        anotado = getattr(self, 'acumulados_restantes_anotados', None)
+        if anotado is not None:
+            return anotado
+
         dias_adicionales = self.dias_adicionales or 0
         dias_consumidos = self.dias_consumidos_total()
         
@@ -130,11 +186,22 @@ class SaldoVacaciones(models.Model):
 class DiasFestivos(models.Model):
     fecha = models.DateField(unique=True)
     descripcion = models.CharField(max_length=100)
+    # Última edición: forma parte del ETag del planificador (views._etag_vacaciones)
+    fecha_modificacion = models.DateTimeField(auto_now=True)
     
     def __str__(self):
         return f"{self.fecha.strftime('%d/%m/%Y')} - {self.descripcion}"
 
 
+class ConflictoDeVersion(Exception):
+    """La solicitud cambió (otro manager, otra pestaña) desde que se leyó: no se escribió nada."""
+
+    def __init__(self, registro_id, version_esperada):
+        super().__init__(f"La solicitud {registro_id} fue modificada por otra persona (se esperaba la versión {version_esperada}).")
+        self.registro_id = registro_id
+        self.version_esperada = version_esperada
+
+
 class RegistroVacaciones(models.Model):
     ESTADO_PENDIENTE = 'Pendiente'
     ESTADO_APROBADA = 'Aprobada'
@@ -163,6 +230,39 @@ class RegistroVacaciones(models.Model):
         blank=True,
         related_name='aprobaciones'
     )
+    # Última modificación (save); la usa la huella/ETag de api_vacaciones_listar
+    fecha_modificacion = models.DateTimeField(auto_now=True)
+    # Control de concurrencia optimista: toda escritura la incrementa (ver actualizar_con_version)
+    version = models.PositiveIntegerField(default=0)
+
+    CAMPOS_CONSUMO = ('estado', 'fecha_inicio', 'dias_solicitados')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Foto del aporte al libro de consumos tal como está en la base (si se cargaron los campos)
+        if not instance.get_deferred_fields().intersection(cls.CAMPOS_CONSUMO):
+            instance._consumo_original = instance._consumo_actual()
+        return instance
+
+    @classmethod
+    def _aporte_consumo(cls, estado, fecha_inicio, dias_solicitados):
+        """Aporte al libro de consumos: (año de inicio, días) si está aprobado, o None."""
+        if estado != cls.ESTADO_APROBADA or not fecha_inicio:
+            return None
+        return (fecha_inicio.year, dias_solicitados)
+
+    def _consumo_actual(self):
+        return self._aporte_consumo(self.estado, self.fecha_inicio, self.dias_solicitados)
+
+    def _consumo_en_base(self):
+        """Aporte actualmente registrado en la base para esta fila."""
+        if self._state.adding or self.pk is None:
+            return None
+        if hasattr(self, '_consumo_original'):
+            return self._consumo_original
+        fila = RegistroVacaciones.objects.filter(pk=self.pk).values_list(*self.CAMPOS_CONSUMO).first()
+        return self._aporte_consumo(*fila) if fila else None
 
     def calcular_dias_naturales(self):
         if self.fecha_inicio and self.fecha_fin:
@@ -171,7 +271,67 @@ class RegistroVacaciones(models.Model):
 
     def save(self, *args, **kwargs):
         self.dias_solicitados = self.calcular_dias_naturales()
-        super().save(*args, **kwargs)
+        consumo_anterior = self._consumo_en_base()
+        consumo_nuevo = self._consumo_actual()
+
+        actualizando = not self._state.adding
+        if actualizando:
+            # Incremento en SQL: un save() completo también invalida las versiones leídas antes
+            self.version = F('version') + 1
+
+        # Aprobar, cancelar o mover una solicitud actualiza el libro de consumos en la misma transacción
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if consumo_anterior != consumo_nuevo:
+                ConsumoVacaciones.objects.registrar_movimiento(self.empleado_id, consumo_anterior, consumo_nuevo)
+        self._consumo_original = consumo_nuevo
+        if actualizando:
+            self.refresh_from_db(fields=['version'])
+
+    def actualizar_con_version(self, version=None, condicion=None, **cambios):
+        """
+        Compare-and-swap: escribe solo los campos de 'cambios' con
+        UPDATE ... WHERE id = pk AND version = <versión leída>. Si otra escritura ganó, o si el cliente
+        manda una 'version' distinta de la leída (tenía datos viejos), lanza ConflictoDeVersion sin tocar nada.
+        'condicion' (un Q) se agrega al WHERE; las transiciones de estado la usan para exigir el estado de origen.
+
+        Hace lo mismo que save() para esos campos: recalcula dias_solicitados si cambian las fechas,
+        mueve fecha_modificacion, mantiene el libro de consumos y envía post_save (caches de capacidad
+        y de tareas). Como toda escritura incrementa la versión, si el UPDATE pasó la fila tenía
+        exactamente lo que se leyó, así que el aporte al libro de consumos también es el leído.
+        """
+        esperada = self.version
+        if version is not None and int(version) != esperada:
+            raise ConflictoDeVersion(self.pk, int(version))
+        valores = dict(cambios)
+        fecha_inicio = valores.get('fecha_inicio', self.fecha_inicio)
+        fecha_fin = valores.get('fecha_fin', self.fecha_fin)
+        if 'fecha_inicio' in valores or 'fecha_fin' in valores:
+            valores['dias_solicitados'] = max((fecha_fin - fecha_inicio).days + 1, 0)
+        valores['fecha_modificacion'] = timezone.now()
+
+        consumo_anterior = self._consumo_en_base()
+        consumo_nuevo = self._aporte_consumo(
+            valores.get('estado', self.estado), fecha_inicio, valores.get('dias_solicitados', self.dias_solicitados)
+        )
+
+        with transaction.atomic():
+            filas = RegistroVacaciones.objects.filter(condicion or Q(), pk=self.pk, version=esperada).update(
+                version=F('version') + 1, **valores
+            )
+            if not filas:
+                raise ConflictoDeVersion(self.pk, esperada)
+            if consumo_anterior != consumo_nuevo:
+                ConsumoVacaciones.objects.registrar_movimiento(self.empleado_id, consumo_anterior, consumo_nuevo)
+
+        for campo, valor in valores.items():
+            setattr(self, campo, valor)
+        self.version = esperada + 1
+        self._consumo_original = consumo_nuevo
+        post_save.send(
+            sender=RegistroVacaciones, instance=self, created=False,
+            update_fields=frozenset(valores) | {'version'}, raw=False, using=self._state.db or 'default'
+        )
 
     def __str__(self):
         emp = self.empleado
@@ -183,6 +343,12 @@ class RegistroVacaciones(models.Model):
         verbose_name = "Registro de Vacaciones"
         verbose_name_plural = "Registros de Vacaciones"
         ordering = ['-fecha_solicitud']
+        indexes = [
+            # Vacaciones de un empleado por estado y rango de fechas (saldos, solapamientos, calendario)
+            models.Index(fields=['empleado', 'estado', 'fecha_inicio', 'fecha_fin'], name='registro_emp_estado_fechas_idx'),
+            # Bandeja de aprobación: pendientes de un manager, ya ordenadas por fecha de solicitud
+            models.Index(fields=['estado', 'manager_aprobador', 'fecha_solicitud'], name='registro_estado_manager_idx'),
+        ]
 
     def es_aprobada(self):
         return self.estado == self.ESTADO_APROBADA
@@ -190,6 +356,94 @@ class RegistroVacaciones(models.Model):
     def dias_restantes_para_inicio(self):
         return (self.fecha_inicio - date.today()).days
 
+class ConsumoVacacionesManager(models.Manager):
+
+    def calcular(self, empleado_id, ciclo):
+        """Consumo real del ciclo calculado desde RegistroVacaciones (fuente de verdad)."""
+        consumido = RegistroVacaciones.objects.filter(
+            desde_anio('fecha_inicio', ciclo),
+            empleado_id=empleado_id,
+            estado=RegistroVacaciones.ESTADO_APROBADA
+        ).aggregate(Sum('dias_solicitados'))['dias_solicitados__sum']
+        return consumido or 0
+
+    def obtener(self, empleado_id, ciclo):
+        """
+        Lee el consumo materializado del ciclo. Si todavía no existe la fila,
+        se calcula una única vez y queda guardada para las próximas lecturas.
+        """
+        dias = self.filter(empleado_id=empleado_id, ciclo=ciclo).values_list('dias_consumidos', flat=True).first()
+        if dias is None:
+            consumo, _ = self.get_or_create(
+                empleado_id=empleado_id,
+                ciclo=ciclo,
+                defaults={'dias_consumidos': self.calcular(empleado_id, ciclo)}
+            )
+            dias = consumo.dias_consumidos
+        return dias
+
+    def registrar_movimiento(self, empleado_id, anterior, nuevo):
+        """
+        Aplica el cambio de un registro al libro de consumos. Se llama con el registro ya escrito, en la
+        misma transacción. 'anterior' y 'nuevo' son (año de inicio, días) o None si el registro no consume saldo.
+        Una vacación que empieza en el año Y consume en todos los ciclos <= Y.
+
+        Los ciclos con saldo que todavía no tienen fila en el libro se crean acá con calcular(), que ya
+        incluye el cambio. Si quedaran para obtener(), el valor que este calculó antes de que se confirme
+        el cambio se guardaría sin él. Si otro pedido crea la fila en paralelo, la clave única lo frena
+        y se le aplica el cambio como a las que ya existían.
+        """
+        anios = [movimiento[0] for movimiento in (anterior, nuevo) if movimiento]
+        if not anios:
+            return
+        with transaction.atomic():
+            creados = []
+            sin_libro = SaldoVacaciones.objects.filter(empleado_id=empleado_id, ciclo__lte=max(anios)).exclude(
+                Exists(self.filter(empleado_id=OuterRef('empleado_id'), ciclo=OuterRef('ciclo')))
+            ).values_list('ciclo', flat=True)
+            for ciclo in sin_libro:
+                try:
+                    with transaction.atomic():
+                        self.create(empleado_id=empleado_id, ciclo=ciclo, dias_consumidos=self.calcular(empleado_id, ciclo))
+                    creados.append(ciclo)
+                except IntegrityError:
+                    pass
+
+            libro = self.filter(empleado_id=empleado_id).exclude(ciclo__in=creados)
+            if anterior:
+                anio, dias = anterior
+                libro.filter(ciclo__lte=anio).update(
+                    dias_consumidos=F('dias_consumidos') - dias, fecha_actualizacion=timezone.now()
+                )
+            if nuevo:
+                anio, dias = nuevo
+                libro.filter(ciclo__lte=anio).update(
+                    dias_consumidos=F('dias_consumidos') + dias, fecha_actualizacion=timezone.now()
+                )
+
+
+class ConsumoVacaciones(models.Model):
+    """
+    Libro de consumos: total de días aprobados por empleado y ciclo, mantenido
+    incrementalmente al aprobar, cancelar o mover solicitudes.
+    Se reconstruye/verifica con 'python manage.py reconstruir_consumos'.
+    """
+    empleado = models.ForeignKey(Empleado, on_delete=models.CASCADE, related_name='consumos')
+    ciclo = models.IntegerField()
+    dias_consumidos = models.IntegerField(default=0)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    objects = ConsumoVacacionesManager()
+
+    class Meta:
+        unique_together = ('empleado', 'ciclo')
+        verbose_name = "Consumo de Vacaciones"
+        verbose_name_plural = "Consumos de Vacaciones"
+
+    def __str__(self):
+        return f"Consumo de {self.empleado_id} en {self.ciclo}: {self.dias_consumidos}"
+
+
 class ConfiguracionEmail(models.Model):
     # SMTP Settings
     email_host = models.CharField(max_length=200, default='mail.tudominio.com', help_text="Ej: mail.tudominio.com o cXXXX.ferozo.com")
@@ -207,9 +461,55 @@ class ConfiguracionEmail(models.Model):
     # Activar/Desactivar
     activo = models.BooleanField(default=True)
 
+    # Sello de la última edición: sin cache compartido, el worker de correos lo compara para recargar
+    fecha_modificacion = models.DateTimeField(auto_now=True)
+
     def __str__(self):
         return f"SMTP: {self.email_host_user}"
 
+class CorreoSaliente(models.Model):
+    """
+    Bandeja de salida de emails. Las vistas solo encolan (ya renderizado) y el comando
+    'procesar_correos' los envía en lotes por una única conexión SMTP, con reintentos.
+    """
+    ESTADO_PENDIENTE = 'Pendiente'
+    ESTADO_ENVIADO = 'Enviado'
+    ESTADO_FALLIDO = 'Fallido'
+
+    ESTADOS = [
+        (ESTADO_PENDIENTE, 'Pendiente'),
+        (ESTADO_ENVIADO, 'Enviado'),
+        (ESTADO_FALLIDO, 'Fallido'),
+    ]
+
+    asunto = models.CharField(max_length=255)
+    cuerpo_texto = models.TextField()
+    cuerpo_html = models.TextField(blank=True)
+    # Emails separados por coma (,)
+    destinatarios = models.TextField()
+    estado = models.CharField(max_length=20, choices=ESTADOS, default=ESTADO_PENDIENTE)
+    intentos = models.PositiveIntegerField(default=0)
+    # Cuándo puede tomarlo el worker (reintentos con espera creciente y reserva del lote en curso)
+    proximo_intento = models.DateTimeField(default=timezone.now)
+    ultimo_error = models.TextField(blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_envio = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Correo saliente"
+        verbose_name_plural = "Correos salientes"
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['estado', 'proximo_intento'], name='correo_cola_idx'),
+        ]
+
+    def lista_destinatarios(self):
+        return [d.strip() for d in self.destinatarios.split(',') if d.strip()]
+
+    def __str__(self):
+        return f"{self.asunto} ({self.estado})"
+
+
 class Notificacion(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notificaciones')
     titulo = models.CharField(max_length=150)
@@ -224,6 +524,12 @@ class Notificacion(models.Model):
         verbose_name = "Notificación"
         verbose_name_plural = "Notificaciones"
         ordering = ['-fecha_creacion']
+        indexes = [
+            # Contador de no leídas de la campana
+            models.Index(fields=['usuario', 'leida'], name='notif_usuario_leida_idx'),
+            # Notificaciones nuevas desde el último id que tiene el cliente
+            models.Index(fields=['usuario', 'id'], name='notif_usuario_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.titulo} - {self.usuario.username}"
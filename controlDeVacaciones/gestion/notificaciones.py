@@ -0,0 +1,156 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .models import RegistroVacaciones
+
+
+# Segundos que una espera de long-poll queda abierta antes de responder "sin cambios" (204)
+LONG_POLL_SEGUNDOS = getattr(settings, 'NOTIFICACIONES_LONG_POLL_SEGUNDOS', 25)
+# Cada cuánto una espera revisa la versión en el cache: ve los cambios de otros procesos solo si el
+# cache es compartido (REDIS_URL); con LocMemCache la app corre en un único proceso (ver settings.CACHES)
+INTERVALO_REVISION = 1
+
+# Versiones en el cache: una por usuario (sus notificaciones) y una para las solicitudes pendientes,
+# que comparten todos los managers. No se consulta la base para saber si algo cambió.
+CLAVE_USUARIO = 'notif:usuario:{}'
+CLAVE_TAREAS = 'notif:tareas'
+
+# Resumen de la campana por usuario y versión: al cambiar la versión, la entrada vieja deja de usarse
+CLAVE_RESUMEN = 'notif:resumen:{}:{}'
+TTL_RESUMEN = 60 * 60
+
+# Difusión dentro del proceso: las señales despiertan a todas las esperas abiertas de este worker
+_cambios = threading.Condition()
+
+
+def _renovar(claves):
+    """
+    Cambia las versiones al confirmarse la transacción (en autocommit, en el acto). Si cambiaran antes,
+    una lectura concurrente vería las filas todavía sin confirmar y guardaría ese resumen bajo la versión
+    nueva hasta que venza (TTL_RESUMEN).
+    """
+    def renovar():
+        cache.set_many({clave: uuid.uuid4().hex for clave in claves}, None)
+        with _cambios:
+            _cambios.notify_all()
+
+    transaction.on_commit(renovar)
+
+
+def avisar_notificaciones(usuario_ids):
+    """Marca como cambiadas las notificaciones de los usuarios indicados."""
+    claves = [CLAVE_USUARIO.format(uid) for uid in set(usuario_ids) if uid]
+    if claves:
+        _renovar(claves)
+
+
+def avisar_tareas():
+    """Marca como cambiadas las solicitudes pendientes (afecta a todos los managers)."""
+    _renovar([CLAVE_TAREAS])
+
+
+def marcar_leidas(notificaciones):
+    """
+    Marca como leídas las notificaciones del queryset con un solo UPDATE.
+    El update() no dispara señales, así que se avisa a mano a los usuarios afectados.
+    """
+    no_leidas = notificaciones.filter(leida=False)
+    usuario_ids = list(no_leidas.values_list('usuario_id', flat=True).distinct())
+    if usuario_ids:
+        no_leidas.update(leida=True)
+        avisar_notificaciones(usuario_ids)
+
+
+def empleado_manager(usuario):
+    """Empleado del usuario si es manager, si no None."""
+    empleado = getattr(usuario, 'empleado', None)
+    return empleado if empleado is not None and empleado.es_manager else None
+
+
+def version_notificaciones(usuario):
+    """Versión actual de lo que ve el usuario en la campana (solo lecturas del cache)."""
+    claves = [CLAVE_USUARIO.format(usuario.pk)]
+    if empleado_manager(usuario):
+        claves.append(CLAVE_TAREAS)
+    valores = cache.get_many(claves)
+    for clave in claves:
+        if clave not in valores:
+            cache.add(clave, uuid.uuid4().hex, None)
+            valores[clave] = cache.get(clave)
+    return '.'.join(valores[clave] for clave in claves)
+
+
+def contar_tareas_pendientes(usuario):
+    """Solicitudes pendientes que el manager debe resolver (0 si no es manager)."""
+    empleado = empleado_manager(usuario)
+    if empleado is None:
+        return 0
+    # Si es Administrador (Superuser), ve TODAS las pendientes
+    filtro = Q() if usuario.is_superuser else Q(manager_aprobador=empleado)
+    return RegistroVacaciones.objects.filter(filtro, estado=RegistroVacaciones.ESTADO_PENDIENTE).count()
+
+
+def resumen_cacheado(usuario):
+    """
+    Devuelve (version, resumen) con resumen = {'no_leidas', 'tareas_pendientes', 'last_id'}.
+    Se guarda en el cache bajo la versión actual, así que las señales de Notificacion y
+    RegistroVacaciones lo invalidan solas; en el caso común no toca la base.
+    """
+    version = version_notificaciones(usuario)
+    clave = CLAVE_RESUMEN.format(usuario.pk, version)
+    resumen = cache.get(clave)
+    if resumen is None:
+        ultima = usuario.notificaciones.order_by('-id').values_list('id', flat=True).first()
+        resumen = {
+            'no_leidas': usuario.notificaciones.filter(leida=False).count(),
+            'tareas_pendientes': contar_tareas_pendientes(usuario),
+            'last_id': ultima or 0,
+        }
+        cache.set(clave, resumen, TTL_RESUMEN)
+    return version, resumen
+
+
+def resumen_notificaciones(usuario, last_id):
+    """
+    Payload de la campana: contadores, versión y notificaciones nuevas desde 'last_id'.
+    Solo consulta la base si hay notificaciones más nuevas que las que ya tiene el cliente.
+    """
+    version, resumen = resumen_cacheado(usuario)
+    nuevas = []
+    if resumen['last_id'] > last_id:
+        nuevas = list(usuario.notificaciones.filter(id__gt=last_id).order_by('id'))
+
+    return {
+        'unread_count': resumen['no_leidas'] + resumen['tareas_pendientes'],
+        'tareas_pendientes': resumen['tareas_pendientes'],
+        'nuevas': [
+            {'id': n.id, 'titulo': n.titulo, 'mensaje': n.mensaje, 'url': n.url}
+            for n in nuevas
+        ],
+        'last_id': max([last_id] + [n.id for n in nuevas]),
+        'version': version,
+    }
+
+
+def esperar_cambio(usuario, version, segundos=None):
+    """
+    Bloquea hasta que la versión del usuario difiera de 'version' o pasen 'segundos'.
+    Devuelve la versión nueva, o None si no hubo cambios. Mientras espera no consulta la base:
+    las señales de este proceso la despiertan al instante y el cache se revisa cada INTERVALO_REVISION.
+    """
+    limite = time.monotonic() + (LONG_POLL_SEGUNDOS if segundos is None else segundos)
+    while True:
+        actual = version_notificaciones(usuario)
+        if actual != version:
+            return actual
+        restante = limite - time.monotonic()
+        if restante <= 0:
+            return None
+        with _cambios:
+            _cambios.wait(min(INTERVALO_REVISION, restante))
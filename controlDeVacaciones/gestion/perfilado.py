@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.template.backends.django import Template as PlantillaDjango
+
+
+# Mediciones por vista: se guardan las últimas VENTANA de cada una, en memoria del proceso
+# (cada worker lleva su propia tabla; no se escribe nada en la base ni en el cache por pedido).
+VENTANA = getattr(settings, 'PERFILADO_VENTANA', 200)
+
+# Vistas que esperan a propósito (long-poll, hasta LONG_POLL_SEGUNDOS): su tiempo total no es trabajo,
+# así que se informan aparte para no tapar a las demás en el p95
+VISTAS_ESPERA = frozenset(getattr(settings, 'PERFILADO_VISTAS_ESPERA', ('gestion:api_esperar_notificaciones',)))
+
+# Medición del pedido en curso; None fuera de un pedido perfilado
+_actual = ContextVar('perfilado_actual', default=None)
+
+_muestras = {}
+_lock = threading.Lock()
+
+
+class Medicion:
+    __slots__ = ('inicio', 'consultas', 'sql_ms', 'plantillas_ms')
+
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.consultas = 0
+        self.sql_ms = 0.0
+        self.plantillas_ms = 0.0
+
+    def total_ms(self):
+        return (time.perf_counter() - self.inicio) * 1000
+
+
+def iniciar():
+    medicion = Medicion()
+    return medicion, _actual.set(medicion)
+
+
+def terminar(token):
+    _actual.reset(token)
+
+
+def medir_consulta(execute, sql, params, many, context):
+    """execute_wrapper de la conexión: cuenta y cronometra cada consulta del pedido."""
+    medicion = _actual.get()
+    if medicion is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        medicion.consultas += 1
+        medicion.sql_ms += (time.perf_counter() - inicio) * 1000
+
+
+def _render_medido(render_original):
+    def render(self, context=None, request=None):
+        medicion = _actual.get()
+        if medicion is None:
+            return render_original(self, context, request)
+        inicio = time.perf_counter()
+        try:
+            return render_original(self, context, request)
+        finally:
+            medicion.plantillas_ms += (time.perf_counter() - inicio) * 1000
+    render.perfilado = True
+    return render
+
+
+def instrumentar_plantillas():
+    """Envuelve el render de las plantillas de Django una sola vez por proceso."""
+    if not getattr(PlantillaDjango.render, 'perfilado', False):
+        PlantillaDjango.render = _render_medido(PlantillaDjango.render)
+
+
+def registrar(vista, medicion, total_ms):
+    fila = (total_ms, medicion.consultas, medicion.sql_ms, medicion.plantillas_ms)
+    with _lock:
+        muestras = _muestras.get(vista)
+        if muestras is None:
+            muestras = _muestras[vista] = deque(maxlen=VENTANA)
+        muestras.append(fila)
+
+
+def reiniciar():
+    with _lock:
+        _muestras.clear()
+
+
+def _percentil(ordenados, fraccion):
+    return ordenados[min(int(len(ordenados) * fraccion), len(ordenados) - 1)]
+
+
+def estadisticas(espera=False):
+    """
+    Resumen por vista de las últimas mediciones, de la más lenta (p95) a la más rápida.
+    Con 'espera' devuelve solo las vistas de VISTAS_ESPERA; sin él, todas las demás.
+    """
+    with _lock:
+        copia = {
+            vista: list(muestras) for vista, muestras in _muestras.items()
+            if (vista in VISTAS_ESPERA) == espera
+        }
+
+    filas = []
+    for vista, muestras in copia.items():
+        totales = sorted(m[0] for m in muestras)
+        cantidad = len(muestras)
+        filas.append({
+            'vista': vista,
+            'pedidos': cantidad,
+            'total_p50_ms': round(_percentil(totales, 0.5), 1),
+            'total_p95_ms': round(_percentil(totales, 0.95), 1),
+            'total_max_ms': round(totales[-1], 1),
+            'consultas_media': round(sum(m[1] for m in muestras) / cantidad, 1),
+            'sql_media_ms': round(sum(m[2] for m in muestras) / cantidad, 1),
+            'plantillas_media_ms': round(sum(m[3] for m in muestras) / cantidad, 1),
+        })
+    filas.sort(key=lambda f: f['total_p95_ms'], reverse=True)
+    return filas
+
+
+def cabecera_server_timing(medicion, total_ms):
+    return (
+        f'sql;dur={medicion.sql_ms:.1f};desc="{medicion.consultas} consultas", '
+        f'plantillas;dur={medicion.plantillas_ms:.1f}, '
+        f'total;dur={total_ms:.1f}'
+    )
@@ -0,0 +1,290 @@
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .capacidad import ESTADOS_OCUPAN, invalidar_capacidad
+from .models import ConsumoVacaciones, Empleado, RegistroVacaciones
+from .notificaciones import avisar_tareas
+from .transiciones import bloquear_saldos
+
+
+# Límites de un lote de api_vacaciones_mover_lote
+MAX_MOVIMIENTOS_LOTE = 200
+MAX_DIAS_MOVIMIENTO = 366
+
+# Porcentaje mínimo del departamento que debe seguir trabajando cada día (por debajo, aprobacion_manager
+# ya lo pinta en rojo). Se rechaza el movimiento que empeora el peor día de la vacación y lo deja por debajo.
+CAPACIDAD_MINIMA_PCT = getattr(settings, 'CAPACIDAD_MINIMA_PCT', 50)
+
+ESTADOS_NO_MOVIBLES = (RegistroVacaciones.ESTADO_RECHAZADA, RegistroVacaciones.ESTADO_CANCELADA)
+
+
+class Movimiento:
+    """Un pedido del lote: fechas ya interpretadas (fin inclusive) y su resultado."""
+    __slots__ = ('id', 'inicio', 'fin', 'version', 'registro', 'error', 'conflicto')
+
+    def __init__(self, datos):
+        self.id = None
+        self.inicio = self.fin = None
+        self.version = None
+        self.registro = None
+        self.error = None
+        self.conflicto = False
+        try:
+            self.id = int(datos['id'])
+            # Versión que tenía el calendario (opcional): si la fila cambió desde entonces, es un conflicto
+            if datos.get('version') is not None:
+                self.version = int(datos['version'])
+            self.inicio = date.fromisoformat(str(datos['start'])[:10])
+            # FullCalendar manda el fin EXCLUSIVO; sin 'end' es un solo día
+            fin = datos.get('end')
+            self.fin = date.fromisoformat(str(fin)[:10]) - timedelta(days=1) if fin else self.inicio
+        except (KeyError, TypeError, ValueError):
+            self.error = 'Datos incompletos o fechas inválidas'
+            return
+        if self.inicio > self.fin:
+            self.error = 'Fecha fin menor a inicio'
+        elif (self.fin - self.inicio).days + 1 > MAX_DIAS_MOVIMIENTO:
+            self.error = f'El rango supera los {MAX_DIAS_MOVIMIENTO} días'
+
+    @property
+    def dias(self):
+        return (self.fin - self.inicio).days + 1
+
+    def resultado(self):
+        return {
+            'id': self.id,
+            'success': self.error is None,
+            'error': self.error,
+            'conflicto': self.conflicto,
+            'version': self.registro.version if self.registro is not None else None,
+        }
+
+
+class _Ocupacion:
+    """
+    Estado en memoria del lote: intervalos de cada empleado y ausentes por día de cada departamento.
+    Se arma con las vacaciones existentes y se actualiza a medida que se aceptan movimientos, así
+    cada validación ve el efecto de los movimientos anteriores del mismo lote.
+    """
+
+    def __init__(self):
+        self.intervalos = defaultdict(dict)  # empleado_id -> {registro_id: (inicio, fin)}
+        self.por_dia = defaultdict(lambda: defaultdict(Counter))  # depto_id -> fecha -> Counter(empleado_id)
+
+    def agregar(self, registro_id, empleado_id, depto_id, inicio, fin):
+        self.intervalos[empleado_id][registro_id] = (inicio, fin)
+        if depto_id is not None:
+            dias = self.por_dia[depto_id]
+            for n in range((fin - inicio).days + 1):
+                dias[inicio + timedelta(days=n)][empleado_id] += 1
+
+    def quitar(self, registro_id, empleado_id, depto_id):
+        inicio, fin = self.intervalos[empleado_id].pop(registro_id)
+        if depto_id is not None:
+            dias = self.por_dia[depto_id]
+            for n in range((fin - inicio).days + 1):
+                contador = dias[inicio + timedelta(days=n)]
+                contador[empleado_id] -= 1
+                if contador[empleado_id] <= 0:
+                    del contador[empleado_id]
+        return inicio, fin
+
+    def solapa(self, registro_id, empleado_id, inicio, fin):
+        return any(
+            otro_inicio <= fin and otro_fin >= inicio
+            for otro_id, (otro_inicio, otro_fin) in self.intervalos[empleado_id].items()
+            if otro_id != registro_id
+        )
+
+    def pico_ausentes(self, depto_id, inicio, fin):
+        dias = self.por_dia[depto_id]
+        return max(len(dias.get(inicio + timedelta(days=n), ())) for n in range((fin - inicio).days + 1))
+
+
+def _validar(mov, ocupacion, disponibles, dotacion, pico_anterior):
+    """
+    Devuelve el error del movimiento contra el estado actual del lote, o None si se puede aplicar.
+    'pico_anterior' son los ausentes del peor día de la vacación en su posición anterior.
+    """
+    registro = mov.registro
+    if ocupacion.solapa(registro.id, registro.empleado_id, mov.inicio, mov.fin):
+        return 'Se superpone con otras vacaciones del empleado'
+
+    # Saldo: una aprobada consume solo la diferencia; una pendiente debe entrar entera (como al solicitarla)
+    disponible = disponibles[registro.empleado_id]
+    if registro.estado == RegistroVacaciones.ESTADO_APROBADA:
+        extra = mov.dias - registro.dias_solicitados
+        if extra > 0 and extra > disponible:
+            return f'Saldo insuficiente: agrega {extra} días y hay {disponible} disponibles'
+    elif mov.dias > disponible:
+        return f'Saldo insuficiente: solicita {mov.dias} días y hay {disponible} disponibles'
+
+    depto_id = registro.empleado.departamento_id
+    total = dotacion.get(depto_id, 0)
+    if total:
+        # El empleado ya estaba ausente antes del movimiento: solo cuenta si su peor día suma ausentes.
+        # Así acortar, correr sin cruzarse con nadie o moverse en un departamento de una persona no se rechaza
+        ausentes = ocupacion.pico_ausentes(depto_id, mov.inicio, mov.fin)
+        presentes_pct = int(((total - ausentes) / total) * 100)
+        if ausentes > pico_anterior and presentes_pct < CAPACIDAD_MINIMA_PCT:
+            return f'El departamento quedaría al {presentes_pct}% de capacidad (mínimo {CAPACIDAD_MINIMA_PCT}%)'
+    return None
+
+
+def mover_en_lote(datos, todo_o_nada=True):
+    """
+    Aplica varios movimientos de vacaciones (id/start/end de FullCalendar) en una sola transacción.
+
+    Bloquea los saldos del ciclo actual y las solicitudes con select_for_update (en orden de empleado
+    y de id, como las aprobaciones, para no cruzarse con ellas ni con otro lote) y valida cada
+    movimiento, en el orden recibido, contra solapamientos del empleado, saldo y capacidad mínima del
+    departamento. Las vacaciones existentes, la dotación y los saldos se leen con una consulta cada
+    uno, sin importar el tamaño del lote.
+
+    Si un movimiento trae 'version' y no coincide con la de la fila bloqueada, falla como conflicto.
+    Con todo_o_nada, si algún movimiento falla no se aplica ninguno. Devuelve un resultado por
+    movimiento, en el mismo orden: {'id', 'success', 'error', 'conflicto', 'version'}.
+    """
+    movimientos = [Movimiento(d if isinstance(d, dict) else {}) for d in datos]
+    validos = [m for m in movimientos if m.error is None]
+
+    ids = [m.id for m in validos]
+    if len(ids) != len(set(ids)):
+        vistos = Counter(ids)
+        for mov in validos:
+            if vistos[mov.id] > 1:
+                mov.error = 'La solicitud aparece más de una vez en el lote'
+        validos = [m for m in validos if m.error is None]
+
+    # Los empleados se leen antes de la transacción: dentro, lo primero tiene que ser el bloqueo. En InnoDB
+    # la primera lectura sin bloqueo fija la foto de la transacción, y una lectura previa haría que el
+    # consumo leído después del bloqueo fuera el de antes de la aprobación o el lote que lo tenía.
+    ids = [m.id for m in validos]
+    ciclo = date.today().year
+    por_id = Empleado.objects.in_bulk(
+        set(RegistroVacaciones.objects.filter(pk__in=ids).values_list('empleado_id', flat=True))
+    )
+    with transaction.atomic():
+        # Mismo orden de bloqueo que transiciones.transicionar: primero los saldos del ciclo (en orden de
+        # empleado), después las solicitudes (en orden de id, sin joins). El saldo disponible sale de la
+        # lectura que bloquear_saldos hace con el bloqueo ya tomado, así que ve todo lo confirmado antes:
+        # dos lotes, o un lote y una aprobación, no pueden validar contra el mismo consumo.
+        saldos = bloquear_saldos(por_id.values(), ciclo)
+        registros = {
+            r.id: r for r in RegistroVacaciones.objects.select_for_update().filter(pk__in=ids).order_by('pk')
+        }
+        for mov in validos:
+            mov.registro = registros.get(mov.id)
+            if mov.registro is None:
+                mov.error = 'Registro no encontrado'
+            elif mov.registro.empleado_id not in saldos:
+                # Reasignada a otro empleado antes del bloqueo: su saldo no está bloqueado
+                mov.error = 'Otra persona modificó estas vacaciones'
+                mov.conflicto = True
+            elif mov.version is not None and mov.version != mov.registro.version:
+                mov.error = 'Otra persona modificó estas vacaciones'
+                mov.conflicto = True
+        validos = [m for m in validos if m.error is None]
+        for mov in validos:
+            mov.registro.empleado = por_id[mov.registro.empleado_id]
+
+        if validos:
+            empleados = {m.registro.empleado_id: m.registro.empleado for m in validos}
+            deptos = {e.departamento_id for e in empleados.values() if e.departamento_id is not None}
+            desde = min(min(m.inicio, m.registro.fecha_inicio) for m in validos)
+            hasta = max(max(m.fin, m.registro.fecha_fin) for m in validos)
+
+            ocupacion = _Ocupacion()
+            existentes = RegistroVacaciones.objects.filter(
+                estado__in=ESTADOS_OCUPAN, fecha_inicio__lte=hasta, fecha_fin__gte=desde
+            ).filter(
+                # Todo el departamento (capacidad), más los empleados del lote que no tienen uno (solapamientos)
+                Q(empleado__departamento_id__in=deptos) | Q(empleado_id__in=list(empleados))
+            ).values_list('id', 'empleado_id', 'empleado__departamento_id', 'fecha_inicio', 'fecha_fin')
+            for registro_id, empleado_id, depto_id, inicio, fin in existentes:
+                ocupacion.agregar(registro_id, empleado_id, depto_id, max(inicio, desde), min(fin, hasta))
+
+            dotacion = dict(
+                Empleado.objects.filter(departamento_id__in=deptos)
+                .values('departamento_id').annotate(total=Count('id'))
+                .values_list('departamento_id', 'total')
+            )
+            disponibles = {empleado_id: saldos[empleado_id].total_disponible() for empleado_id in empleados}
+
+            for mov in validos:
+                registro = mov.registro
+                depto_id = registro.empleado.departamento_id
+                if registro.estado in ESTADOS_NO_MOVIBLES:
+                    mov.error = 'No se pueden mover solicitudes canceladas/rechazadas'
+                    continue
+                pico_anterior = 0
+                if depto_id is not None:
+                    pico_anterior = ocupacion.pico_ausentes(
+                        depto_id, *ocupacion.intervalos[registro.empleado_id][registro.id]
+                    )
+                # Se prueba en la posición nueva; si no pasa, vuelve a la anterior
+                anterior = ocupacion.quitar(registro.id, registro.empleado_id, depto_id)
+                ocupacion.agregar(registro.id, registro.empleado_id, depto_id, mov.inicio, mov.fin)
+                mov.error = _validar(mov, ocupacion, disponibles, dotacion, pico_anterior)
+                if mov.error is not None:
+                    ocupacion.quitar(registro.id, registro.empleado_id, depto_id)
+                    ocupacion.agregar(registro.id, registro.empleado_id, depto_id, *anterior)
+                elif registro.estado == RegistroVacaciones.ESTADO_APROBADA:
+                    disponibles[registro.empleado_id] -= mov.dias - registro.dias_solicitados
+
+        aceptados = [m for m in movimientos if m.error is None]
+        if todo_o_nada and len(aceptados) != len(movimientos):
+            for mov in aceptados:
+                mov.error = 'No aplicado: otros movimientos del lote fallaron'
+            aceptados = []
+
+        if aceptados:
+            _aplicar(aceptados)
+
+    if aceptados:
+        # bulk_update no dispara señales: se invalidan a mano los caches que mantienen
+        for depto_id in {m.registro.empleado.departamento_id for m in aceptados}:
+            if depto_id is None:
+                invalidar_capacidad()
+            else:
+                invalidar_capacidad(depto_id)
+        avisar_tareas()
+
+    return [m.resultado() for m in movimientos]
+
+
+def _aplicar(aceptados):
+    """
+    Escribe los movimientos con un bulk_update y mantiene a mano lo que haría save():
+    el libro de consumos de las aprobadas, fecha_modificacion (auto_now no corre en bulk_update) y version.
+    """
+    registros = []
+    cambios_consumo = []
+    for mov in aceptados:
+        registro = mov.registro
+        consumo_anterior = registro._consumo_actual()
+        registro.fecha_inicio = mov.inicio
+        registro.fecha_fin = mov.fin
+        registro.dias_solicitados = registro.calcular_dias_naturales()
+        consumo_nuevo = registro._consumo_actual()
+        if consumo_anterior != consumo_nuevo:
+            cambios_consumo.append((registro.empleado_id, consumo_anterior, consumo_nuevo))
+        registro._consumo_original = consumo_nuevo
+        registros.append(registro)
+
+    # Las filas están bloqueadas: la versión siguiente se puede calcular acá
+    ahora = timezone.now()
+    for registro in registros:
+        registro.fecha_modificacion = ahora
+        registro.version += 1
+    RegistroVacaciones.objects.bulk_update(
+        registros, ['fecha_inicio', 'fecha_fin', 'dias_solicitados', 'fecha_modificacion', 'version']
+    )
+    # Como en save(), el libro se actualiza con los registros ya escritos (ver registrar_movimiento)
+    for empleado_id, consumo_anterior, consumo_nuevo in cambios_consumo:
+        ConsumoVacaciones.objects.registrar_movimiento(empleado_id, consumo_anterior, consumo_nuevo)
@@ -0,0 +1,64 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .capacidad import invalidar_capacidad
+from .dias_habiles import invalidar_festivos
+from .models import ConfiguracionEmail, ConsumoVacaciones, DiasFestivos, Empleado, Notificacion, RegistroVacaciones
+from .notificaciones import avisar_notificaciones, avisar_tareas
+from .utils import invalidar_config_email
+
+
+@receiver(post_delete, sender=RegistroVacaciones)
+def descontar_consumo_eliminado(sender, instance, **kwargs):
+    """Al borrar una vacación aprobada (admin o borrado en cascada), se devuelve su consumo al libro."""
+    consumo = getattr(instance, '_consumo_original', None)
+    if consumo:
+        ConsumoVacaciones.objects.registrar_movimiento(instance.empleado_id, consumo, None)
+
+
+@receiver(post_save, sender=DiasFestivos)
+@receiver(post_delete, sender=DiasFestivos)
+def refrescar_festivos(sender, instance, **kwargs):
+    """Cualquier alta, edición o baja de un feriado invalida el cache de días hábiles."""
+    invalidar_festivos()
+
+
+@receiver(post_save, sender=RegistroVacaciones)
+@receiver(post_delete, sender=RegistroVacaciones)
+def refrescar_capacidad_departamento(sender, instance, **kwargs):
+    """Un pedido nuevo, movido, aprobado, cancelado o borrado cambia la línea de capacidad de su departamento."""
+    try:
+        depto_id = instance.empleado.departamento_id
+    except Empleado.DoesNotExist:
+        invalidar_capacidad()
+        return
+    if depto_id is not None:
+        invalidar_capacidad(depto_id)
+
+
+@receiver(post_save, sender=Empleado)
+@receiver(post_delete, sender=Empleado)
+def refrescar_capacidad_general(sender, instance, **kwargs):
+    """Un empleado que cambia de departamento mueve sus vacaciones de una línea a otra: se invalidan todas."""
+    invalidar_capacidad()
+
+
+@receiver(post_save, sender=Notificacion)
+@receiver(post_delete, sender=Notificacion)
+def avisar_cambio_notificacion(sender, instance, **kwargs):
+    """Despierta las esperas de long-poll del destinatario."""
+    avisar_notificaciones([instance.usuario_id])
+
+
+@receiver(post_save, sender=RegistroVacaciones)
+@receiver(post_delete, sender=RegistroVacaciones)
+def avisar_cambio_solicitud(sender, instance, **kwargs):
+    """Cualquier cambio de una solicitud puede mover el contador de pendientes de los managers."""
+    avisar_tareas()
+
+
+@receiver(post_save, sender=ConfiguracionEmail)
+@receiver(post_delete, sender=ConfiguracionEmail)
+def refrescar_config_email(sender, instance, **kwargs):
+    """Guardar la configuración (configurar_email o el admin) obliga a todos los procesos a recargarla."""
+    invalidar_config_email()
@@ -1,3 +1,1171 @@
-from django.test import TestCase
+import gzip
+import json
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.template import RequestContext, Template
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .calendario import CeldaSemana, calcular_ocupacion_semanal, esqueleto_anio, meses_de_anios, saldos_por_empleado
+from .capacidad import analizar_conflictos, lineas_capacidad, pico_ausentes
+from .ciclos import en_anio
+from .datos_sinteticos import PREFIJO_DNI, USUARIO_ADMIN, generar_dataset, limpiar_dataset
+from .context_processors import notificaciones_context
+from .dias_habiles import contar_dias_habiles, contar_dias_habiles_lote, invalidar_festivos
+from .notificaciones import resumen_cacheado, version_notificaciones
+from .transiciones import SaldoInsuficiente, TransicionInvalida, transicionar
+from . import perfilado
+from . import urls as urls_gestion
+from .utils import (
+    conexion_smtp_activa, enviar_email_cambio_estado, ids_administradores, invalidar_config_email, notificar_usuarios
+)
+from .models import (
+    ConfiguracionEmail, ConflictoDeVersion, ConsumoVacaciones, CorreoSaliente, Departamento, DiasFestivos, Empleado, Notificacion, RegistroVacaciones,
+    SaldoVacaciones
+)
+
+
+class CalendarioGlobalQueriesTest(TestCase):
+    """La planificación anual debe resolverse con un número fijo de consultas."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'clave-segura')
+        Empleado.objects.create(
+            user=cls.admin, legajo='ADMIN', dni='0', nombre='Admin', apellido='Sistema',
+            fecha_ingreso=date(2010, 1, 1), es_manager=True, primer_login=False
+        )
+        cls.deptos = [Departamento.objects.create(nombre=f'Depto {i}') for i in range(3)]
+
+    def _crear_empleados(self, cantidad, offset=0):
+        anio = date.today().year
+        for i in range(offset, offset + cantidad):
+            emp = Empleado.objects.create(
+                legajo=f'L{i}', dni=f'D{i}', nombre=f'Nombre{i}', apellido=f'Apellido{i}',
+                departamento=self.deptos[i % len(self.deptos)], fecha_ingreso=date(2015, 3, 1)
+            )
+            inicio = date(anio, 2, 1) + timedelta(days=i)
+            RegistroVacaciones.objects.create(
+                empleado=emp, fecha_inicio=inicio, fecha_fin=inicio + timedelta(days=4),
+                estado=RegistroVacaciones.ESTADO_APROBADA
+            )
+            RegistroVacaciones.objects.create(
+                empleado=emp, fecha_inicio=inicio + timedelta(days=30), fecha_fin=inicio + timedelta(days=31),
+                estado=RegistroVacaciones.ESTADO_PENDIENTE
+            )
+
+    def _contar_consultas(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('gestion:calendario_global'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries), response
+
+    def test_consultas_no_crecen_con_la_plantilla(self):
+        self.client.force_login(self.admin)
+        self._crear_empleados(5)
+        self._contar_consultas()  # Primera carga: crea los saldos faltantes
+        pocas, _ = self._contar_consultas()
+
+        self._crear_empleados(20, offset=5)
+        self._contar_consultas()
+        muchas, _ = self._contar_consultas()
+
+        self.assertEqual(pocas, muchas)
+
+    def test_contexto_agrupado_por_departamento(self):
+        self.client.force_login(self.admin)
+        self._crear_empleados(6)
+        _, response = self._contar_consultas()
+
+        departamentos_data = response.context['departamentos_data']
+        nombres = [d['departamento'].nombre if d['departamento'] else None for d in departamentos_data]
+        self.assertEqual(nombres, ['Depto 0', 'Depto 1', 'Depto 2', None])
+
+        fila = next(e for d in departamentos_data for e in d['empleados'] if e['empleado'].legajo == 'L0')
+        saldo = SaldoVacaciones.objects.get(empleado=fila['empleado'], ciclo=date.today().year)
+        self.assertEqual(len(fila['vacaciones']), 2)
+        self.assertEqual(fila['dias_disponibles'], saldo.dias_base_ciclo())
+        self.assertEqual(fila['dias_restantes'], saldo.dias_totales() - 5)
+
+
+class OcupacionSemanalTest(TestCase):
+    """La grilla precalculada debe coincidir con el conteo día por día."""
+
+    def test_union_de_intervalos_y_estado_dominante(self):
+        lunes = date(2025, 1, 6)
+        semanas = [semana for mes in esqueleto_anio(2025) for semana in mes.semanas][1:4]
+        self.assertEqual(semanas[0].inicio, lunes)
+        vacaciones = [
+            RegistroVacaciones(fecha_inicio=date(2025, 1, 10), fecha_fin=date(2025, 1, 14),
+                               estado=RegistroVacaciones.ESTADO_PENDIENTE),
+            # Se solapa con la anterior: los días no se cuentan dos veces
+            RegistroVacaciones(fecha_inicio=date(2025, 1, 13), fecha_fin=date(2025, 1, 13),
+                               estado=RegistroVacaciones.ESTADO_APROBADA),
+        ]
+
+        celdas = calcular_ocupacion_semanal(semanas, vacaciones)
+
+        self.assertEqual(celdas, [
+            CeldaSemana(3, 'pendiente'),
+            CeldaSemana(2, 'aprobada'),
+            CeldaSemana(0, None),
+        ])
+
+
+class EsqueletoCalendarioTest(TestCase):
+    """El esqueleto anual se cachea y la vista multi-año no debe alterar los meses cacheados."""
+
+    def test_semanas_por_mes_y_cache_intacto(self):
+        meses = esqueleto_anio(2025)
+        # 1/1/2025 es miércoles: la primera semana arranca el lunes 30/12/2024 y va a Enero
+        self.assertEqual(meses[0].semanas[0].inicio, date(2024, 12, 30))
+        self.assertEqual(meses[0].semanas[0].rango, '30/12/24-5/1/25')
+        self.assertEqual(sum(mes.total_semanas for mes in meses), 53)
+
+        todos = meses_de_anios((2024, 2025))
+        self.assertEqual([m.nombre for m in todos[:2]], ['Ene 24', 'Feb 24'])
+        self.assertEqual(todos[12].nombre, 'Ene 25')
+        self.assertIs(todos[12].semanas, meses[0].semanas)
+        self.assertEqual(esqueleto_anio(2025)[0].nombre, 'Ene')
+        self.assertIs(esqueleto_anio(2025), meses)
+
+
+class LibroConsumosTest(TestCase):
+    """El libro de consumos debe seguir a las aprobaciones, cancelaciones, movimientos y borrados."""
+
+    def setUp(self):
+        self.empleado = Empleado.objects.create(
+            legajo='C1', dni='C1', nombre='Ana', apellido='Paz', fecha_ingreso=date(2012, 5, 1)
+        )
+        self.saldo_2024 = SaldoVacaciones.objects.create(empleado=self.empleado, ciclo=2024, dias_iniciales=21)
+        self.saldo_2025 = SaldoVacaciones.objects.create(empleado=self.empleado, ciclo=2025, dias_iniciales=21)
+
+    def _consumos(self):
+        return self.saldo_2024.dias_consumidos_total(), self.saldo_2025.dias_consumidos_total()
+
+    def test_movimientos_actualizan_el_libro(self):
+        self.assertEqual(self._consumos(), (0, 0))
+
+        vac = RegistroVacaciones.objects.create(
+            empleado=self.empleado, fecha_inicio=date(2025, 1, 6), fecha_fin=date(2025, 1, 10)
+        )
+        self.assertEqual(self._consumos(), (0, 0))
+
+        vac.estado = RegistroVacaciones.ESTADO_APROBADA
+        vac.save()
+        self.assertEqual(self._consumos(), (5, 5))
+
+        # Mover al año anterior: solo cuenta para el ciclo 2024
+        vac = RegistroVacaciones.objects.get(pk=vac.pk)
+        vac.fecha_inicio, vac.fecha_fin = date(2024, 12, 2), date(2024, 12, 4)
+        vac.save()
+        self.assertEqual(self._consumos(), (3, 0))
+
+        vac.estado = RegistroVacaciones.ESTADO_CANCELADA
+        vac.save()
+        self.assertEqual(self._consumos(), (0, 0))
+
+        otra = RegistroVacaciones.objects.create(
+            empleado=self.empleado, fecha_inicio=date(2025, 3, 3), fecha_fin=date(2025, 3, 4),
+            estado=RegistroVacaciones.ESTADO_APROBADA
+        )
+        self.assertEqual(self._consumos(), (2, 2))
+        RegistroVacaciones.objects.get(pk=otra.pk).delete()
+        self.assertEqual(self._consumos(), (0, 0))
+
+    def test_movimiento_crea_el_ciclo_que_falta_en_el_libro(self):
+        vac = RegistroVacaciones.objects.create(
+            empleado=self.empleado, fecha_inicio=date(2025, 1, 6), fecha_fin=date(2025, 1, 10)
+        )
+        self.assertFalse(ConsumoVacaciones.objects.filter(empleado=self.empleado).exists())
+
+        vac.estado = RegistroVacaciones.ESTADO_APROBADA
+        vac.save()
+        libro = dict(ConsumoVacaciones.objects.filter(empleado=self.empleado).values_list('ciclo', 'dias_consumidos'))
+        self.assertEqual(libro, {2024: 5, 2025: 5})
+
+        # Lo que obtener() hubiera calculado antes de la aprobación ya no puede pisar la fila
+        consumo, creado = ConsumoVacaciones.objects.get_or_create(
+            empleado=self.empleado, ciclo=2025, defaults={'dias_consumidos': 0}
+        )
+        self.assertEqual((creado, consumo.dias_consumidos), (False, 5))
+
+        # Un ciclo que falta junto a otro que ya existe: uno se crea y el otro recibe el cambio
+        ConsumoVacaciones.objects.filter(empleado=self.empleado, ciclo=2024).delete()
+        vac = RegistroVacaciones.objects.get(pk=vac.pk)
+        vac.fecha_fin = date(2025, 1, 7)
+        vac.save()
+        self.assertEqual(self._consumos(), (2, 2))
+
+    def test_reconstruir_y_verificar(self):
+        RegistroVacaciones.objects.create(
+            empleado=self.empleado, fecha_inicio=date(2025, 1, 6), fecha_fin=date(2025, 1, 10),
+            estado=RegistroVacaciones.ESTADO_APROBADA
+        )
+        self._consumos()
+        ConsumoVacaciones.objects.filter(empleado=self.empleado).update(dias_consumidos=99)
+
+        with self.assertRaises(CommandError):
+            call_command('reconstruir_consumos', verificar=True, stdout=StringIO())
+
+        call_command('reconstruir_consumos', stdout=StringIO())
+        self.assertEqual(self._consumos(), (5, 5))
+        call_command('reconstruir_consumos', verificar=True, stdout=StringIO())
+
+
+class SaldosAnotadosTest(TestCase):
+    """with_balances() debe resolver los saldos de un listado en una sola consulta."""
+
+    def test_balances_sin_consultas_por_fila(self):
+        for i in range(4):
+            emp = Empleado.objects.create(
+                legajo=f'S{i}', dni=f'S{i}', nombre='N', apellido=f'A{i}', fecha_ingreso=date(2018, 1, 1)
+            )
+            SaldoVacaciones.objects.create(empleado=emp, ciclo=2025, dias_iniciales=14, dias_adicionales=3)
+            RegistroVacaciones.objects.create(
+                empleado=emp, fecha_inicio=date(2025, 2, 3), fecha_fin=date(2025, 2, 3 + i),
+                estado=RegistroVacaciones.ESTADO_APROBADA
+            )
+        # Un ciclo materializado en el libro y el resto resuelto por el Sum de respaldo
+        SaldoVacaciones.objects.get(empleado__legajo='S0', ciclo=2025).dias_consumidos_total()
+
+        esperados = {
+            s.empleado.legajo: (s.dias_consumidos_total(), s.dias_acumulados_restantes(), s.total_disponible())
+            for s in SaldoVacaciones.objects.filter(ciclo=2025)
+        }
+
+        with self.assertNumQueries(1):
+            obtenidos = {
+                s.empleado.legajo: (s.dias_consumidos_total(), s.dias_acumulados_restantes(), s.total_disponible())
+                for s in SaldoVacaciones.objects.filter(ciclo=2025).with_balances()
+            }
+
+        self.assertEqual(obtenidos, esperados)
+        self.assertEqual(obtenidos['S2'], (3, 0, 21))
+
+    def test_saldos_creados_en_bloque_vienen_anotados(self):
+        empleados = [
+            Empleado.objects.create(
+                legajo=f'C{i}', dni=f'C{i}', nombre='N', apellido=f'A{i}', fecha_ingreso=date(2018, 1, 1)
+            )
+            for i in range(3)
+        ]
+        # Primer uso del ciclo: ningún saldo existe todavía
+        saldos = saldos_por_empleado(empleados, 2025, con_balances=True)
+        with self.assertNumQueries(0):
+            disponibles = [saldos[e.id].total_disponible() for e in empleados]
+        self.assertEqual(disponibles, [21, 21, 21])
+
+
+class FiltrosPorCicloTest(TestCase):
+    """Los filtros por año/ciclo se expresan como rangos de fechas, sin EXTRACT(YEAR) sobre la columna."""
+
+    def test_respaldo_por_ciclo_con_rango(self):
+        emp = Empleado.objects.create(legajo='C1', dni='C1', nombre='N', apellido='A', fecha_ingreso=date(2018, 1, 1))
+        SaldoVacaciones.objects.create(empleado=emp, ciclo=2025, dias_iniciales=14)
+        for inicio in (date(2024, 12, 30), date(2025, 1, 1), date(2026, 3, 2)):
+            RegistroVacaciones.objects.create(
+                empleado=emp, fecha_inicio=inicio, fecha_fin=inicio + timedelta(days=1),
+                estado=RegistroVacaciones.ESTADO_APROBADA
+            )
+
+        with CaptureQueriesContext(connection) as consultas:
+            saldo = SaldoVacaciones.objects.with_balances().get()
+        self.assertEqual(saldo.dias_consumidos_total(), 4)
+        self.assertNotIn('extract', consultas[0]['sql'].lower())
+
+        self.assertEqual(RegistroVacaciones.objects.filter(en_anio('fecha_inicio', 2025)).count(), 1)
+
+
+class DiasHabilesTest(TestCase):
+    """El cálculo aritmético debe coincidir con el recorrido día por día."""
+
+    def setUp(self):
+        for fecha in (date(2024, 12, 25), date(2025, 1, 1), date(2025, 3, 8), date(2025, 5, 1)):
+            DiasFestivos.objects.create(fecha=fecha, descripcion='Feriado')
+
+    def _contar_a_mano(self, inicio, fin):
+        festivos = set(DiasFestivos.objects.values_list('fecha', flat=True))
+        dias = 0
+        actual = inicio
+        while actual <= fin:
+            if actual.weekday() < 5 and actual not in festivos:
+                dias += 1
+            actual += timedelta(days=1)
+        return dias
+
+    def test_lote_coincide_con_el_recorrido(self):
+        rangos = [
+            (date(2024, 12, 20), date(2025, 1, 10)),
+            (date(2025, 3, 3), date(2025, 3, 9)),  # El 8/3 cae sábado: no resta
+            (date(2025, 4, 28), date(2025, 5, 2)),
+            (date(2025, 5, 3), date(2025, 5, 4)),
+            (date(2025, 1, 10), date(2025, 1, 1)),  # Rango invertido
+            (date(2023, 6, 1), date(2025, 12, 31)),
+        ]
+        with self.assertNumQueries(1):
+            obtenidos = contar_dias_habiles_lote(rangos)
+        self.assertEqual(obtenidos, [self._contar_a_mano(i, f) for i, f in rangos])
+
+    def test_alta_de_feriado_invalida_el_cache(self):
+        lunes, viernes = date(2025, 6, 16), date(2025, 6, 20)
+        self.assertEqual(contar_dias_habiles(lunes, viernes), 5)
+        DiasFestivos.objects.create(fecha=date(2025, 6, 20), descripcion='Güemes')
+        self.assertEqual(contar_dias_habiles(lunes, viernes), 4)
+
+
+class AsistenteConflictosTest(TestCase):
+    """Los solapamientos del asistente deben coincidir con la consulta por pedido que reemplazan."""
+
+    def test_barrido_coincide_con_consulta_por_pedido(self):
+        deptos = [Departamento.objects.create(nombre=f'Sector {i}') for i in range(2)]
+        inicio = date(2025, 3, 3)
+        for i in range(12):
+            emp = Empleado.objects.create(
+                legajo=f'K{i}', dni=f'K{i}', nombre=f'N{i}', apellido=f'A{i}',
+                departamento=deptos[i % 2], fecha_ingreso=date(2015, 1, 1)
+            )
+            for j, estado in enumerate((RegistroVacaciones.ESTADO_PENDIENTE, RegistroVacaciones.ESTADO_APROBADA)):
+                desde = inicio + timedelta(days=(i * 3 + j * 11) % 25)
+                RegistroVacaciones.objects.create(
+                    empleado=emp, fecha_inicio=desde, fecha_fin=desde + timedelta(days=(i + j) % 9), estado=estado
+                )
+        Empleado.objects.create(legajo='SD', dni='SD', nombre='Sin', apellido='Depto', fecha_ingreso=date(2015, 1, 1))
+
+        pendientes = list(
+            RegistroVacaciones.objects.filter(estado=RegistroVacaciones.ESTADO_PENDIENTE)
+            .select_related('empleado__departamento')
+        )
+        # Intervalos, dotación y líneas de capacidad; con las líneas en cache, solo las dos primeras
+        with self.assertNumQueries(3):
+            analizar_conflictos(pendientes)
+        with self.assertNumQueries(2):
+            analizar_conflictos(pendientes)
+
+        for sol in pendientes:
+            esperados = RegistroVacaciones.objects.filter(
+                empleado__departamento=sol.empleado.departamento,
+                estado__in=[RegistroVacaciones.ESTADO_APROBADA, RegistroVacaciones.ESTADO_PENDIENTE],
+                fecha_inicio__lte=sol.fecha_fin, fecha_fin__gte=sol.fecha_inicio
+            ).exclude(id=sol.id)
+            self.assertEqual(sol.overlap_count, esperados.count())
+            self.assertEqual(
+                sorted(sol.overlap_names),
+                sorted(f"{v.empleado.nombre} {v.empleado.apellido} ({v.estado})" for v in esperados)
+            )
+            pico = max(
+                sum(
+                    1 for emp in Empleado.objects.filter(departamento=sol.empleado.departamento)
+                    if emp.registrovacaciones_set.filter(
+                        estado__in=[RegistroVacaciones.ESTADO_APROBADA, RegistroVacaciones.ESTADO_PENDIENTE],
+                        fecha_inicio__lte=dia, fecha_fin__gte=dia
+                    ).exists()
+                )
+                for dia in (sol.fecha_inicio + timedelta(days=n) for n in range((sol.fecha_fin - sol.fecha_inicio).days + 1))
+            )
+            self.assertEqual(sol.capacidad_pct, max(int((6 - pico) / 6 * 100), 0))
+
+
+class LineaCapacidadTest(TestCase):
+    """La línea de capacidad cuenta personas por día y se invalida al cambiar un pedido."""
+
+    def test_conteo_diario_e_invalidacion(self):
+        depto = Departamento.objects.create(nombre='Planta')
+        ana, beto = [
+            Empleado.objects.create(
+                legajo=f'P{i}', dni=f'P{i}', nombre=n, apellido='X', departamento=depto, fecha_ingreso=date(2015, 1, 1)
+            )
+            for i, n in enumerate(('Ana', 'Beto'))
+        ]
+        RegistroVacaciones.objects.create(
+            empleado=ana, fecha_inicio=date(2025, 12, 29), fecha_fin=date(2026, 1, 2),
+            estado=RegistroVacaciones.ESTADO_APROBADA
+        )
+        # Pedido superpuesto de la misma persona: no la cuenta dos veces
+        RegistroVacaciones.objects.create(empleado=ana, fecha_inicio=date(2025, 12, 30), fecha_fin=date(2025, 12, 31))
+        pedido = RegistroVacaciones.objects.create(
+            empleado=beto, fecha_inicio=date(2025, 12, 31), fecha_fin=date(2026, 1, 5)
+        )
+
+        lineas = lineas_capacidad([depto.id], [2025, 2026])
+        self.assertEqual(lineas[(depto.id, 2025)].serie(date(2025, 12, 28), date(2025, 12, 31)), [0, 1, 1, 2])
+        self.assertEqual(lineas[(depto.id, 2025)].maximo(date(2025, 1, 1), date(2025, 12, 31), solo_aprobadas=True), 1)
+        self.assertEqual(pico_ausentes(lineas, depto.id, date(2025, 12, 1), date(2026, 1, 31)), 2)
+
+        with self.assertNumQueries(0):
+            lineas_capacidad([depto.id], [2025, 2026])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pedido.estado = RegistroVacaciones.ESTADO_RECHAZADA
+            pedido.save()
+            # Hasta confirmar la transacción la versión no cambia: nadie guarda la línea nueva antes de tiempo
+            with self.assertNumQueries(0):
+                lineas_capacidad([depto.id], [2025, 2026])
+        lineas = lineas_capacidad([depto.id], [2025, 2026])
+        self.assertEqual(lineas[(depto.id, 2026)].serie(date(2026, 1, 1), date(2026, 1, 3)), [1, 1, 0])
+
+
+class LongPollNotificacionesTest(TestCase):
+    """El long-poll responde solo cuando cambia la versión y no consulta la base mientras espera."""
+
+    def setUp(self):
+        # Las versiones viven en el cache, que no se revierte entre tests
+        cache.clear()
+        self.user = User.objects.create_user('ana', 'ana@example.com', 'clave-segura')
+        Empleado.objects.create(
+            user=self.user, legajo='N1', dni='N1', nombre='Ana', apellido='Paz',
+            fecha_ingreso=date(2015, 1, 1), primer_login=False
+        )
+        self.client.force_login(self.user)
+        self.url = reverse('gestion:api_esperar_notificaciones')
+
+    def test_responde_solo_ante_cambios(self):
+        data = self.client.get(self.url, {'last_id': 0}).json()
+        self.assertEqual(data['unread_count'], 0)
+
+        with mock.patch('gestion.notificaciones.LONG_POLL_SEGUNDOS', 0):
+            response = self.client.get(self.url, {'last_id': 0, 'version': data['version']})
+        self.assertEqual(response.status_code, 204)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            notif = Notificacion.objects.create(usuario=self.user, titulo='Hola', mensaje='Nueva')
+        nuevo = self.client.get(self.url, {'last_id': 0, 'version': data['version']}).json()
+        self.assertNotEqual(nuevo['version'], data['version'])
+        self.assertEqual(nuevo['unread_count'], 1)
+        self.assertEqual([n['id'] for n in nuevo['nuevas']], [notif.id])
+
+
+class ResumenNotificacionesTest(TestCase):
+    """El resumen de la campana se sirve desde el cache y se invalida con las escrituras."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cache_e_invalidacion(self):
+        manager_user = User.objects.create_user('jefe', 'jefe@example.com', 'clave-segura')
+        manager = Empleado.objects.create(
+            user=manager_user, legajo='M1', dni='M1', nombre='Jefe', apellido='Uno',
+            fecha_ingreso=date(2010, 1, 1), es_manager=True, primer_login=False
+        )
+        empleado = Empleado.objects.create(
+            legajo='E1', dni='E1', nombre='Emp', apellido='Uno', fecha_ingreso=date(2015, 1, 1),
+            manager_aprobador=manager
+        )
+        self.client.force_login(manager_user)
+        url = reverse('gestion:api_check_notificaciones')
+
+        data = self.client.get(url).json()
+        self.assertEqual((data['unread_count'], data['tareas_pendientes']), (0, 0))
+
+        # Caso común: mismo estado, solo sesión, usuario y empleado (PrimerLoginMiddleware)
+        with self.assertNumQueries(3):
+            self.client.get(url, {'last_id': data['last_id']})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RegistroVacaciones.objects.create(
+                empleado=empleado, manager_aprobador=manager,
+                fecha_inicio=date(2025, 5, 5), fecha_fin=date(2025, 5, 9)
+            )
+            Notificacion.objects.create(usuario=manager_user, titulo='Nueva solicitud', mensaje='Emp Uno')
+        data = self.client.get(url, {'last_id': data['last_id']}).json()
+        self.assertEqual((data['unread_count'], data['tareas_pendientes'], len(data['nuevas'])), (2, 1, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('gestion:lista_notificaciones'), {'marcar_todas': '1'})
+        data = self.client.get(url, {'last_id': data['last_id']}).json()
+        self.assertEqual((data['unread_count'], data['tareas_pendientes']), (1, 1))
+
+    def test_version_cambia_al_confirmar(self):
+        user = User.objects.create_user('beto', 'beto@example.com', 'clave-segura')
+        version = version_notificaciones(user)
+
+        # Una escritura revertida no cambia la versión
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Notificacion.objects.create(usuario=user, titulo='Aviso', mensaje='Revertido')
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        self.assertEqual(version_notificaciones(user), version)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Notificacion.objects.create(usuario=user, titulo='Aviso', mensaje='Uno')
+                # Sin confirmar: quien lea ahora guarda el resumen bajo la versión vieja, que queda descartada
+                self.assertEqual(resumen_cacheado(user)[0], version)
+        self.assertNotEqual(version_notificaciones(user), version)
+
+
+class ContextoNotificacionesPerezosoTest(TestCase):
+    """El contexto de la campana solo consulta cuando un template usa sus variables."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_sin_consultas_si_el_template_no_usa_la_campana(self):
+        user = User.objects.create_user('beto', 'beto@example.com', 'clave-segura')
+        Notificacion.objects.create(usuario=user, titulo='Aviso', mensaje='Uno')
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(pk=user.pk)
+
+        with self.assertNumQueries(0):
+            contexto = notificaciones_context(request)
+            Template('Hola').render(RequestContext(request, contexto))
+
+        html = Template(
+            '{% if notif_count > 0 %}{{ notif_count }}{% endif %}|'
+            '{% for n in notif_list_preview %}{{ n.titulo }}{% endfor %}'
+        ).render(RequestContext(request, contexto))
+        self.assertEqual(html, '1|Aviso')
+
+
+class BandejaSalidaCorreosTest(TestCase):
+    """Los emails se encolan al confirmar la transacción y el worker los envía con reintentos."""
+
+    def setUp(self):
+        user = User.objects.create_user('caro', 'caro@example.com', 'clave-segura')
+        empleado = Empleado.objects.create(
+            user=user, legajo='B1', dni='B1', nombre='Caro', apellido='Sol', fecha_ingreso=date(2015, 1, 1)
+        )
+        self.solicitud = RegistroVacaciones.objects.create(
+            empleado=empleado, fecha_inicio=date(2025, 7, 7), fecha_fin=date(2025, 7, 11),
+            estado=RegistroVacaciones.ESTADO_APROBADA
+        )
+        self.request = RequestFactory().get('/')
+
+    def test_encola_al_confirmar_y_envia(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(enviar_email_cambio_estado(self.request, self.solicitud))
+            self.assertFalse(CorreoSaliente.objects.exists())
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('procesar_correos', una_vez=True, stdout=StringIO())
+
+        correo = CorreoSaliente.objects.get()
+        self.assertEqual(correo.estado, CorreoSaliente.ESTADO_ENVIADO)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['caro@example.com'])
+
+    def test_reintento_con_espera(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enviar_email_cambio_estado(self.request, self.solicitud)
+
+        with mock.patch('django.core.mail.EmailMultiAlternatives.send', side_effect=OSError('SMTP caído')):
+            call_command('procesar_correos', una_vez=True, stdout=StringIO())
+
+        correo = CorreoSaliente.objects.get()
+        self.assertEqual((correo.estado, correo.intentos, correo.ultimo_error), (CorreoSaliente.ESTADO_PENDIENTE, 1, 'SMTP caído'))
+        self.assertGreater(correo.proximo_intento, timezone.now())
+
+        # Cuando llega su turno, el siguiente intento lo envía
+        CorreoSaliente.objects.update(proximo_intento=timezone.now())
+        call_command('procesar_correos', una_vez=True, stdout=StringIO())
+        self.assertEqual(CorreoSaliente.objects.get().estado, CorreoSaliente.ESTADO_ENVIADO)
+
+
+class NotificacionesMasivasTest(TestCase):
+    """El aviso a varios usuarios se resuelve con un solo INSERT y sin duplicados."""
+
+    def setUp(self):
+        cache.clear()
+        self.admins = [User.objects.create_superuser(f'admin{i}', f'a{i}@example.com', 'clave-segura') for i in range(3)]
+
+    def test_un_insert_sin_duplicados_y_avisa(self):
+        ids = ids_administradores()
+        version = version_notificaciones(self.admins[0])
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+            notificados = notificar_usuarios(ids + ids, 'Aviso', 'Mensaje', excluir=[self.admins[1].id])
+
+        self.assertEqual(sorted(notificados), sorted([self.admins[0].id, self.admins[2].id]))
+        self.assertEqual(Notificacion.objects.count(), 2)
+        # bulk_create no dispara señales: la campana igual debe enterarse
+        self.assertNotEqual(version_notificaciones(self.admins[0]), version)
+
+
+class ConfiguracionEmailCacheadaTest(TestCase):
+    """La configuración SMTP se lee de memoria hasta que alguien la guarda."""
+
+    def setUp(self):
+        cache.clear()
+        # Las filas se revierten al final del test sin señales: no dejar la copia en memoria a los demás
+        self.addCleanup(invalidar_config_email)
+        self.config = ConfiguracionEmail.objects.create(
+            email_host='smtp.uno.test', email_host_user='uno@example.com', email_host_password='x'
+        )
+
+    @override_settings(CACHE_COMPARTIDO=True)
+    def test_sin_consultas_hasta_guardar(self):
+        conexion_smtp_activa()
+        with self.assertNumQueries(0):
+            conexion, remitente = conexion_smtp_activa()
+        self.assertEqual((conexion.host, remitente), ('smtp.uno.test', 'uno@example.com'))
+
+        self.config.email_host = 'smtp.dos.test'
+        self.config.save()
+        with self.assertNumQueries(1):
+            conexion, _ = conexion_smtp_activa()
+        self.assertEqual(conexion.host, 'smtp.dos.test')
+
+    @override_settings(CACHE_COMPARTIDO=False)
+    def test_sin_cache_compartido_usa_el_sello_de_la_fila(self):
+        conexion_smtp_activa()
+        # Dentro del TTL del sello los envíos no consultan la base
+        with self.assertNumQueries(0):
+            conexion_smtp_activa()
+
+        # Guardado desde otro proceso (la web): la señal no toca el cache de este
+        ConfiguracionEmail.objects.filter(pk=self.config.pk).update(
+            email_host='smtp.tres.test', fecha_modificacion=timezone.now() + timedelta(seconds=1)
+        )
+        with self.assertNumQueries(0):
+            conexion, _ = conexion_smtp_activa()
+        self.assertEqual(conexion.host, 'smtp.uno.test')
+
+        # Vencido el TTL se relee el sello y, como cambió, la configuración
+        with mock.patch('gestion.utils.TTL_SELLO_CONFIG_EMAIL', -1), self.assertNumQueries(2):
+            conexion, _ = conexion_smtp_activa()
+        self.assertEqual(conexion.host, 'smtp.tres.test')
+
+
+class BenchmarkVistasTest(TestCase):
+    """El set sintético es coherente y todas las vistas medidas responden sobre él."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_dataset_y_reporte(self):
+        totales = generar_dataset(departamentos=2, empleados=6, anios=1, solicitudes_por_anio=2, notificaciones_por_usuario=3)
+        self.assertEqual(totales['empleados'], 7)
+        # El libro generado coincide con el que reconstruiría el comando
+        call_command('reconstruir_consumos', verificar=True, stdout=StringIO())
+
+        salida = StringIO()
+        call_command('benchmark_vistas', repeticiones=2, calentamiento=0, stdout=salida)
+        reporte = json.loads(salida.getvalue())
+        self.assertEqual(len(reporte['vistas']), 7)
+        for vista in reporte['vistas'].values():
+            self.assertEqual(vista['estado'], 200)
+            self.assertIn('p95', vista['latencia_ms'])
+
+        limpiar_dataset()
+        self.assertFalse(Empleado.objects.exists())
+
+
+class PerfiladoTest(TestCase):
+    """El middleware de perfilado mide cada pedido y lo expone a staff (cabecera y tabla)."""
+
+    def setUp(self):
+        perfilado.reiniciar()
+        self.staff = User.objects.create_user('staff', 'staff@example.com', 'clave-segura', is_staff=True)
+        self.client.force_login(self.staff)
+
+    def test_server_timing_y_tabla(self):
+        respuesta = self.client.get(reverse('gestion:api_check_notificaciones'))
+        self.assertIn('sql;dur=', respuesta['Server-Timing'])
+        self.assertIn('total;dur=', respuesta['Server-Timing'])
+
+        datos = self.client.get(reverse('gestion:estadisticas_rendimiento'), {'formato': 'json'}).json()
+        fila = next(f for f in datos['vistas'] if f['vista'] == 'gestion:api_check_notificaciones')
+        self.assertEqual(fila['pedidos'], 1)
+        self.assertGreater(fila['consultas_media'], 0)
+        self.assertContains(self.client.get(reverse('gestion:estadisticas_rendimiento')), 'gestion:api_check_notificaciones')
+
+    def test_long_poll_aparte(self):
+        Empleado.objects.create(
+            user=self.staff, legajo='S1', dni='S1', nombre='Sol', apellido='Staff',
+            fecha_ingreso=date(2015, 1, 1), primer_login=False
+        )
+        self.client.get(reverse('gestion:api_check_notificaciones'))
+        with mock.patch('gestion.notificaciones.LONG_POLL_SEGUNDOS', 0):
+            self.client.get(reverse('gestion:api_esperar_notificaciones'), {'last_id': 0, 'version': 'vieja'})
+
+        datos = self.client.get(reverse('gestion:estadisticas_rendimiento'), {'formato': 'json'}).json()
+        self.assertNotIn('gestion:api_esperar_notificaciones', [f['vista'] for f in datos['vistas']])
+        self.assertIn('gestion:api_check_notificaciones', [f['vista'] for f in datos['vistas']])
+        self.assertEqual([f['vista'] for f in datos['esperas']], ['gestion:api_esperar_notificaciones'])
+        self.assertContains(self.client.get(reverse('gestion:estadisticas_rendimiento')), 'Long-poll')
+
+    def test_solo_staff(self):
+        comun = User.objects.create_user('comun', 'comun@example.com', 'clave-segura')
+        self.client.force_login(comun)
+        respuesta = self.client.get(reverse('gestion:api_check_notificaciones'))
+        self.assertNotIn('Server-Timing', respuesta)
+        self.assertEqual(self.client.get(reverse('gestion:estadisticas_rendimiento')).status_code, 302)
+
+
+class PresupuestoConsultasTest(TestCase):
+    """
+    Máximo de consultas por vista, independiente del tamaño del plantel: se mide como administrador
+    sobre un set sintético chico y otra vez sobre uno cinco veces más grande. Un N+1 nuevo rompe el
+    presupuesto o hace crecer la cuenta entre una medición y otra.
+    """
+    PRESUPUESTOS = {
+        'dashboard': 32,
+        'cambiar_password': 7,
+        'solicitar_vacaciones': 9,
+        'calendario_global': 12,
+        'exportar_calendario_excel': 6,
+        'dias_disponibles': 15,
+        'solicitar_mis_vacaciones': 10,
+        'historial_personal': 15,
+        'mi_perfil': 8,
+        'exportar_notificacion_ics': 5,
+        'aprobacion_manager': 12,
+        'gestion_empleados': 11,
+        'crear_empleado': 7,
+        'editar_empleado': 13,
+        'eliminar_empleado': 10,
+        'historial_global': 10,
+        'gestion_saldos': 9,
+        'gestion_festivos': 9,
+        'calendario_manager': 4,
+        'calendario_interactivo': 7,
+        'api_vacaciones_listar': 7,
+        'configurar_email': 11,
+        'obtener_saldo_empleado': 11,
+        'exportar_notificacion_pdf': 12,
+        'lista_notificaciones': 9,
+        'api_check_notificaciones': 7,
+        'estadisticas_rendimiento': 7,
+    }
+    # Rutas que no se miden con un GET: solo POST, efectos externos (email, git, archivos) o long-poll
+    SIN_PRESUPUESTO = {
+        'api_vacaciones_mover', 'api_vacaciones_mover_lote', 'aprobar_rechazar', 'eliminar_festivo', 'marcar_notificacion_leida',
+        'probar_email', 'api_esperar_notificaciones', 'backup_dashboard', 'crear_backup_db', 'crear_backup_code',
+        'crear_backup_github', 'crear_backup_completo', 'descargar_backup', 'eliminar_backup',
+    }
+
+    def _argumentos(self, nombre):
+        empleado = Empleado.objects.filter(dni__startswith=PREFIJO_DNI, es_manager=False).order_by('id').first()
+        aprobada = RegistroVacaciones.objects.filter(
+            empleado=empleado, estado=RegistroVacaciones.ESTADO_APROBADA
+        ).order_by('id').first()
+        kwargs = {
+            'editar_empleado': {'empleado_id': empleado.id},
+            'eliminar_empleado': {'empleado_id': empleado.id},
+            'exportar_notificacion_ics': {'vacacion_id': aprobada.id},
+            'exportar_notificacion_pdf': {'empleado_id': empleado.id, 'vacacion_id': aprobada.id},
+        }.get(nombre, {})
+        parametros = {
+            'obtener_saldo_empleado': {'empleado_id': empleado.id, 'year': date.today().year},
+            'api_vacaciones_listar': {'start': f'{date.today().year}-01-01', 'end': f'{date.today().year}-02-01'},
+        }.get(nombre, {})
+        return kwargs, parametros
+
+    def _medir(self):
+        self.client.force_login(User.objects.get(username=USUARIO_ADMIN))
+        cuentas = {}
+        for nombre in self.PRESUPUESTOS:
+            kwargs, parametros = self._argumentos(nombre)
+            # Siempre en frío: sin caches de pedidos anteriores
+            cache.clear()
+            invalidar_festivos()
+            with CaptureQueriesContext(connection) as consultas:
+                respuesta = self.client.get(reverse(f'gestion:{nombre}', kwargs=kwargs), parametros)
+                if respuesta.streaming:
+                    b''.join(respuesta.streaming_content)
+            self.assertEqual(respuesta.status_code, 200, nombre)
+            cuentas[nombre] = len(consultas)
+        return cuentas
+
+    def test_todas_las_rutas_tienen_presupuesto(self):
+        nombres = {patron.name for patron in urls_gestion.urlpatterns}
+        self.assertEqual(nombres - set(self.PRESUPUESTOS) - self.SIN_PRESUPUESTO, set())
+
+    def test_presupuesto_independiente_del_plantel(self):
+        mediciones = []
+        for empleados in (6, 30):
+            generar_dataset(departamentos=2, empleados=empleados, anios=2, solicitudes_por_anio=2, notificaciones_por_usuario=3)
+            mediciones.append(self._medir())
+            limpiar_dataset()
+
+        chico, grande = mediciones
+        for nombre, presupuesto in self.PRESUPUESTOS.items():
+            with self.subTest(vista=nombre):
+                self.assertLessEqual(chico[nombre], presupuesto)
+                self.assertLessEqual(grande[nombre], presupuesto)
+                # Un margen de una consulta por caches que se llenan en el primer pedido
+                self.assertLessEqual(grande[nombre], chico[nombre] + 1)
+
+
+class ApiVacacionesListarTest(TestCase):
+    """La API del planificador exige ventana, filtra estados en SQL y responde 304 si nada cambió."""
+
+    def setUp(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'clave-segura')
+        self.empleado = Empleado.objects.create(
+            legajo='P1', dni='P1', nombre='Pía', apellido='Luna', fecha_ingreso=date(2015, 1, 1)
+        )
+        for estado in (RegistroVacaciones.ESTADO_APROBADA, RegistroVacaciones.ESTADO_CANCELADA):
+            RegistroVacaciones.objects.create(
+                empleado=self.empleado, fecha_inicio=date(2025, 3, 3), fecha_fin=date(2025, 3, 7), estado=estado
+            )
+        self.client.force_login(admin)
+        self.url = reverse('gestion:api_vacaciones_listar')
+        self.ventana = {'start': '2025-02-24T00:00:00-03:00', 'end': '2025-04-07T00:00:00-03:00'}
+
+    def test_requiere_ventana(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+
+    def test_etag_y_304(self):
+        respuesta = self.client.get(self.url, self.ventana)
+        self.assertEqual([e['extendedProps']['estado'] for e in respuesta.json()], [RegistroVacaciones.ESTADO_APROBADA])
+        etag = respuesta['ETag']
+
+        self.assertEqual(self.client.get(self.url, self.ventana, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Mover la vacación cambia la huella
+        vacacion = RegistroVacaciones.objects.get(estado=RegistroVacaciones.ESTADO_APROBADA)
+        vacacion.fecha_fin = date(2025, 3, 10)
+        vacacion.save()
+        self.assertEqual(self.client.get(self.url, self.ventana, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_sigue_a_empleados_departamentos_y_feriados(self):
+        depto = Departamento.objects.create(nombre='Ventas')
+        feriado = DiasFestivos.objects.create(fecha=date(2025, 3, 24), descripcion='Memoria')
+
+        def cambiar(editar):
+            etag = self.client.get(self.url, self.ventana)['ETag']
+            editar()
+            return self.client.get(self.url, self.ventana, HTTP_IF_NONE_MATCH=etag).status_code
+
+        def renombrar_empleado():
+            self.empleado.nombre = 'Pilar'
+            self.empleado.save()
+
+        def cambiar_departamento():
+            self.empleado.departamento = depto
+            self.empleado.save()
+
+        def renombrar_departamento():
+            depto.nombre = 'Comercial'
+            depto.save()
+
+        def describir_feriado():
+            feriado.descripcion = 'Día de la Memoria'
+            feriado.save()
+
+        for editar in (renombrar_empleado, cambiar_departamento, renombrar_departamento, describir_feriado):
+            with self.subTest(cambio=editar.__name__):
+                self.assertEqual(cambiar(editar), 200)
+
+    def test_formato_compacto_equivale_a_eventos(self):
+        DiasFestivos.objects.create(fecha=date(2025, 3, 24), descripcion='Memoria')
+        eventos = self.client.get(self.url, self.ventana).json()
+        compacto = self.client.get(self.url, {**self.ventana, 'formato': 'compacto'}).json()
+
+        base = date.fromisoformat(compacto['base'])
+        vac = compacto['vacaciones']
+        self.assertEqual(vac['id'], [eventos[0]['id']])
+        self.assertEqual((base + timedelta(days=vac['inicio'][0])).isoformat(), eventos[0]['start'])
+        self.assertEqual(
+            (base + timedelta(days=vac['inicio'][0] + vac['dias'][0])).isoformat(), eventos[0]['end']
+        )
+        self.assertEqual(compacto['estados'][vac['estado'][0]], eventos[0]['extendedProps']['estado'])
+        self.assertEqual(compacto['empleados'], [[self.empleado.id, 'Pía Luna', -1]])
+        self.assertEqual(compacto['descripciones'][compacto['festivos']['descripcion'][0]], 'Memoria')
+        self.assertEqual((base + timedelta(days=compacto['festivos']['dia'][0])).isoformat(), '2025-03-24')
+
+    def test_compresion_gzip_negociada(self):
+        RegistroVacaciones.objects.bulk_create([
+            RegistroVacaciones(
+                empleado=self.empleado, fecha_inicio=date(2025, 3, 10 + i), fecha_fin=date(2025, 3, 10 + i),
+                estado=RegistroVacaciones.ESTADO_PENDIENTE, razon='Trámite'
+            )
+            for i in range(5)
+        ])
+        plano = self.client.get(self.url, self.ventana)
+        self.assertFalse(plano.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', plano['Vary'])
+
+        comprimido = self.client.get(self.url, self.ventana, HTTP_ACCEPT_ENCODING='gzip;q=1, br;q=0')
+        self.assertEqual(comprimido['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(comprimido.content), plano.content)
+        self.assertTrue(comprimido['ETag'].startswith('W/'))
+        # El ETag débil sigue sirviendo para revalidar
+        self.assertEqual(
+            self.client.get(self.url, self.ventana, HTTP_IF_NONE_MATCH=comprimido['ETag']).status_code, 304
+        )
+
+
+class MoverEnLoteTest(TestCase):
+    """El lote valida solapamientos, saldo y capacidad contra el estado que van dejando los movimientos anteriores."""
+
+    def setUp(self):
+        cache.clear()
+        manager_user = User.objects.create_user('jefa', password='clave-segura')
+        depto = Departamento.objects.create(nombre='Soporte')
+        self.manager = Empleado.objects.create(
+            user=manager_user, legajo='J1', dni='J1', nombre='Jefa', apellido='Soporte',
+            fecha_ingreso=date(2010, 1, 1), es_manager=True, departamento=depto, primer_login=False
+        )
+        self.ana, self.beto, self.caro = (
+            Empleado.objects.create(
+                legajo=f'L{i}', dni=f'D{i}', nombre=nombre, apellido='Soporte',
+                fecha_ingreso=date(2010, 1, 1), departamento=depto
+            )
+            for i, nombre in enumerate(['Ana', 'Beto', 'Caro'])
+        )
+        anio = date.today().year
+        self.ciclo = anio
+        self.vac_ana = RegistroVacaciones.objects.create(
+            empleado=self.ana, fecha_inicio=date(anio, 3, 2), fecha_fin=date(anio, 3, 6),
+            estado=RegistroVacaciones.ESTADO_APROBADA
+        )
+        self.vac_ana_2 = RegistroVacaciones.objects.create(
+            empleado=self.ana, fecha_inicio=date(anio, 4, 6), fecha_fin=date(anio, 4, 10),
+            estado=RegistroVacaciones.ESTADO_PENDIENTE
+        )
+        self.vac_beto = RegistroVacaciones.objects.create(
+            empleado=self.beto, fecha_inicio=date(anio, 5, 4), fecha_fin=date(anio, 5, 8),
+            estado=RegistroVacaciones.ESTADO_PENDIENTE
+        )
+        self.client.force_login(manager_user)
+        self.url = reverse('gestion:api_vacaciones_mover_lote')
+
+    def _mover(self, movimientos, todo_o_nada=True):
+        return self.client.post(
+            self.url, json.dumps({'movimientos': movimientos, 'todo_o_nada': todo_o_nada}),
+            content_type='application/json'
+        ).json()
+
+    def test_resultados_por_movimiento(self):
+        anio = self.ciclo
+        respuesta = self._mover([
+            # Alarga la aprobada de Ana dos días (pasa a 7)
+            {'id': self.vac_ana.id, 'start': f'{anio}-03-02', 'end': f'{anio}-03-09'},
+            # La pendiente de Ana cae sobre la aprobada ya movida: se superpone
+            {'id': self.vac_ana_2.id, 'start': f'{anio}-03-08', 'end': f'{anio}-03-10'},
+            {'id': 999999, 'start': f'{anio}-06-01'},
+        ], todo_o_nada=False)
+
+        self.assertEqual(respuesta['aplicados'], 1)
+        self.assertEqual([r['success'] for r in respuesta['resultados']], [True, False, False])
+        self.assertIn('superpone', respuesta['resultados'][1]['error'])
+        self.vac_ana.refresh_from_db()
+        self.assertEqual((self.vac_ana.fecha_fin, self.vac_ana.dias_solicitados), (date(anio, 3, 8), 7))
+        # El libro de consumos acompaña al bulk_update
+        self.assertEqual(ConsumoVacaciones.objects.obtener(self.ana.id, anio), 7)
+
+    def test_todo_o_nada_no_aplica_nada_si_algo_falla(self):
+        anio = self.ciclo
+        respuesta = self._mover([
+            {'id': self.vac_beto.id, 'start': f'{anio}-05-11', 'end': f'{anio}-05-16'},
+            {'id': self.vac_ana.id, 'start': f'{anio}-03-10', 'end': f'{anio}-03-05'},
+        ])
+        self.assertFalse(respuesta['success'])
+        self.assertEqual(respuesta['aplicados'], 0)
+        self.vac_beto.refresh_from_db()
+        self.assertEqual(self.vac_beto.fecha_inicio, date(anio, 5, 4))
+
+    def test_capacidad_minima_del_departamento(self):
+        anio = self.ciclo
+        # Con Ana y Beto juntos, de 4 personas quedan 2 (50%): entra justo
+        respuesta = self._mover([{'id': self.vac_beto.id, 'start': f'{anio}-03-02', 'end': f'{anio}-03-07'}])
+        self.assertTrue(respuesta['success'])
+
+        # Una tercera ausencia en la misma semana deja al equipo al 25%
+        vac_caro = RegistroVacaciones.objects.create(
+            empleado=self.caro, fecha_inicio=date(anio, 7, 6), fecha_fin=date(anio, 7, 7),
+            estado=RegistroVacaciones.ESTADO_PENDIENTE
+        )
+        respuesta = self._mover([{'id': vac_caro.id, 'start': f'{anio}-03-03', 'end': f'{anio}-03-05'}])
+        self.assertIn('capacidad', respuesta['resultados'][0]['error'])
+
+    def test_capacidad_no_cuenta_la_ausencia_propia(self):
+        anio = self.ciclo
+        # Departamento de una persona: cualquier vacación lo deja al 0%, moverla no lo empeora
+        solo = Empleado.objects.create(
+            legajo='L9', dni='D9', nombre='Dani', apellido='Guardia', fecha_ingreso=date(2010, 1, 1),
+            departamento=Departamento.objects.create(nombre='Guardia')
+        )
+        vac_solo = RegistroVacaciones.objects.create(
+            empleado=solo, fecha_inicio=date(anio, 8, 3), fecha_fin=date(anio, 8, 7),
+            estado=RegistroVacaciones.ESTADO_PENDIENTE
+        )
+        respuesta = self._mover([{'id': vac_solo.id, 'start': f'{anio}-08-10', 'end': f'{anio}-08-15'}])
+        self.assertTrue(respuesta['success'])
+
+        # Tres personas con dos ausentes (33%): acortar una de las dos ausencias de 4 a 3 días no suma a nadie
+        equipo = Departamento.objects.create(nombre='Depósito')
+        eva, fede, _ = (
+            Empleado.objects.create(
+                legajo=f'T{i}', dni=f'T{i}', nombre=nombre, apellido='Depósito',
+                fecha_ingreso=date(2010, 1, 1), departamento=equipo
+            )
+            for i, nombre in enumerate(['Eva', 'Fede', 'Gabi'])
+        )
+        vac_eva, _ = (
+            RegistroVacaciones.objects.create(
+                empleado=emp, fecha_inicio=date(anio, 9, 7), fecha_fin=date(anio, 9, 10),
+                estado=RegistroVacaciones.ESTADO_APROBADA
+            )
+            for emp in (eva, fede)
+        )
+        respuesta = self._mover([{'id': vac_eva.id, 'start': f'{anio}-09-07', 'end': f'{anio}-09-10'}])
+        self.assertTrue(respuesta['success'])
+        vac_eva.refresh_from_db()
+        self.assertEqual(vac_eva.dias_solicitados, 3)
+
+    def test_bloquea_saldos_antes_que_las_solicitudes(self):
+        anio = self.ciclo
+        with CaptureQueriesContext(connection) as consultas:
+            respuesta = self._mover([{'id': self.vac_beto.id, 'start': f'{anio}-05-11', 'end': f'{anio}-05-15'}])
+        self.assertTrue(respuesta['success'])
+        sql = [q['sql'] for q in consultas]
+        # Mismo orden que una aprobación: saldo del ciclo (creado si faltaba), después la solicitud completa
+        primer_saldo = next(i for i, q in enumerate(sql) if q.startswith('SELECT') and 'gestion_saldovacaciones' in q)
+        primera_solicitud = next(i for i, q in enumerate(sql) if '"gestion_registrovacaciones"."version"' in q)
+        self.assertLess(primer_saldo, primera_solicitud)
+        # Dentro de la transacción del lote nada se lee antes del bloqueo del saldo
+        inicio = max(i for i, q in enumerate(sql[:primer_saldo]) if q.startswith('SAVEPOINT'))
+        self.assertFalse([q for q in sql[inicio + 1:primer_saldo] if q.startswith('SELECT')])
+        self.assertNotIn('gestion_consumovacaciones', sql[primer_saldo])
+        self.assertTrue(SaldoVacaciones.objects.filter(empleado=self.beto, ciclo=anio).exists())
+
+
+class VersionOptimistaTest(TestCase):
+    """Mover y aprobar escriben con compare-and-swap sobre 'version' y reportan los conflictos."""
+
+    def setUp(self):
+        cache.clear()
+        manager_user = User.objects.create_user('jefe', password='clave-segura')
+        self.manager = Empleado.objects.create(
+            user=manager_user, legajo='M1', dni='M1', nombre='Jefe', apellido='Uno',
+            fecha_ingreso=date(2010, 1, 1), es_manager=True, primer_login=False
+        )
+        self.empleado = Empleado.objects.create(
+            user=User.objects.create_user('eva', 'eva@example.com', 'clave-segura'),
+            legajo='E1', dni='E1', nombre='Eva', apellido='Paz', fecha_ingreso=date(2010, 1, 1)
+        )
+        anio = date.today().year
+        self.vacacion = RegistroVacaciones.objects.create(
+            empleado=self.empleado, fecha_inicio=date(anio, 3, 2), fecha_fin=date(anio, 3, 6), razon='Viaje'
+        )
+        self.client.force_login(manager_user)
+
+    def _mover(self, version):
+        anio = date.today().year
+        return self.client.post(
+            reverse('gestion:api_vacaciones_mover'),
+            json.dumps({'id': self.vacacion.id, 'start': f'{anio}-03-09', 'end': f'{anio}-03-12', 'version': version}),
+            content_type='application/json'
+        )
+
+    def test_save_incrementa_version(self):
+        self.assertEqual(self.vacacion.version, 0)
+        self.vacacion.razon = 'Otro viaje'
+        self.vacacion.save()
+        self.assertEqual(self.vacacion.version, 1)
+
+    def test_mover_con_version_vieja_es_conflicto(self):
+        respuesta = self._mover(version=0)
+        self.assertEqual(respuesta.json()['version'], 1)
+
+        # Una segunda pestaña con la versión 0 ya no puede pisar el movimiento
+        respuesta = self._mover(version=0)
+        self.assertEqual(respuesta.status_code, 409)
+        self.assertTrue(respuesta.json()['conflicto'])
+
+    def test_mover_escribe_solo_las_fechas(self):
+        # Cambio de otra columna hecho por fuera (sin pasar por la versión): el UPDATE no la pisa
+        RegistroVacaciones.objects.filter(pk=self.vacacion.pk).update(razon='Editada')
+        self.assertTrue(self._mover(version=0).json()['success'])
+        self.vacacion.refresh_from_db()
+        self.assertEqual((self.vacacion.razon, self.vacacion.dias_solicitados), ('Editada', 3))
+
+    def test_aprobar_con_version_vieja_no_aprueba(self):
+        url = reverse('gestion:aprobar_rechazar', kwargs={'solicitud_id': self.vacacion.id})
+        self._mover(version=0)  # otro manager la movió mientras tanto
+
+        self.client.post(url, {'accion': 'aprobar', 'version': 0})
+        self.vacacion.refresh_from_db()
+        self.assertEqual(self.vacacion.estado, RegistroVacaciones.ESTADO_PENDIENTE)
+
+        self.client.post(url, {'accion': 'aprobar', 'version': self.vacacion.version})
+        self.vacacion.refresh_from_db()
+        self.assertEqual(self.vacacion.estado, RegistroVacaciones.ESTADO_APROBADA)
+        self.assertEqual(ConsumoVacaciones.objects.obtener(self.empleado.id, date.today().year), 3)
+
+    def test_lote_con_version_vieja_es_conflicto(self):
+        self._mover(version=0)
+        anio = date.today().year
+        respuesta = self.client.post(
+            reverse('gestion:api_vacaciones_mover_lote'),
+            json.dumps({'movimientos': [
+                {'id': self.vacacion.id, 'start': f'{anio}-04-06', 'end': f'{anio}-04-08', 'version': 0}
+            ]}),
+            content_type='application/json'
+        ).json()
+        self.assertTrue(respuesta['resultados'][0]['conflicto'])
+        self.assertEqual(respuesta['resultados'][0]['version'], 1)
+
+
+class TransicionesTest(TestCase):
+    """Máquina de estados: saldo bloqueado y leído una vez, UPDATE condicional al estado y la versión."""
+
+    def setUp(self):
+        cache.clear()
+        self.manager = Empleado.objects.create(
+            legajo='M1', dni='M1', nombre='Jefe', apellido='Uno', fecha_ingreso=date(2010, 1, 1), es_manager=True
+        )
+        # Ingresó hace menos de 5 años: 14 días base por LCT
+        self.empleado = Empleado.objects.create(
+            legajo='E1', dni='E1', nombre='Eva', apellido='Paz', fecha_ingreso=date(date.today().year - 2, 1, 1)
+        )
+        self.anio = date.today().year
+
+    def _pedido(self, dia, dias):
+        return RegistroVacaciones.objects.create(
+            empleado=self.empleado, fecha_inicio=date(self.anio, 2, dia),
+            fecha_fin=date(self.anio, 2, dia) + timedelta(days=dias - 1)
+        )
+
+    def test_aprobar_valida_contra_el_saldo_bloqueado(self):
+        SaldoVacaciones.objects.create(empleado=self.empleado, ciclo=self.anio, dias_iniciales=14)
+        with CaptureQueriesContext(connection) as consultas:
+            resultado = transicionar(self._pedido(2, 10), 'aprobar', self.manager)
+        self.assertEqual(resultado.saldo_disponible, 4)
+        # Validación: primero se bloquea la fila (sin el consumo) y recién después se lee el consumo
+        sql = [q['sql'] for q in consultas]
+        validacion = sql[:next(i for i, q in enumerate(sql) if q.startswith('UPDATE "gestion_registrovacaciones"'))]
+        lecturas_saldo = [q for q in validacion if q.startswith('SELECT') and 'gestion_saldovacaciones' in q]
+        self.assertEqual(len(lecturas_saldo), 2)
+        self.assertNotIn('gestion_consumovacaciones', lecturas_saldo[0])
+        self.assertIn('gestion_consumovacaciones', lecturas_saldo[1])
+
+        with self.assertRaises(SaldoInsuficiente) as error:
+            transicionar(self._pedido(16, 5), 'aprobar', self.manager)
+        self.assertEqual(error.exception.disponible, 4)
+
+    def test_estados_de_origen(self):
+        pedido = self._pedido(2, 3)
+        transicionar(pedido, 'aprobar', self.manager)
+        with self.assertRaises(TransicionInvalida):
+            transicionar(pedido, 'rechazar', self.manager)
+
+        resultado = transicionar(pedido, 'cancelar', self.manager)
+        self.assertEqual(resultado.estado_anterior, RegistroVacaciones.ESTADO_APROBADA)
+        self.assertEqual(ConsumoVacaciones.objects.obtener(self.empleado.id, self.anio), 0)
+
+    def test_copia_vieja_no_pisa_otra_transicion(self):
+        pedido = self._pedido(2, 3)
+        copia = RegistroVacaciones.objects.get(pk=pedido.pk)
+        transicionar(pedido, 'rechazar', self.manager)
+
+        with self.assertRaises(ConflictoDeVersion):
+            transicionar(copia, 'aprobar', self.manager)
+        pedido.refresh_from_db()
+        self.assertEqual(pedido.estado, RegistroVacaciones.ESTADO_RECHAZADA)
+        self.assertEqual(ConsumoVacaciones.objects.obtener(self.empleado.id, self.anio), 0)
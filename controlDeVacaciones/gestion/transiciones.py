@@ -0,0 +1,115 @@
+from collections import namedtuple
+from datetime import date
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import RegistroVacaciones, SaldoVacaciones
+
+
+# Máquina de estados de RegistroVacaciones: acción -> (estados de origen, estado destino)
+TRANSICIONES = {
+    'aprobar': ((RegistroVacaciones.ESTADO_PENDIENTE,), RegistroVacaciones.ESTADO_APROBADA),
+    'rechazar': ((RegistroVacaciones.ESTADO_PENDIENTE,), RegistroVacaciones.ESTADO_RECHAZADA),
+    'cancelar': (
+        (RegistroVacaciones.ESTADO_APROBADA, RegistroVacaciones.ESTADO_PENDIENTE),
+        RegistroVacaciones.ESTADO_CANCELADA,
+    ),
+}
+
+# Resultado de una transición: la solicitud ya actualizada, de qué estado venía y, al aprobar,
+# el saldo del ciclo que quedó después de descontarla
+Transicion = namedtuple('Transicion', ['solicitud', 'estado_anterior', 'saldo_disponible'])
+
+
+class TransicionInvalida(Exception):
+    """Acción desconocida o no permitida desde el estado actual de la solicitud."""
+
+
+class SaldoInsuficiente(TransicionInvalida):
+    def __init__(self, disponible, solicitados):
+        super().__init__(f"Saldo insuficiente: hay {disponible} días disponibles y se solicitan {solicitados}.")
+        self.disponible = disponible
+        self.solicitados = solicitados
+
+
+def bloquear_saldos(empleados, ciclo):
+    """
+    Saldos del ciclo de varios empleados, {empleado_id: saldo}, con las filas bloqueadas
+    (select_for_update, sin joins) y el consumo anotado. Se bloquean en orden de empleado, así dos
+    pedidos que comparten empleados esperan en vez de trabarse. Los saldos que no existen se crean
+    en bloque como en el resto de las vistas y se bloquean después.
+
+    El consumo se lee en una consulta aparte, recién con el bloqueo tomado: dentro del mismo
+    SELECT ... FOR UPDATE la subconsulta no ve lo que confirmó quien tenía el bloqueo (PostgreSQL
+    solo relee la fila bloqueada; InnoDB la resuelve como lectura consistente), y la segunda de dos
+    aprobaciones simultáneas validaría contra el consumo de antes de la primera.
+    """
+    por_id = {empleado.id: empleado for empleado in empleados}
+    bloqueo = SaldoVacaciones.objects.select_for_update().filter(ciclo=ciclo).order_by('empleado_id')
+    bloqueados = dict(bloqueo.filter(empleado_id__in=list(por_id)).values_list('empleado_id', 'pk'))
+
+    faltantes = [
+        SaldoVacaciones(empleado=empleado, ciclo=ciclo, dias_iniciales=empleado.dias_base_lct(ciclo))
+        for empleado_id, empleado in por_id.items() if empleado_id not in bloqueados
+    ]
+    if faltantes:
+        # ignore_conflicts: si otro pedido creó alguno en paralelo, se bloquea el suyo
+        SaldoVacaciones.objects.bulk_create(faltantes, ignore_conflicts=True)
+        bloqueados.update(
+            bloqueo.filter(empleado_id__in=[s.empleado_id for s in faltantes]).values_list('empleado_id', 'pk')
+        )
+
+    saldos = {}
+    for saldo in SaldoVacaciones.objects.filter(pk__in=list(bloqueados.values())).anotar_consumo():
+        saldo.empleado = por_id[saldo.empleado_id]
+        saldos[saldo.empleado_id] = saldo
+    return saldos
+
+
+def bloquear_saldo(empleado, ciclo):
+    """
+    Saldo del ciclo con la fila bloqueada y el consumo anotado (ver bloquear_saldos): dos aprobaciones
+    simultáneas del mismo empleado se atienden de a una y la segunda ya ve el consumo de la primera.
+    """
+    return bloquear_saldos([empleado], ciclo)[empleado.id]
+
+
+def transicionar(solicitud, accion, manager, version=None):
+    """
+    Aplica 'accion' (aprobar, rechazar o cancelar) a la solicitud y devuelve un Transicion.
+
+    Al aprobar bloquea el saldo del ciclo actual y valida contra él (bloquear_saldo). El cambio de
+    estado es un UPDATE condicional al estado de origen y a la versión leída (o la que mandó el
+    cliente), que escribe solo estado, aprobador y fecha de aprobación.
+
+    Errores: TransicionInvalida (o SaldoInsuficiente) si no corresponde, ConflictoDeVersion si otra
+    escritura ganó. En ambos casos no se modifica nada. La usan aprobar_rechazar_solicitud y
+    cualquier API que necesite cambiar estados.
+    """
+    if accion not in TRANSICIONES:
+        raise TransicionInvalida(f"Acción '{accion}' inválida o no reconocida.")
+    origenes, destino = TRANSICIONES[accion]
+    estado_anterior = solicitud.estado
+    if estado_anterior not in origenes:
+        raise TransicionInvalida(f"No se puede {accion} una solicitud en estado '{estado_anterior}'.")
+
+    cambios = {'estado': destino, 'manager_aprobador': manager}
+    if accion in ('aprobar', 'rechazar'):
+        cambios['fecha_aprobacion'] = date.today()
+
+    with transaction.atomic():
+        saldo_disponible = None
+        if accion == 'aprobar':
+            ciclo = date.today().year
+            saldo = bloquear_saldo(solicitud.empleado, ciclo)
+            saldo_disponible = saldo.total_disponible()
+            if saldo_disponible < solicitud.dias_solicitados:
+                raise SaldoInsuficiente(saldo_disponible, solicitud.dias_solicitados)
+            # Una vacación consume en los ciclos hasta el año en que empieza
+            if solicitud.fecha_inicio.year >= ciclo:
+                saldo_disponible -= solicitud.dias_solicitados
+
+        solicitud.actualizar_con_version(version=version, condicion=Q(estado__in=origenes), **cambios)
+
+    return Transicion(solicitud, estado_anterior, saldo_disponible)
@@ -44,6 +44,7 @@ urlpatterns = [
     path('calendario_interactivo/', views.calendario_interactivo, name='calendario_interactivo'),
     path('api/vacaciones/listar/', views.api_vacaciones_listar, name='api_vacaciones_listar'),
     path('api/vacaciones/mover/', views.api_vacaciones_mover, name='api_vacaciones_mover'),
+    path('api/vacaciones/mover-lote/', views.api_vacaciones_mover_lote, name='api_vacaciones_mover_lote'),
     path('configurar_email/', views.configurar_email, name='configurar_email'),
     path('probar_email/', views.probar_email, name='probar_email'),
 
@@ -74,4 +75,8 @@ urlpatterns = [
     path('notificaciones/', views.lista_notificaciones, name='lista_notificaciones'),
     path('notificaciones/marcar-leida/<int:notif_id>/', views.marcar_notificacion_leida, name='marcar_notificacion_leida'),
     path('api/check_notificaciones/', views.api_check_notificaciones, name='api_check_notificaciones'),
+    path('api/notificaciones/esperar/', views.api_esperar_notificaciones, name='api_esperar_notificaciones'),
+
+    # --- Rendimiento (staff) ---
+    path('rendimiento/', views.estadisticas_rendimiento, name='estadisticas_rendimiento'),
 ]
\ No newline at end of file
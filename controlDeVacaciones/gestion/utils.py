@@ -1,15 +1,34 @@
 import logging
+import time
+import uuid
+from datetime import timedelta
+from django.core.cache import cache
 from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 from django.conf import settings
 from django.contrib.sites.shortcuts import get_current_site
 from django.utils import timezone
 from django.contrib.auth.models import User
-from .models import Empleado, ConfiguracionEmail, Notificacion
+from .models import Empleado, ConfiguracionEmail, CorreoSaliente, Notificacion
+from .notificaciones import avisar_notificaciones
 
 logger = logging.getLogger(__name__)
 
+# Cola de correos: el worker reserva cada lote por este tiempo (si se cae, otro lo retoma después)
+RESERVA_LOTE_CORREOS = timedelta(minutes=10)
+
+# Configuración de email en memoria: (version, config, parametros_smtp). Con cache compartido la versión
+# está en el cache y cambia con cada guardado, así que un envío normal no consulta la base.
+CLAVE_VERSION_CONFIG_EMAIL = 'email:config:version'
+_config_email = None
+
+# Sin cache compartido la versión es el sello de la fila activa: (sello, leido_en). Se vuelve a mirar
+# cada TTL_SELLO_CONFIG_EMAIL segundos, así un guardado hecho en otro proceso tarda a lo sumo eso en verse.
+TTL_SELLO_CONFIG_EMAIL = 60
+_sello_config_email = None
+
 def crear_notificacion(usuario, titulo, mensaje, url=None, solicitud=None):
     """Crea una notificación interna para un usuario."""
     try:
@@ -25,52 +44,187 @@ def crear_notificacion(usuario, titulo, mensaje, url=None, solicitud=None):
         logger.error(f"Error al crear notificación: {e}")
 
 
+def notificar_usuarios(usuario_ids, titulo, mensaje, url=None, solicitud=None, excluir=()):
+    """
+    Crea la misma notificación interna para varios usuarios con un solo INSERT (bulk_create).
+    Los ids repetidos, vacíos o incluidos en 'excluir' se descartan. Devuelve los ids notificados.
+    """
+    excluir = set(excluir)
+    ids = [uid for uid in dict.fromkeys(usuario_ids) if uid and uid not in excluir]
+    if not ids:
+        return []
+    try:
+        Notificacion.objects.bulk_create([
+            Notificacion(usuario_id=uid, titulo=titulo, mensaje=mensaje, url=url, solicitud=solicitud)
+            for uid in ids
+        ])
+    except Exception as e:
+        logger.error(f"Error al crear notificaciones: {e}")
+        return []
+    # bulk_create no dispara post_save: avisar a mano a las campanas
+    avisar_notificaciones(ids)
+    return ids
+
+
+def ids_administradores():
+    """Ids de los superusuarios (Administradores), resueltos en una sola consulta."""
+    return list(User.objects.filter(is_superuser=True).values_list('id', flat=True))
+
+
+def emails_managers():
+    """Emails de todos los managers con usuario y email cargado, en una sola consulta."""
+    return list(
+        Empleado.objects.filter(es_manager=True, user__isnull=False)
+        .exclude(user__email='').values_list('user__email', flat=True)
+    )
+
+
+def invalidar_config_email():
+    """
+    Cambia la versión de la configuración de email (se llama al guardar o borrar un ConfiguracionEmail).
+    Con cache compartido todos los procesos recargan en su próximo envío; sin él solo este proceso,
+    y los demás se enteran por el sello de la fila (ver _version_config_email).
+    """
+    global _sello_config_email
+    _sello_config_email = None
+    cache.set(CLAVE_VERSION_CONFIG_EMAIL, uuid.uuid4().hex, None)
+
+
+def _version_config_email():
+    global _sello_config_email
+    if not getattr(settings, 'CACHE_COMPARTIDO', False):
+        # Con LocMemCache el guardado hecho en la web no llega al worker de correos (otro proceso):
+        # la versión es el id y el sello de modificación de la configuración activa (filtrada por
+        # 'activo'), leídos a lo sumo una vez cada TTL_SELLO_CONFIG_EMAIL
+        ahora = time.monotonic()
+        entrada = _sello_config_email
+        if entrada is None or ahora - entrada[1] > TTL_SELLO_CONFIG_EMAIL:
+            sello = ConfiguracionEmail.objects.filter(activo=True).values_list('id', 'fecha_modificacion').first()
+            entrada = (sello, ahora)
+            _sello_config_email = entrada
+        return entrada[0]
+    version = cache.get(CLAVE_VERSION_CONFIG_EMAIL)
+    if version is None:
+        cache.add(CLAVE_VERSION_CONFIG_EMAIL, uuid.uuid4().hex, None)
+        version = cache.get(CLAVE_VERSION_CONFIG_EMAIL)
+    return version
+
+
+def _config_email_vigente():
+    """
+    Devuelve (config, parametros_smtp) de la configuración activa, guardados en memoria del proceso
+    mientras no cambie la versión. Solo se lee la fila completa después de un cambio.
+    """
+    global _config_email
+    version = _version_config_email()
+    entrada = _config_email
+    if entrada is None or entrada[0] != version:
+        config = ConfiguracionEmail.objects.filter(activo=True).first()
+        entrada = (version, config, _parametros_smtp(config))
+        _config_email = entrada
+    return entrada[1], entrada[2]
+
+
 def _get_email_config():
-    """Retorna la configuración activa de la base de datos o None."""
+    """Retorna la configuración activa de la base de datos (cacheada) o None."""
     try:
-        return ConfiguracionEmail.objects.filter(activo=True).first()
+        return _config_email_vigente()[0]
     except:
         return None
 
-def _enviar_email_generico(request, subject, context, template_name, destinatarios, force_config=None):
+
+def _parametros_smtp(config):
+    """(argumentos de get_connection, remitente) para la configuración dada, o None sin configuración."""
+    if not config:
+        return None
+    parametros = {
+        'backend': 'django.core.mail.backends.smtp.EmailBackend',
+        'host': config.email_host,
+        'port': config.email_port,
+        'username': config.email_host_user,
+        'password': config.email_host_password,
+        'use_tls': config.email_use_tls,
+        'use_ssl': config.email_use_ssl,
+    }
+    return parametros, config.email_host_user
+
+
+def _conexion_desde_parametros(parametros):
+    # Sin configuración se usa el backend de settings.py
+    if parametros is None:
+        return get_connection(), settings.DEFAULT_FROM_EMAIL
+    kwargs, remitente = parametros
+    return get_connection(**kwargs), remitente
+
+
+def conexion_smtp(config):
     """
-    Función interna para manejar la lógica de envío usando la configuración de la DB o settings.py.
+    Devuelve (conexión sin abrir, remitente) para la configuración dada.
+    Sin configuración se usa el backend de settings.py.
     """
-    try:
-        # Usar config forzada (test) o la de la DB activa
-        config = force_config if force_config else _get_email_config()
-        
-        # 1. Determinar el servidor (Connection)
-        connection = None
-        from_email = settings.DEFAULT_FROM_EMAIL
-        
-        if config:
-            connection = get_connection(
-                backend='django.core.mail.backends.smtp.EmailBackend',
-                host=config.email_host,
-                port=config.email_port,
-                username=config.email_host_user,
-                password=config.email_host_password,
-                use_tls=config.email_use_tls,
-                use_ssl=config.email_use_ssl,
-            )
-            from_email = config.email_host_user
+    return _conexion_desde_parametros(_parametros_smtp(config))
+
 
+def conexion_smtp_activa():
+    """conexion_smtp() con la configuración activa de la base (parámetros ya armados en memoria)."""
+    return _conexion_desde_parametros(_config_email_vigente()[1])
 
 
-        # 2. Configurar el sitio URL
+def encolar_correo(subject, html_content, destinatarios):
+    """
+    Deja el email en la bandeja de salida cuando la transacción en curso confirma
+    (en el acto si no hay transacción). Si la operación se revierte, no se envía nada.
+    """
+    correo = CorreoSaliente(
+        asunto=subject[:255],
+        cuerpo_texto=strip_tags(html_content),
+        cuerpo_html=html_content,
+        destinatarios=','.join(destinatarios),
+    )
+    transaction.on_commit(correo.save)
+
+
+def reservar_correos(lote):
+    """
+    Toma hasta 'lote' correos pendientes cuyo turno ya llegó y los reserva (corre su próximo intento)
+    para que otro worker no los tome. Con SKIP LOCKED varios workers pueden convivir.
+    """
+    ahora = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            CorreoSaliente.objects.select_for_update(skip_locked=True)
+            .filter(estado=CorreoSaliente.ESTADO_PENDIENTE, proximo_intento__lte=ahora)
+            .order_by('id').values_list('id', flat=True)[:lote]
+        )
+        if ids:
+            CorreoSaliente.objects.filter(id__in=ids).update(proximo_intento=ahora + RESERVA_LOTE_CORREOS)
+    return list(CorreoSaliente.objects.filter(id__in=ids).order_by('id')) if ids else []
+
+
+def _enviar_email_generico(request, subject, context, template_name, destinatarios, force_config=None):
+    """
+    Función interna para manejar la lógica de envío usando la configuración de la DB o settings.py.
+    El email se renderiza acá y se encola (ver encolar_correo); el comando 'procesar_correos' lo envía.
+    Solo la prueba de configuración (force_config) se envía en el momento, para mostrar el resultado.
+    """
+    try:
+        # 1. Configurar el sitio URL
         protocol = 'https' if request.is_secure() else 'http'
         domain = get_current_site(request).domain
         context['site_url'] = f"{protocol}://{domain}"
 
-        # 3. Renderizar contenido
+        # 2. Renderizar contenido
         html_content = render_to_string(template_name, context)
-        text_content = strip_tags(html_content)
 
-        # 4. Enviar
+        if not force_config:
+            encolar_correo(subject, html_content, destinatarios)
+            return True
+
+        # 3. Enviar (solo prueba de configuración)
+        connection, from_email = conexion_smtp(force_config)
         email = EmailMultiAlternatives(
             subject,
-            text_content,
+            strip_tags(html_content),
             from_email,
             destinatarios,
             connection=connection
@@ -137,8 +291,7 @@ def enviar_email_nueva_solicitud(request, solicitud):
     Notifica sobre una nueva solicitud. 
     """
     try:
-        managers = Empleado.objects.filter(es_manager=True).exclude(user__email='')
-        destinatarios = [m.user.email for m in managers]
+        destinatarios = emails_managers()
         
         config = _get_email_config()
         if config and config.emails_notificacion:
@@ -3,8 +3,24 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth.views import LoginView
 from django.http import JsonResponse 
 # CORRECCIÓN 1: Asegurando que la importación de DiaFestivo sea correcta (singular)
-from .models import Empleado, SaldoVacaciones, RegistroVacaciones, DiasFestivos, Departamento, ConfiguracionEmail, Notificacion
-from .utils import enviar_email_nueva_solicitud, enviar_email_cambio_estado, probar_configuracion_email, crear_notificacion
+from .models import (
+    Empleado, SaldoVacaciones, RegistroVacaciones, DiasFestivos, Departamento, ConfiguracionEmail, Notificacion,
+    ConflictoDeVersion
+)
+from .utils import (
+    enviar_email_nueva_solicitud, enviar_email_cambio_estado, probar_configuracion_email, crear_notificacion,
+    notificar_usuarios, ids_administradores
+)
+from .calendario import construir_datos_calendario, meses_de_anios
+from .exportacion import exportar_calendario_stream
+from .dias_habiles import contar_dias_habiles, contar_dias_habiles_lote
+from .capacidad import ESTADOS_OCUPAN, analizar_conflictos
+from .ciclos import desde_anio, en_anio
+from .compresion import comprimir_respuesta
+from .notificaciones import esperar_cambio, marcar_leidas, resumen_notificaciones
+from .planificacion import MAX_MOVIMIENTOS_LOTE, mover_en_lote
+from .transiciones import SaldoInsuficiente, TransicionInvalida, transicionar
+from . import perfilado
 
 from django.contrib.auth.models import User
 from django.db import transaction
@@ -13,18 +29,17 @@ from datetime import datetime
 from django.contrib import messages
 from datetime import date, timedelta
 from calendar import monthrange
+import hashlib
+import json
 import logging
 # NUEVAS IMPORTACIONES REQUERIDAS para historial_global
-from django.db.models import Sum, F 
+from django.db.models import Sum, F, Q, Count, Max
+from django.views.decorators.http import condition
 from django import template
 import sys 
 import traceback
 import calendar
 import locale
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
-from openpyxl.drawing.image import Image
 
 # IMPORTS PARA GENERAR PDF (ReportLab)
 from reportlab.pdfgen import canvas
@@ -42,13 +57,6 @@ logger = logging.getLogger(__name__)
 # --- Clases y Funciones de Utilidad ---
 
 
-# Definición de MESES_ESPANOL (Asegúrate de que esté definida en tu archivo)
-MESES_ESPANOL = {
-    1: 'Ene', 2: 'Feb', 3: 'Mar', 4: 'Abr', 5: 'May', 6: 'Jun', 
-    7: 'Jul', 8: 'Ago', 9: 'Sep', 10: 'Oct', 11: 'Nov', 12: 'Dic'
-}
-
-
 try:
     locale.setlocale(locale.LC_TIME, 'es_ES.UTF-8')
 except locale.Error:
@@ -233,30 +241,9 @@ def calcular_dias_habiles(fecha_inicio, fecha_fin):
     """
     Calcula los días hábiles (laborables) entre dos fechas, 
     excluyendo sábados, domingos y días festivos registrados.
+    Delegado en gestion.dias_habiles (feriados cacheados por año).
     """
-    if fecha_inicio > fecha_fin:
-        return 0
-        
-    delta = fecha_fin - fecha_inicio
-    dias_habiles = 0
-    
-    # Obtener todos los días festivos en el rango para una consulta eficiente
-    festivos = DiasFestivos.objects.filter(fecha__range=[fecha_inicio, fecha_fin]).values_list('fecha', flat=True)
-    
-    current_date = fecha_inicio
-    while current_date <= fecha_fin:
-        # 0 = Lunes, 6 = Domingo
-        weekday = current_date.weekday()
-        
-        # 1. Excluir Sábados (5) y Domingos (6)
-        if weekday < 5: 
-            # 2. Excluir Días Festivos
-            if current_date not in festivos:
-                dias_habiles += 1
-                
-        current_date += timedelta(days=1)
-        
-    return dias_habiles
+    return contar_dias_habiles(fecha_inicio, fecha_fin)
 
 # --- Vistas Principales ---
 
@@ -313,7 +300,7 @@ def dashboard(request):
         solicitudes_pendientes = RegistroVacaciones.objects.filter(filtro_solicitudes).count()
         
         # 3. Total de días de vacaciones disponibles en su equipo
-        saldos_equipo = SaldoVacaciones.objects.filter(filtro_equipo, ciclo=current_year)
+        saldos_equipo = SaldoVacaciones.objects.filter(filtro_equipo, ciclo=current_year).with_balances()
         total_dias_equipo = sum(saldo.total_disponible() for saldo in saldos_equipo)
         
         # 4. Empleados de su equipo con vacaciones próximas (próximos 30 días)
@@ -369,8 +356,8 @@ def dashboard(request):
         
         # Obtener todas las vacaciones aprobadas del año actual (para el equipo)
         vacaciones_aprobadas_qs = RegistroVacaciones.objects.filter(
+            en_anio('fecha_inicio', anio_calendario),
             f_equipo, 
-            fecha_inicio__year=anio_calendario,
             estado=RegistroVacaciones.ESTADO_APROBADA
         ).values('fecha_inicio')
         
@@ -506,17 +493,17 @@ def obtener_saldo_empleado(request):
         # Calcular días usados (aprobados)
         # CORRECCIÓN: Incluir vacaciones futuras (ej. 2026) que corresponden a este ciclo
         dias_usados = RegistroVacaciones.objects.filter(
+            desde_anio('fecha_inicio', current_year),
             empleado=empleado_afectado,
-            estado=RegistroVacaciones.ESTADO_APROBADA,
-            fecha_inicio__year__gte=current_year  # Cambiado de = a >=
+            estado=RegistroVacaciones.ESTADO_APROBADA
         ).aggregate(total=Sum('dias_solicitados'))['total'] or 0
         
         # Calcular días pendientes
         # CORRECCIÓN: Incluir vacaciones futuras (ej. 2026) que corresponden a este ciclo
         dias_pendientes = RegistroVacaciones.objects.filter(
+            desde_anio('fecha_inicio', current_year),
             empleado=empleado_afectado,
-            estado=RegistroVacaciones.ESTADO_PENDIENTE,
-            fecha_inicio__year__gte=current_year # Cambiado de = a >=
+            estado=RegistroVacaciones.ESTADO_PENDIENTE
         ).aggregate(total=Sum('dias_solicitados'))['total'] or 0
         
         return JsonResponse({
@@ -599,18 +586,18 @@ def solicitar_vacaciones(request):
             # KPI 2 – DÍAS USADOS (Aprobados)
             # -------------------------
             dias_usados = RegistroVacaciones.objects.filter(
+                en_anio('fecha_inicio', current_year),
                 empleado=empleado_afectado,
-                estado=RegistroVacaciones.ESTADO_APROBADA,
-                fecha_inicio__year=current_year
+                estado=RegistroVacaciones.ESTADO_APROBADA
             ).aggregate(total=Sum('dias_solicitados'))['total'] or 0
 
             # -------------------------
             # KPI 3 – DÍAS PENDIENTES
             # -------------------------
             dias_pendientes = RegistroVacaciones.objects.filter(
+                en_anio('fecha_inicio', current_year),
                 empleado=empleado_afectado,
-                estado=RegistroVacaciones.ESTADO_PENDIENTE,
-                fecha_inicio__year=current_year
+                estado=RegistroVacaciones.ESTADO_PENDIENTE
             ).aggregate(total=Sum('dias_solicitados'))['total'] or 0
 
             # Agregar al contexto
@@ -707,15 +694,13 @@ def solicitar_vacaciones(request):
 
                 # Notificación interna para el Administrador Global (Superusuario) y para el manager
                 # (En este caso el manager ya lo sabe porque él mismo la creó, pero la dejamos para trazabilidad)
-                admin_users = User.objects.filter(is_superuser=True)
-                for a_user in admin_users:
-                    crear_notificacion(
-                        usuario=a_user,
-                        titulo="Nueva Solicitud Creada (Manager) 🔔",
-                        mensaje=f"Se ha registrado una solicitud para {empleado_afectado.nombre} {empleado_afectado.apellido}.",
-                        url="gestion:aprobacion_manager",
-                        solicitud=solicitud
-                    )
+                notificar_usuarios(
+                    ids_administradores(),
+                    titulo="Nueva Solicitud Creada (Manager) 🔔",
+                    mensaje=f"Se ha registrado una solicitud para {empleado_afectado.nombre} {empleado_afectado.apellido}.",
+                    url="gestion:aprobacion_manager",
+                    solicitud=solicitud
+                )
 
             messages.success(
                 request,
@@ -1065,15 +1050,18 @@ def historial_global(request):
     if estado and estado != 'Todos':
         solicitudes_qs = solicitudes_qs.filter(estado=estado)
         
-    solicitudes_qs = solicitudes_qs.order_by('-fecha_solicitud')
+    # La tabla muestra empleado, departamento y aprobador de cada fila: traerlos en la misma consulta
+    solicitudes_qs = solicitudes_qs.select_related(
+        'empleado__departamento', 'manager_aprobador'
+    ).order_by('-fecha_solicitud')
     
     # --- 2. Datos para Filtros y Resumen ---
     
     # Cálculo del resumen (Días Aprobados)
     resumen_aprobado_data = resumen_base_qs.filter(
-        estado=RegistroVacaciones.ESTADO_APROBADA, # Uso de la constante
         # Filtrar por solicitudes cuya fecha de inicio sea en el año actual
-        fecha_inicio__year=datetime.now().year 
+        en_anio('fecha_inicio', datetime.now().year),
+        estado=RegistroVacaciones.ESTADO_APROBADA, # Uso de la constante
     ).values(
         'empleado__id', 
         'empleado__nombre', 
@@ -1137,7 +1125,7 @@ def gestion_saldos(request):
     else:
         anio_ciclo = hoy_dt.year
         
-    saldos_list = SaldoVacaciones.objects.filter(ciclo=anio_ciclo).select_related('empleado__user', 'empleado__departamento').order_by('empleado__apellido')
+    saldos_list = SaldoVacaciones.objects.filter(ciclo=anio_ciclo).select_related('empleado__user', 'empleado__departamento').with_balances().order_by('empleado__apellido')
     
     # Paginación de 5 items por defecto
     from django.core.paginator import Paginator
@@ -1238,7 +1226,7 @@ def gestion_festivos(request):
 
     # Auto-importación si es un año específico y está vacío
     if isinstance(selected_year, int):
-        exists = DiasFestivos.objects.filter(fecha__year=selected_year).exists()
+        exists = DiasFestivos.objects.filter(en_anio('fecha', selected_year)).exists()
         if not exists:
             # Intentar descargar
             _fetch_and_save_holidays(request, selected_year)
@@ -1247,7 +1235,7 @@ def gestion_festivos(request):
     festivos = DiasFestivos.objects.all().order_by('-fecha')
     
     if isinstance(selected_year, int):
-        festivos = festivos.filter(fecha__year=selected_year)
+        festivos = festivos.filter(en_anio('fecha', selected_year))
 
     contexto = {
         'festivos': festivos,
@@ -1362,8 +1350,8 @@ def dias_disponibles_view(request, empleado_id=None):
 
         
         dias_tomados_agregado = RegistroVacaciones.objects.filter(
+            en_anio('fecha_inicio', CICLO_ACTUAL),
             empleado=empleado_a_ver,
-            fecha_inicio__year=CICLO_ACTUAL,
             estado=RegistroVacaciones.ESTADO_APROBADA
         ).aggregate(
             total_tomados=Sum('dias_solicitados')
@@ -1376,8 +1364,8 @@ def dias_disponibles_view(request, empleado_id=None):
         
     except SaldoVacaciones.DoesNotExist:
         dias_tomados_agregado = RegistroVacaciones.objects.filter(
+            en_anio('fecha_inicio', CICLO_ACTUAL),
             empleado=empleado_a_ver,
-            fecha_inicio__year=CICLO_ACTUAL, 
             estado=RegistroVacaciones.APROBADO 
         ).aggregate(
             total_tomados=Sum('dias_utilizados')
@@ -1433,33 +1421,15 @@ def aprobacion_manager(request):
         filtro_gestor,
         estado=RegistroVacaciones.ESTADO_PENDIENTE
     ).select_related('empleado__departamento').order_by('fecha_solicitud')
+    solicitudes_pendientes = list(solicitudes_pendientes)
+
+    # Días hábiles de cada pedido (feriados de todos los años en una sola consulta)
+    dias_habiles = contar_dias_habiles_lote((sol.fecha_inicio, sol.fecha_fin) for sol in solicitudes_pendientes)
+    for sol, habiles in zip(solicitudes_pendientes, dias_habiles):
+        sol.dias_habiles = habiles
     
-    # 🛡️ Lógica del Asistente de Conflictos (Smart Approvals)
-    for sol in solicitudes_pendientes:
-        if sol.empleado.departamento:
-            # Buscar otros del mismo departamento que se solapen (Aprobadas o Pendientes)
-            solapamientos = RegistroVacaciones.objects.filter(
-                empleado__departamento=sol.empleado.departamento,
-                estado__in=[RegistroVacaciones.ESTADO_APROBADA, RegistroVacaciones.ESTADO_PENDIENTE]
-            ).filter(
-                Q(fecha_inicio__lte=sol.fecha_fin, fecha_fin__gte=sol.fecha_inicio)
-            ).exclude(id=sol.id).values_list('empleado__nombre', 'empleado__apellido', 'estado')
-            
-            sol.overlap_count = len(solapamientos)
-            # Lista de nombres con su estado para el tooltip
-            sol.overlap_names = [f"{n} {a} ({est})" for n, a, est in solapamientos]
-            
-            # Calcular capacidad operativa
-            total_equipo = Empleado.objects.filter(departamento=sol.empleado.departamento).count()
-            if total_equipo > 0:
-                # Contamos al solicitante y a todos los que se solapan (aprobados y pendientes)
-                personal_activo = total_equipo - sol.overlap_count - 1
-                sol.capacidad_pct = max(int((personal_activo / total_equipo) * 100), 0)
-            else:
-                sol.capacidad_pct = 100
-        else:
-            sol.overlap_count = 0
-            sol.capacidad_pct = 100
+    # 🛡️ Asistente de Conflictos (Smart Approvals): solapamientos y capacidad de todos los pedidos en bloque
+    analizar_conflictos(solicitudes_pendientes)
     
     context = {
         'solicitudes_pendientes': solicitudes_pendientes
@@ -1487,156 +1457,12 @@ def calendario_global(request):
             except ValueError:
                 anios_a_mostrar = [date.today().year]
 
-        # 1. GENERAR MESES Y SEMANAS CONTINUAS PARA TODOS LOS AÑOS SELECCIONADOS
-        meses_globales = []
-        
-        for anio in anios_a_mostrar:
-            datos_anio = _generar_datos_anio(anio)
-            
-            # Ajustar nombres de meses para incluir el año (ej: "Ene 24")
-            anio_corto = str(anio)[-2:]
-            for mes in datos_anio['meses_data']:
-                mes['nombre'] = f"{mes['nombre']} {anio_corto}"
-                meses_globales.append(mes)
-
-        # 2. DEFINIR RANGO TOTAL DE FECHAS
-        fecha_inicio_total = date(anios_a_mostrar[0], 1, 1)
-        fecha_fin_total = date(anios_a_mostrar[-1], 12, 31)
-
-        # 3. OBTENER EMPLEADOS Y VACACIONES PARA EL RANGO TOTAL
-        departamentos = Departamento.objects.all().order_by('nombre')
-        departamentos_data = []
-
-        # Determinar año para el saldo (usar el actual o el primero de la lista)
-        anio_saldo = date.today().year if date.today().year in anios_a_mostrar else anios_a_mostrar[0]
-
-        for depto in departamentos:
-            # Filtrar empleados por departamento Y por manager si no es superuser
-            from django.db.models import Q
-            if request.user.is_superuser:
-                filtro_empleados = Q(departamento=depto)
-            else:
-                filtro_empleados = Q(departamento=depto, manager_aprobador=request.user.empleado)
+        # 1. MESES Y SEMANAS CONTINUAS PARA TODOS LOS AÑOS SELECCIONADOS (esqueleto cacheado, ej: "Ene 24")
+        meses_globales = meses_de_anios(tuple(anios_a_mostrar))
 
-            empleados_depto = Empleado.objects.filter(
-                filtro_empleados
-            ).select_related('manager_aprobador').order_by('apellido', 'nombre')
-            
-            empleados_list = []
-            for emp in empleados_depto:
-                # Saldo del año de referencia
-                saldo, created = SaldoVacaciones.objects.get_or_create(
-                    empleado=emp,
-                    ciclo=anio_saldo,
-                    defaults={'dias_iniciales': emp.dias_base_lct(anio_saldo)}
-                )
-                
-                # Días acumulados: usar dias_adicionales del saldo (cargados manualmente)
-                # Días base del ciclo actual (sin acumulados) - columna "Disponible"
-                dias_disponibles = saldo.dias_base_ciclo()
-                
-                # CORRECCIÓN: Calcular consumo visualmente para incluir vacaciones puente
-                consumo_visual = RegistroVacaciones.objects.filter(
-                    empleado=emp,
-                    estado=RegistroVacaciones.ESTADO_APROBADA,
-                    fecha_fin__year__gte=anio_saldo 
-                ).aggregate(Sum('dias_solicitados'))['dias_solicitados__sum'] or 0
-
-                # Días acumulados restantes: lo que había menos lo consumido, piso 0
-                dias_adicionales_iniciales = saldo.dias_adicionales or 0
-                dias_acumulados = max(0, dias_adicionales_iniciales - consumo_visual)
-
-                # Días restantes totales - columna "Restan"
-                dias_restantes = saldo.dias_totales() - consumo_visual
-                
-                # Vacaciones en el rango TOTAL (aprobadas y pendientes)
-                vacaciones = RegistroVacaciones.objects.filter(
-                    empleado=emp,
-                    estado__in=[RegistroVacaciones.ESTADO_APROBADA, RegistroVacaciones.ESTADO_PENDIENTE],
-                    fecha_inicio__lte=fecha_fin_total,
-                    fecha_fin__gte=fecha_inicio_total
-                )
-                
-                # Obtener lista de vacaciones futuras aprobadas (para el selector PDF)
-                vacaciones_futuras = list(RegistroVacaciones.objects.filter(
-                    empleado=emp,
-                    estado=RegistroVacaciones.ESTADO_APROBADA,
-                    fecha_fin__gte=date.today()
-                ).order_by('fecha_inicio'))
-                
-                empleados_list.append({
-                    'empleado': emp,
-                    'dias_disponibles': dias_disponibles,
-                    'dias_acumulados': dias_acumulados,
-                    'dias_restantes': dias_restantes,
-                    'vacaciones': list(vacaciones),
-                    'vacaciones_futuras': vacaciones_futuras,
-                })
-            
-            if empleados_list:
-                departamentos_data.append({
-                    'departamento': depto,
-                    'empleados': empleados_list
-                })
-        
-        # Empleados sin departamento
-        empleados_sin_depto = Empleado.objects.filter(
-            departamento__isnull=True
-        ).select_related('manager_aprobador').order_by('apellido', 'nombre')
-        
-        if empleados_sin_depto.exists():
-            empleados_list = []
-            for emp in empleados_sin_depto:
-                saldo, created = SaldoVacaciones.objects.get_or_create(
-                    empleado=emp,
-                    ciclo=anio_saldo,
-                    defaults={'dias_iniciales': emp.dias_base_lct(anio_saldo)}
-                )
-                
-                # Días base del ciclo actual (sin acumulados) - columna "Disponible"
-                dias_disponibles = saldo.dias_base_ciclo()
-                
-                # CORRECCIÓN: Calcular consumo visualmente para incluir vacaciones puente
-                consumo_visual = RegistroVacaciones.objects.filter(
-                    empleado=emp,
-                    estado=RegistroVacaciones.ESTADO_APROBADA,
-                    fecha_fin__year__gte=anio_saldo 
-                ).aggregate(Sum('dias_solicitados'))['dias_solicitados__sum'] or 0
-
-                # Días acumulados restantes: lo que había menos lo consumido, piso 0
-                dias_adicionales_iniciales = saldo.dias_adicionales or 0
-                dias_acumulados = max(0, dias_adicionales_iniciales - consumo_visual)
-
-                # Días restantes totales - columna "Restan"
-                dias_restantes = saldo.dias_totales() - consumo_visual
-                
-                vacaciones = RegistroVacaciones.objects.filter(
-                    empleado=emp,
-                    estado__in=[RegistroVacaciones.ESTADO_APROBADA, RegistroVacaciones.ESTADO_PENDIENTE],
-                    fecha_inicio__lte=fecha_fin_total,
-                    fecha_fin__gte=fecha_inicio_total
-                )
-                
-                # Obtener lista de vacaciones futuras aprobadas (para el selector PDF)
-                vacaciones_futuras = list(RegistroVacaciones.objects.filter(
-                    empleado=emp,
-                    estado=RegistroVacaciones.ESTADO_APROBADA,
-                    fecha_fin__gte=date.today()
-                ).order_by('fecha_inicio'))
-                
-                empleados_list.append({
-                    'empleado': emp,
-                    'dias_disponibles': dias_disponibles,
-                    'dias_acumulados': dias_acumulados,
-                    'dias_restantes': dias_restantes,
-                    'vacaciones': list(vacaciones),
-                    'vacaciones_futuras': vacaciones_futuras,
-                })
-            
-            departamentos_data.append({
-                'departamento': None,
-                'empleados': empleados_list
-            })
+        # 2. OBTENER EMPLEADOS, SALDOS Y VACACIONES EN BLOQUE (consultas constantes)
+        semanas_globales = [semana for mes in meses_globales for semana in mes.semanas]
+        departamentos_data = construir_datos_calendario(request.user, anios_a_mostrar, semanas_globales)
 
         context = {
             'anio_seleccionado': anio_param,
@@ -1668,397 +1494,28 @@ def exportar_calendario_excel(request):
             except ValueError:
                 anios_a_mostrar = [date.today().year]
 
-        # Crear workbook
-        wb = Workbook()
-        ws = wb.active
-        ws.title = f"Calendario {anio_param}"
-
-        # Estilos
-        header_fill = PatternFill(start_color="764ba2", end_color="764ba2", fill_type="solid")
-        header_font = Font(bold=True, color="FFFFFF", size=11)
-        
-        week_fill = PatternFill(start_color="c2e9fb", end_color="c2e9fb", fill_type="solid")
-        week_font = Font(bold=True, color="2c3e50", size=7)
-        
-        dept_fill = PatternFill(start_color="f5576c", end_color="f5576c", fill_type="solid")
-        dept_font = Font(bold=True, color="FFFFFF", size=10)
-        
-        emp_fill = PatternFill(start_color="fcb69f", end_color="fcb69f", fill_type="solid")
-        emp_font = Font(bold=False, color="2c3e50", size=10)
-        
-        disp_fill = PatternFill(start_color="fdcb6e", end_color="fdcb6e", fill_type="solid")
-        acum_fill = PatternFill(start_color="56ab2f", end_color="56ab2f", fill_type="solid")
-        rest_fill = PatternFill(start_color="9b59b6", end_color="9b59b6", fill_type="solid")
-        
-        vac_fill = PatternFill(start_color="38ef7d", end_color="38ef7d", fill_type="solid")
-        vac_pending_fill = PatternFill(start_color="ffd93d", end_color="ffd93d", fill_type="solid")
-        vac_font = Font(bold=True, color="000000")
-        
-        center_align = Alignment(horizontal="center", vertical="center")
-        left_align = Alignment(horizontal="left", vertical="center")
-        
-        # Bordes negros medianos para mejor visibilidad
-        # Bordes finos negros (formato estándar de Excel)
-        thin_border = Border(
-            left=Side(style='thin', color='000000'),
-            right=Side(style='thin', color='000000'),
-            top=Side(style='thin', color='000000'),
-            bottom=Side(style='thin', color='000000')
-        )
-
-        # === ENCABEZADO CORPORATIVO ===
-        header_start_row = 5
-        
-        # 1. Logo
-        # CORRECCIÓN: Usamos la ruta correcta (la misma que en el PDF)
-        logo_path = os.path.join(settings.BASE_DIR.parent, 'gestion', 'imagenes', 'logo', 'logo.png')
-        if not os.path.exists(logo_path):
-            logo_path = os.path.join(settings.BASE_DIR.parent, 'gestion', 'imagenes', 'logo', 'logo.jpg')
-            
-        if os.path.exists(logo_path):
-            try:
-                img = Image(logo_path)
-                # Ajustar tamaño del logo
-                img.width = 220
-                img.height = 50
-                ws.add_image(img, 'A1')
-            except Exception as e:
-                logger.error(f"Error al insertar logo en Excel: {e}")
-
-        # 2. Títulos (Ahora a la derecha del logo)
-        ws.merge_cells(start_row=2, start_column=5, end_row=2, end_column=15)
-        title_cell = ws.cell(2, 5, f"Planilla de VACACIONES CICLO {anio_param}")
-        title_cell.font = Font(bold=True, size=14)
-        title_cell.alignment = left_align
-
-        ws.merge_cells(start_row=3, start_column=5, end_row=3, end_column=15)
-        subtitle_cell = ws.cell(3, 5, f"PLANILLA ENTREGADA {date.today().strftime('%d-%m-%y')}")
-        subtitle_cell.font = Font(bold=True, size=11)
-        subtitle_cell.alignment = left_align
-
-        # Generar estructura de meses y semanas
-        meses_globales = []
-        for anio in anios_a_mostrar:
-            datos_anio = _generar_datos_anio(anio)
-            anio_corto = str(anio)[-2:]
-            for mes in datos_anio['meses_data']:
-                mes['nombre'] = f"{mes['nombre']} {anio_corto}"
-                meses_globales.append(mes)
-
-        # Calcular columnas
-        col_offset = 5  # Empleado, Disponible, Acumuladas, Restan, (espacio)
-        total_semanas = sum(len(mes['semanas']) for mes in meses_globales)
-
-        # FILA DE MESES (header_start_row)
-        current_col = col_offset
-        
-        # Combinar verticalmente las columnas fijas
-        for c in range(1, 5):
-            ws.merge_cells(start_row=header_start_row, start_column=c, end_row=header_start_row + 1, end_column=c)
-            
-        ws.cell(header_start_row, 1, "Empleado").fill = header_fill
-        ws.cell(header_start_row, 1).font = header_font
-        ws.cell(header_start_row, 1).alignment = center_align
-        ws.cell(header_start_row, 1).border = thin_border
-        
-        ws.cell(header_start_row, 2, "Disponible").fill = header_fill
-        ws.cell(header_start_row, 2).font = header_font
-        ws.cell(header_start_row, 2).alignment = center_align
-        ws.cell(header_start_row, 2).border = thin_border
-        
-        ws.cell(header_start_row, 3, "Acumuladas").fill = header_fill
-        ws.cell(header_start_row, 3).font = header_font
-        ws.cell(header_start_row, 3).alignment = center_align
-        ws.cell(header_start_row, 3).border = thin_border
-        
-        ws.cell(header_start_row, 4, "Restan").fill = header_fill
-        ws.cell(header_start_row, 4).font = header_font
-        ws.cell(header_start_row, 4).alignment = center_align
-        ws.cell(header_start_row, 4).border = thin_border
-
-        for mes in meses_globales:
-            num_semanas = len(mes['semanas'])
-            if num_semanas > 0:
-                ws.merge_cells(start_row=header_start_row, start_column=current_col, end_row=header_start_row, end_column=current_col + num_semanas - 1)
-                cell = ws.cell(header_start_row, current_col, mes['nombre'])
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = center_align
-                cell.border = thin_border
-                current_col += num_semanas
-
-        # FILA DE SEMANAS (header_start_row + 1)
-        ws.row_dimensions[header_start_row + 1].height = 35
-        week_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        current_col = col_offset
-        for mes in meses_globales:
-            for semana in mes['semanas']:
-                cell = ws.cell(header_start_row + 1, current_col, semana['rango'])
-                cell.fill = week_fill
-                cell.font = week_font
-                cell.alignment = week_align
-                cell.border = thin_border
-                current_col += 1
-
-        # Obtener datos de empleados
-        fecha_inicio_total = date(anios_a_mostrar[0], 1, 1)
-        fecha_fin_total = date(anios_a_mostrar[-1], 12, 31)
-        anio_saldo = date.today().year if date.today().year in anios_a_mostrar else anios_a_mostrar[0]
-
-        # Inicializar contador de personas por semana
-        totales_por_columna = {}
-        
-        departamentos = Departamento.objects.all().order_by('nombre')
-        current_row = header_start_row + 2
-        
-        for depto in departamentos:
-            empleados_depto = Empleado.objects.filter(
-                departamento=depto
-            ).select_related('manager_aprobador').order_by('apellido', 'nombre')
-            
-            if empleados_depto.exists():
-                # Fila de departamento
-                ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=col_offset + total_semanas - 1)
-                cell = ws.cell(current_row, 1, depto.nombre.upper())
-                cell.fill = dept_fill
-                cell.font = dept_font
-                cell.alignment = left_align
-                cell.border = thin_border
-                current_row += 1
-                
-                # Empleados del departamento
-                for emp in empleados_depto:
-                    saldo, _ = SaldoVacaciones.objects.get_or_create(
-                        empleado=emp,
-                        ciclo=anio_saldo,
-                        defaults={'dias_iniciales': emp.dias_base_lct(anio_saldo)}
-                    )
-                    
-                    dias_disponibles = saldo.dias_base_ciclo()
-                    dias_acumulados = saldo.dias_acumulados_restantes()
-                    dias_restantes = saldo.total_disponible()
-                    
-                    vacaciones = RegistroVacaciones.objects.filter(
-                        empleado=emp,
-                        estado__in=[RegistroVacaciones.ESTADO_APROBADA, RegistroVacaciones.ESTADO_PENDIENTE],
-                        fecha_inicio__lte=fecha_fin_total,
-                        fecha_fin__gte=fecha_inicio_total
-                    )
-                    
-                    # Columna Empleado
-                    cell = ws.cell(current_row, 1, f"{emp.apellido}, {emp.nombre}")
-                    cell.fill = emp_fill
-                    cell.font = emp_font
-                    cell.alignment = left_align
-                    cell.border = thin_border
-                    
-                    # Columna Disponible
-                    cell = ws.cell(current_row, 2, dias_disponibles)
-                    cell.fill = disp_fill
-                    cell.font = Font(bold=True, color="2c3e50")
-                    cell.alignment = center_align
-                    cell.border = thin_border
-                    
-                    # Columna Acumuladas
-                    cell = ws.cell(current_row, 3, dias_acumulados)
-                    cell.fill = acum_fill
-                    cell.font = Font(bold=True, color="FFFFFF")
-                    cell.alignment = center_align
-                    cell.border = thin_border
-                    
-                    # Columna Restan
-                    cell = ws.cell(current_row, 4, dias_restantes)
-                    cell.fill = rest_fill
-                    cell.font = Font(bold=True, color="FFFFFF")
-                    cell.alignment = center_align
-                    cell.border = thin_border
-                    
-                    # Marcar vacaciones en las semanas
-                    current_col = col_offset
-                    for mes in meses_globales:
-                        for semana in mes['semanas']:
-                            cell = ws.cell(current_row, current_col)
-                            cell.border = thin_border
-                            cell.alignment = center_align
-                            
-                            # Calcular días de vacaciones en esta semana y estado
-                            dias_en_semana = 0
-                            estado_vacacion = None
-                            for dia in semana['dias']:
-                                for vac in vacaciones:
-                                    if vac.fecha_inicio <= dia <= vac.fecha_fin:
-                                        dias_en_semana += 1
-                                        # Priorizar estado APROBADO si hay mezcla
-                                        if not estado_vacacion or estado_vacacion == RegistroVacaciones.ESTADO_PENDIENTE:
-                                            estado_vacacion = vac.estado
-                                        break
-                            
-                            if estado_vacacion == RegistroVacaciones.ESTADO_APROBADA:
-                                cell.fill = vac_fill
-                                cell.font = vac_font
-                                cell.value = dias_en_semana
-                                totales_por_columna[current_col] = totales_por_columna.get(current_col, 0) + 1
-                            elif estado_vacacion == RegistroVacaciones.ESTADO_PENDIENTE:
-                                cell.fill = vac_pending_fill
-                                cell.font = vac_font
-                                cell.value = dias_en_semana
-                                totales_por_columna[current_col] = totales_por_columna.get(current_col, 0) + 1
-                            
-                            current_col += 1
-                    
-                    current_row += 1
-        
-        # --- FILA DE TOTALES POR SEMANA ---
-        # Estilo para la fila de totales
-        total_fill = PatternFill(start_color="ecf0f1", end_color="ecf0f1", fill_type="solid")
-        total_font = Font(bold=True, color="2c3e50")
-
-        # Etiqueta de la fila
-        ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=4)
-        label_cell = ws.cell(current_row, 1, "TOTAL PERSONAS EN VACACIONES")
-        label_cell.fill = total_fill
-        label_cell.font = total_font
-        label_cell.alignment = Alignment(horizontal="right", vertical="center")
-        label_cell.border = thin_border
-
-        # Poner los totales acumulados
-        current_col = col_offset
-        for mes in meses_globales:
-            for semana in mes['semanas']:
-                total = totales_por_columna.get(current_col, 0)
-                cell = ws.cell(current_row, current_col, total if total > 0 else 0)
-                cell.fill = total_fill
-                cell.font = total_font
-                cell.alignment = center_align
-                cell.border = thin_border
-                current_col += 1
-
-        # Ajustar anchos de columna
-        ws.column_dimensions['A'].width = 30
-        ws.column_dimensions['B'].width = 12
-        ws.column_dimensions['C'].width = 12
-        ws.column_dimensions['D'].width = 12
-        
-        for col in range(col_offset, col_offset + total_semanas):
-            ws.column_dimensions[get_column_letter(col)].width = 5
+        # Estructura de meses y semanas (esqueleto cacheado)
+        meses_globales = meses_de_anios(tuple(anios_a_mostrar))
 
-        # Preparar respuesta
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        filename = f"calendario_vacaciones_{anio_param}.xlsx"
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
-        wb.save(response)
-        return response
+        # Workbook write-only con estilos compartidos, enviado como StreamingHttpResponse
+        return exportar_calendario_stream(anio_param, anios_a_mostrar, meses_globales)
         
     except Exception as e:
         import traceback
         return HttpResponse(f"<h1>Error al exportar: {e}</h1><pre>{traceback.format_exc()}</pre>")
 
 
-def _generar_datos_anio(anio_ciclo):
-    """
-    Función auxiliar para generar los datos del calendario de un año específico.
-    """
-    # 1. CALENDARIO ANUAL - Generar SEMANAS COMPLETAS del año (Lunes a Domingo)
-    # Ajustamos para que la semana visual comience en LUNES.
-    primer_dia = date(anio_ciclo, 1, 1)
-    dia_semana = primer_dia.weekday()  # 0=Lunes, 6=Domingo
-    
-    # Calcular días hasta el Lunes anterior
-    # Si es lunes(0) -> 0, Si es martes(1) -> 1 ...
-    dias_hasta_lunes = dia_semana
-    
-    # Retroceder hasta el lunes
-    fecha_inicio = primer_dia - timedelta(days=dias_hasta_lunes)
-    
-    # Generar todas las semanas del año
-    todas_semanas = []
-    fecha_actual = fecha_inicio
-    
-    # Continuar mientras la semana tenga al menos un día del año actual
-    while True:
-        # Crear semana de 7 días (Lunes a Domingo)
-        semana = []
-        for i in range(7):
-            semana.append(fecha_actual + timedelta(days=i))
-        
-        # Verificar si esta semana tiene al menos un día del año actual
-        tiene_dias_del_ano = any(dia.year == anio_ciclo for dia in semana)
-        
-        if not tiene_dias_del_ano and semana[0].year > anio_ciclo:
-            break
-        
-        if tiene_dias_del_ano:
-            # Determinar a qué mes asignar esta semana
-            # Asignar al mes donde COMIENZA la semana (primer día = lunes)
-            inicio = semana[0]
-            fin = semana[6]
-            
-            # Si el inicio está en el año actual, usar ese mes
-            # Si no, usar el mes del primer día del año actual en la semana
-            if inicio.year == anio_ciclo:
-                mes_principal = inicio.month
-            else:
-                # Buscar el primer día del año actual en la semana
-                primer_dia_del_anio = next((dia for dia in semana if dia.year == anio_ciclo), None)
-                if primer_dia_del_anio:
-                    mes_principal = primer_dia_del_anio.month
-                else:
-                    continue  # No debería pasar, pero por seguridad
-            
-            # Formatear rango
-            if inicio.month == fin.month and inicio.year == fin.year:
-                rango = f"{inicio.day}-{fin.day}"
-            elif inicio.year != fin.year:
-                # Si cruza de año, mostrar año corto (ej: 29/12/24 - 4/1/25)
-                rango = f"{inicio.day}/{inicio.month}/{str(inicio.year)[-2:]}-{fin.day}/{fin.month}/{str(fin.year)[-2:]}"
-            else:
-                rango = f"{inicio.day}/{inicio.month}-{fin.day}/{fin.month}"
-            
-            todas_semanas.append({
-                'dias': semana,
-                'inicio': inicio,
-                'fin': fin,
-                'mes': mes_principal,
-                'rango': rango
-            })
-        
-        fecha_actual += timedelta(days=7)
-    
-    # Agrupar semanas por mes
-    meses_data = []
-    for mes_num in range(1, 13):
-        mes_nombre = MESES_ESPANOL.get(mes_num, f'Mes-{mes_num}')
-        semanas_del_mes = [sem for sem in todas_semanas if sem['mes'] == mes_num]
-        
-        if semanas_del_mes:
-            meses_data.append({
-                'numero': mes_num,
-                'nombre': mes_nombre,
-                'semanas': semanas_del_mes,
-                'total_semanas': len(semanas_del_mes)
-            })
-            
-    return {
-        'anio': anio_ciclo,
-        'meses_data': meses_data,
-    }
-
-
-
-
 @login_required
 @user_passes_test(is_manager)
 def aprobar_rechazar_solicitud(request, solicitud_id):
     """
-    Procesa la aprobación o el rechazo de una solicitud de vacaciones
-    para un empleado y actualiza el saldo si se aprueba.
+    Procesa la aprobación, el rechazo o la cancelación de una solicitud de vacaciones.
+    La transición (bloqueo del saldo, validación y UPDATE condicional) la hace transiciones.transicionar;
+    acá quedan los avisos al empleado y los mensajes.
     """
 
     # Obtener la solicitud o devolver 404 si no existe
-    solicitud = get_object_or_404(RegistroVacaciones, pk=solicitud_id)
+    solicitud = get_object_or_404(RegistroVacaciones.objects.select_related('empleado'), pk=solicitud_id)
     empleado = solicitud.empleado
     dias_solicitados = solicitud.dias_solicitados
 
@@ -2067,7 +1524,9 @@ def aprobar_rechazar_solicitud(request, solicitud_id):
         messages.error(request, "Método no permitido. Utiliza el formulario.")
         return redirect('gestion:historial_global')
 
-    accion = request.POST.get('accion')  # Debe ser 'aprobar' o 'rechazar'
+    accion = request.POST.get('accion')  # 'aprobar', 'rechazar' o 'cancelar'
+    # Versión con la que se mostró la solicitud: si cambió desde entonces, no se pisa
+    version = request.POST.get('version') or None
 
     try:
         # Obtener el Empleado asociado al usuario actual (manager)
@@ -2078,128 +1537,67 @@ def aprobar_rechazar_solicitud(request, solicitud_id):
             logger.error(f"Usuario {request.user.username} no tiene perfil de Empleado asociado")
             return redirect('gestion:historial_global')
 
-        # Usar transacciones atómicas para asegurar que el saldo y la solicitud se actualicen juntos
+        # La transición y sus avisos van juntos: si falla el aviso, no queda el estado a medias
         with transaction.atomic():
-            # 1. Validaciones específicas según la acción
-            if accion in ['aprobar', 'rechazar'] and solicitud.estado != RegistroVacaciones.ESTADO_PENDIENTE:
-                 messages.warning(request, f"La solicitud ya fue procesada y está en estado: '{solicitud.estado}'.")
-                 return redirect('gestion:historial_global')
-
-            # Para cancelar, permitimos si está Aprobada (o incluso Pendiente si se desea)
-            if accion == 'cancelar' and solicitud.estado not in [RegistroVacaciones.ESTADO_APROBADA, RegistroVacaciones.ESTADO_PENDIENTE]:
-                 messages.warning(request, f"No se puede cancelar una solicitud en estado: '{solicitud.estado}'.")
-                 return redirect('gestion:historial_global')
-
-            # 2. Obtener o crear el saldo de vacaciones para el ciclo (año) actual
-            ciclo_actual = datetime.now().year
-            saldo, created = SaldoVacaciones.objects.get_or_create(
-                empleado=empleado,
-                ciclo=ciclo_actual,
-                defaults={'dias_iniciales': empleado.dias_base_lct(ciclo_actual)}
-            )
+            resultado = transicionar(solicitud, accion, manager_empleado, version=version)
 
-            if accion == 'aprobar':
-                # 3. Acción de aprobar: Validar saldo
-                if saldo.total_disponible() < dias_solicitados:
-                    messages.error(
-                        request,
-                        f"Saldo insuficiente. {empleado.nombre} tiene {saldo.total_disponible()} días disponibles y solicita {dias_solicitados}."
-                    )
-                    raise Exception("Fallo en la aprobación: Saldo insuficiente.")
-
-                # NOTA: No es necesario descontar manualmente los días porque el modelo
-                # SaldoVacaciones calcula automáticamente los días consumidos.
-                
-                # Actualizar estado de la solicitud y guardar el objeto RegistroVacaciones
-                solicitud.estado = RegistroVacaciones.ESTADO_APROBADA
-                solicitud.manager_aprobador = manager_empleado
-                solicitud.fecha_aprobacion = date.today()
-                solicitud.save()
-                
-                # Enviar notificación por email al empleado
-                enviar_email_cambio_estado(request, solicitud)
-
-                # Notificación interna
-                crear_notificacion(
-                    usuario=solicitud.empleado.user,
-                    titulo="Vacaciones Aprobadas ✅",
-                    mensaje=f"Tu solicitud para el ciclo {datetime.now().year} ha sido APROBADA.",
-                    url="gestion:historial_personal",
-                    solicitud=solicitud
-                )
-                
-                # Auto-limpiar notificaciones PENDIENTES de esta solicitud para el manager
-                Notificacion.objects.filter(solicitud=solicitud, usuario=request.user).update(leida=True)
-
-                messages.success(
-                    request,
-                    f"Vacaciones de {empleado.nombre} APROBADAS. Se descontaron {dias_solicitados} días. Nuevo saldo: {saldo.total_disponible()} días."
-                )
+            # Enviar notificación por email al empleado
+            enviar_email_cambio_estado(request, solicitud)
 
+            if accion == 'aprobar':
+                titulo = "Vacaciones Aprobadas ✅"
+                mensaje = f"Tu solicitud para el ciclo {datetime.now().year} ha sido APROBADA."
             elif accion == 'rechazar':
-                # 4. Acción de rechazar: Actualizar estado sin modificar saldo
-                solicitud.estado = RegistroVacaciones.ESTADO_RECHAZADA
-                solicitud.manager_aprobador = manager_empleado
-                solicitud.fecha_aprobacion = date.today()
-                solicitud.save()
-
-                # Enviar notificación por email al empleado
-                enviar_email_cambio_estado(request, solicitud)
-
-                # Notificación interna
-                crear_notificacion(
-                    usuario=solicitud.empleado.user,
-                    titulo="Solicitud Rechazada ❌",
-                    mensaje=f"Tu solicitud para el ciclo {datetime.now().year} ha sido RECHAZADA.",
-                    url="gestion:historial_personal",
-                    solicitud=solicitud
-                )
-
-                # Auto-limpiar notificaciones PENDIENTES de esta solicitud para el manager
-                Notificacion.objects.filter(solicitud=solicitud, usuario=request.user).update(leida=True)
-
-                messages.warning(request, f"Vacaciones de {empleado.nombre} RECHAZADAS. El saldo no fue afectado.")
-
-            elif accion == 'cancelar':
-                # NUEVA ACCIÓN: Cancelar solicitud (incluso si estaba aprobada)
-                # Al cambiar el estado a Cancelada, el cálculo dinámico de saldo
-                # automáticamente dejará de contar estos días como consumidos.
-                estado_anterior = solicitud.estado
-                solicitud.estado = RegistroVacaciones.ESTADO_CANCELADA
-                # Mantenemos o actualizamos el manager que canceló
-                solicitud.manager_aprobador = manager_empleado 
-                solicitud.save()
-                
-                # Enviar notificación por email al empleado
-                enviar_email_cambio_estado(request, solicitud)
-
-                # Notificación interna
-                crear_notificacion(
-                    usuario=solicitud.empleado.user,
-                    titulo="Solicitud Cancelada ⚠️",
-                    mensaje=f"Tu solicitud para el ciclo {datetime.now().year} ha sido CANCELADA y los días devueltos.",
-                    url="gestion:historial_personal",
-                    solicitud=solicitud
-                )
-
-                # Auto-limpiar notificaciones PENDIENTES
-                Notificacion.objects.filter(solicitud=solicitud).update(leida=True)
-
-                msg_extra = ""
-                if estado_anterior == RegistroVacaciones.ESTADO_APROBADA:
-                    msg_extra = " Los días descontados han sido devueltos al saldo."
-                
-                messages.success(request, f"Solicitud de {empleado.nombre} CANCELADA.{msg_extra}")
-
+                titulo = "Solicitud Rechazada ❌"
+                mensaje = f"Tu solicitud para el ciclo {datetime.now().year} ha sido RECHAZADA."
             else:
-                # 5. Acción inválida
-                messages.error(request, f"Acción '{accion}' inválida o no reconocida.")
-                raise Exception("Acción de formulario no válida.")
+                titulo = "Solicitud Cancelada ⚠️"
+                mensaje = f"Tu solicitud para el ciclo {datetime.now().year} ha sido CANCELADA y los días devueltos."
+
+            # Notificación interna
+            crear_notificacion(
+                usuario=empleado.user,
+                titulo=titulo,
+                mensaje=mensaje,
+                url="gestion:historial_personal",
+                solicitud=solicitud
+            )
+
+            # Auto-limpiar notificaciones PENDIENTES de esta solicitud (al cancelar, las de todos)
+            pendientes = Notificacion.objects.filter(solicitud=solicitud)
+            if accion != 'cancelar':
+                pendientes = pendientes.filter(usuario=request.user)
+            marcar_leidas(pendientes)
 
+        if accion == 'aprobar':
+            messages.success(
+                request,
+                f"Vacaciones de {empleado.nombre} APROBADAS. Se descontaron {dias_solicitados} días. Nuevo saldo: {resultado.saldo_disponible} días."
+            )
+        elif accion == 'rechazar':
+            messages.warning(request, f"Vacaciones de {empleado.nombre} RECHAZADAS. El saldo no fue afectado.")
+        else:
+            msg_extra = ""
+            if resultado.estado_anterior == RegistroVacaciones.ESTADO_APROBADA:
+                msg_extra = " Los días descontados han sido devueltos al saldo."
+            messages.success(request, f"Solicitud de {empleado.nombre} CANCELADA.{msg_extra}")
+
+    except SaldoInsuficiente as e:
+        messages.error(
+            request,
+            f"Saldo insuficiente. {empleado.nombre} tiene {e.disponible} días disponibles y solicita {e.solicitados}."
+        )
+    except TransicionInvalida as e:
+        messages.warning(request, str(e))
+    except ConflictoDeVersion:
+        messages.warning(
+            request,
+            f"La solicitud de {empleado.nombre} fue modificada por otra persona mientras la revisabas. "
+            "Revisa su estado actual antes de volver a intentarlo."
+        )
     except Exception as e:
         logger.error(f"Error procesando solicitud {solicitud_id}: {e}")
-        if not str(e).startswith("Fallo en la aprobación: Saldo insuficiente."):
-             messages.error(request, "Error interno al procesar la solicitud. Contacta a soporte.")
+        messages.error(request, "Error interno al procesar la solicitud. Contacta a soporte.")
     
     return redirect('gestion:historial_global')
 
@@ -2276,15 +1674,15 @@ def solicitar_vacaciones(request):
             dias_totales = (saldo.dias_iniciales or 0) + (saldo.dias_adicionales or 0)
             
             dias_usados = RegistroVacaciones.objects.filter(
+                en_anio('fecha_inicio', current_year),
                 empleado=empleado_afectado,
-                estado=RegistroVacaciones.ESTADO_APROBADA,
-                fecha_inicio__year=current_year
+                estado=RegistroVacaciones.ESTADO_APROBADA
             ).aggregate(total=Sum('dias_solicitados'))['total'] or 0
             
             dias_pendientes = RegistroVacaciones.objects.filter(
+                en_anio('fecha_inicio', current_year),
                 empleado=empleado_afectado,
-                estado=RegistroVacaciones.ESTADO_PENDIENTE,
-                fecha_inicio__year=current_year
+                estado=RegistroVacaciones.ESTADO_PENDIENTE
             ).aggregate(total=Sum('dias_solicitados'))['total'] or 0
 
             context.update({
@@ -2693,28 +2091,24 @@ def solicitar_mis_vacaciones(request):
             enviar_email_nueva_solicitud(request, solicitud)
 
             # Notificación interna para el manager y para todos los Administradores
-            notificados = set()
-            if solicitud.manager_aprobador and solicitud.manager_aprobador.user:
-                crear_notificacion(
-                    usuario=solicitud.manager_aprobador.user,
-                    titulo="Nueva Solicitud de Vacaciones 🔔",
-                    mensaje=f"{empleado.nombre} {empleado.apellido} ha solicitado vacaciones.",
-                    url="gestion:aprobacion_manager",
-                    solicitud=solicitud
-                )
-                notificados.add(solicitud.manager_aprobador.user.id)
+            manager = solicitud.manager_aprobador
+            notificados = notificar_usuarios(
+                [manager.user_id] if manager else [],
+                titulo="Nueva Solicitud de Vacaciones 🔔",
+                mensaje=f"{empleado.nombre} {empleado.apellido} ha solicitado vacaciones.",
+                url="gestion:aprobacion_manager",
+                solicitud=solicitud
+            )
             
             # Notificar también a todos los Administradores (superusuarios) que no sean el manager ya notificado
-            admin_users = User.objects.filter(is_superuser=True)
-            for a_user in admin_users:
-                if a_user.id not in notificados:
-                    crear_notificacion(
-                        usuario=a_user,
-                        titulo="Seguimiento: Nueva Solicitud 🔔",
-                        mensaje=f"{empleado.nombre} {empleado.apellido} ha solicitado vacaciones.",
-                        url="gestion:aprobacion_manager",
-                        solicitud=solicitud
-                    )
+            notificar_usuarios(
+                ids_administradores(),
+                titulo="Seguimiento: Nueva Solicitud 🔔",
+                mensaje=f"{empleado.nombre} {empleado.apellido} ha solicitado vacaciones.",
+                url="gestion:aprobacion_manager",
+                solicitud=solicitud,
+                excluir=notificados
+            )
 
             
             messages.success(request, "¡Solicitud enviada con éxito! Tu manager deberá aprobarla.")
@@ -2790,11 +2184,11 @@ def lista_notificaciones(request):
         solicitudes_pendientes = RegistroVacaciones.objects.filter(
             filter_q,
             estado=RegistroVacaciones.ESTADO_PENDIENTE
-        ).order_by('fecha_solicitud')
+        ).select_related('empleado').order_by('fecha_solicitud')
 
     # Si viene por POST, marcar todas como leídas
     if request.method == 'POST' and 'marcar_todas' in request.POST:
-        request.user.notificaciones.filter(leida=False).update(leida=True)
+        marcar_leidas(request.user.notificaciones.all())
         messages.success(request, "Todas las notificaciones marcadas como leídas.")
         return redirect('gestion:lista_notificaciones')
         
@@ -2844,47 +2238,56 @@ def api_check_notificaciones(request):
     except ValueError:
         last_notif_id = 0
 
-    # 1. Notificaciones nuevas (creadas después del last_id)
-    nuevas_notif = request.user.notificaciones.filter(id__gt=last_notif_id).order_by('id')
-    
-    # 2. Conteo total de no leídas
-    unread_count = request.user.notificaciones.filter(leida=False).count()
-    
-    # 3. Tareas pendientes (solo para managers)
-    tareas_pendientes = 0
-    if hasattr(request.user, 'empleado') and request.user.empleado.es_manager:
-        from django.db.models import Q
-        # Si es Administrador (Superuser), ve TODAS las pendientes
-        if request.user.is_superuser:
-            filter_q = Q()
-        else:
-            filter_q = Q(manager_aprobador=request.user.empleado)
-            
-        tareas_pendientes = RegistroVacaciones.objects.filter(
-            filter_q,
-            estado=RegistroVacaciones.ESTADO_PENDIENTE
-        ).count()
-
-    notif_data = []
-    max_id = last_notif_id
-    for n in nuevas_notif:
-        notif_data.append({
-            'id': n.id,
-            'titulo': n.titulo,
-            'mensaje': n.mensaje,
-            'url': n.url
+    return JsonResponse(resumen_notificaciones(request.user, last_notif_id))
+
+
+@login_required
+def api_esperar_notificaciones(request):
+    """
+    Long-poll de notificaciones: responde apenas cambia la versión del usuario (o enseguida si el
+    cliente no manda la actual) y, si no hubo cambios en LONG_POLL_SEGUNDOS, devuelve 204.
+    Mientras espera no toca la base de datos.
+    """
+    try:
+        last_notif_id = int(request.GET.get('last_id', 0))
+    except ValueError:
+        last_notif_id = 0
+
+    if esperar_cambio(request.user, request.GET.get('version', '')) is None:
+        return HttpResponse(status=204)
+
+    return JsonResponse(resumen_notificaciones(request.user, last_notif_id))
+
+
+@login_required
+@user_passes_test(lambda u: u.is_staff)
+def estadisticas_rendimiento(request):
+    """
+    Tabla de rendimiento por vista (últimos pedidos de este proceso): tiempos p50/p95/máx,
+    consultas SQL y render de plantillas. Las vistas de long-poll van en una tabla aparte ('esperas').
+    Con ?formato=json devuelve los mismos datos en JSON.
+    """
+    if request.method == 'POST' and 'reiniciar' in request.POST:
+        perfilado.reiniciar()
+        return redirect('gestion:estadisticas_rendimiento')
+
+    filas = perfilado.estadisticas()
+    esperas = perfilado.estadisticas(espera=True)
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({
+            'activo': getattr(settings, 'PERFILADO_ACTIVO', False), 'ventana': perfilado.VENTANA,
+            'vistas': filas, 'esperas': esperas,
         })
-        max_id = max(max_id, n.id)
 
-    return JsonResponse({
-        'unread_count': unread_count + tareas_pendientes,
-        'tareas_pendientes': tareas_pendientes,
-        'nuevas': notif_data,
-        'last_id': max_id
+    return render(request, 'gestion/rendimiento.html', {
+        'filas': filas,
+        'esperas': esperas,
+        'activo': getattr(settings, 'PERFILADO_ACTIVO', False),
+        'ventana': perfilado.VENTANA,
+        'titulo_pagina': 'Rendimiento por Vista',
     })
 
 
-
 @login_required
 def exportar_notificacion_vacaciones_ics(request, vacacion_id):
     """
@@ -2970,92 +2373,207 @@ def calendario_interactivo(request):
     return render(request, 'gestion/calendario_interactivo.html', context)
 
 
-@login_required
-def api_vacaciones_listar(request):
+# Ventana máxima que acepta api_vacaciones_listar (FullCalendar pide de a un mes/semana)
+MAX_DIAS_VENTANA_API = 400
+
+COLORES_ESTADO_API = {
+    RegistroVacaciones.ESTADO_APROBADA: '#10b981',  # Verde Esmeralda
+    RegistroVacaciones.ESTADO_PENDIENTE: '#f59e0b',  # Ambar
+}
+
+
+def _consulta_ventana_vacaciones(request):
     """
-    API JSON que devuelve todas las vacaciones para FullCalendar.
-    Managers ven todo. Empleados ven solo lo suyo (si tuvieran acceso).
+    Interpreta start/end (FullCalendar manda fechas ISO, con hora y zona) y arma los filtros de la ventana:
+    devuelve (inicio, fin_exclusivo, filtro de vacaciones) o None si la ventana falta o es inválida.
+    Las rechazadas y canceladas se descartan en SQL (no se muestran en el planificador).
     """
-    from django.db.models import Q
-    start = request.GET.get('start') # Formato ISO: 2024-01-01
-    end = request.GET.get('end')     # Formato ISO
-    
-    # Filtro base por fechas (si se envían)
-    query = Q()
-    if start and end:
-        # Vacaciones que se solapen con el rango visible
-        # (Start < Fin_Vacacion) AND (End > Inicio_Vacacion)
-        query &= Q(fecha_fin__gte=start) & Q(fecha_inicio__lte=end)
-    
-    # Filtro de permisos
+    try:
+        inicio = date.fromisoformat(request.GET['start'][:10])
+        fin = date.fromisoformat(request.GET['end'][:10])
+    except (KeyError, ValueError):
+        return None
+    if not (inicio < fin and (fin - inicio).days <= MAX_DIAS_VENTANA_API):
+        return None
+
+    # Vacaciones que se solapen con el rango visible ('end' es exclusivo)
+    filtro = Q(fecha_fin__gte=inicio, fecha_inicio__lt=fin, estado__in=ESTADOS_OCUPAN)
+
+    # Filtro de permisos: Administrador y managers ven todo (para evitar choques con otros departamentos);
+    # un empleado normal solo lo suyo
     if not request.user.is_superuser:
-        if hasattr(request.user, 'empleado') and request.user.empleado.es_manager:
-            # Manager: Ve su equipo + a sí mismo
-            # (Simplificación: Ver todo para planificar mejor, o solo equipo)
-            # Para "Interactive Drag & Drop" global, vamos a permitir ver TODO si es manager,
-            # para evitar choques con otros departamentos.
-            pass 
-        else:
-            # Empleado normal: Solo ve lo suyo (aunque esta vista suele ser de manager)
-            # Si se le da acceso a empleados, filtrar aquí.
-            if hasattr(request.user, 'empleado'):
-                query &= Q(empleado=request.user.empleado)
-            else:
-                return JsonResponse([], safe=False)
+        empleado = getattr(request.user, 'empleado', None)
+        if empleado is None:
+            filtro &= Q(pk__in=[])
+        elif not empleado.es_manager:
+            filtro &= Q(empleado=empleado)
+    return inicio, fin, filtro
 
-    vacaciones = RegistroVacaciones.objects.filter(query).select_related('empleado', 'empleado__departamento')
-    
+
+def _etag_vacaciones(request):
+    """
+    Huella barata de la ventana: cantidad, id máximo y última modificación de las vacaciones visibles
+    y de sus empleados y departamentos (nombre y departamento van en el título), más cantidad, id
+    máximo y última modificación de los feriados. Cualquier alta, baja o cambio la mueve.
+    """
+    ventana = _consulta_ventana_vacaciones(request)
+    if ventana is None:
+        return None
+    inicio, fin, filtro = ventana
+    huella = RegistroVacaciones.objects.filter(filtro).aggregate(
+        cantidad=Count('id'), ultimo_id=Max('id'), modificada=Max('fecha_modificacion'),
+        empleados=Max('empleado__fecha_modificacion'), departamentos=Max('empleado__departamento__fecha_modificacion')
+    )
+    festivos = DiasFestivos.objects.filter(fecha__gte=inicio, fecha__lt=fin).aggregate(
+        cantidad=Count('id'), ultimo_id=Max('id'), modificado=Max('fecha_modificacion')
+    )
+    clave = (
+        f"{request.user.pk}|{_formato_vacaciones(request)}|{inicio}|{fin}|"
+        f"{sorted(huella.items())}|{sorted(festivos.items())}"
+    )
+    return hashlib.md5(clave.encode()).hexdigest()
+
+
+def _formato_vacaciones(request):
+    return 'compacto' if request.GET.get('formato') == 'compacto' else 'eventos'
+
+
+def _eventos_fullcalendar(vacaciones, festivos):
+    """Formato clásico: un objeto de evento de FullCalendar por vacación y por feriado."""
     eventos = []
     for vac in vacaciones:
-        color = '#3b82f6' # Azul (Default)
-        if vac.estado == RegistroVacaciones.ESTADO_APROBADA:
-            color = '#10b981' # Verde Esmeralda
-        elif vac.estado == RegistroVacaciones.ESTADO_PENDIENTE:
-            color = '#f59e0b' # Ambar
-        elif vac.estado == RegistroVacaciones.ESTADO_RECHAZADA:
-            color = '#ef4444' # Rojo (no se suelen mostrar, pero por si acaso)
-            continue # Mejor no mostrar rechazadas para no ensuciar
-        elif vac.estado == RegistroVacaciones.ESTADO_CANCELADA:
-             continue
-
-        # FullCalendar espera fecha fin EXCLUSIVA (+1 día)
-        end_date_fc = vac.fecha_fin + timedelta(days=1)
-        
-        titulo = f"{vac.empleado.nombre} {vac.empleado.apellido}"
-        if vac.empleado.departamento:
-             titulo += f" ({vac.empleado.departamento.nombre[:3]})"
+        departamento = vac['empleado__departamento__nombre']
+        titulo = f"{vac['empleado__nombre']} {vac['empleado__apellido']}"
+        if departamento:
+            titulo += f" ({departamento[:3]})"
 
         eventos.append({
-            'id': vac.id,
+            'id': vac['id'],
             'title': titulo,
-            'start': vac.fecha_inicio.isoformat(),
-            'end': end_date_fc.isoformat(),
-            'color': color,
+            'start': vac['fecha_inicio'].isoformat(),
+            # FullCalendar espera fecha fin EXCLUSIVA (+1 día)
+            'end': (vac['fecha_fin'] + timedelta(days=1)).isoformat(),
+            'color': COLORES_ESTADO_API[vac['estado']],
             'extendedProps': {
-                'estado': vac.estado,
-                'empleado_id': vac.empleado.id,
-                'departamento': vac.empleado.departamento.nombre if vac.empleado.departamento else 'Gral',
-                'detalle': vac.razon or "Sin motivo"
+                'estado': vac['estado'],
+                'empleado_id': vac['empleado_id'],
+                'departamento': departamento or 'Gral',
+                'detalle': vac['razon'] or "Sin motivo",
+                'version': vac['version'],
             },
-            # Bloquear edición si no es manager o si ya pasó (opcional)
             'editable': True # Permitir drag & drop
         })
-        
+
     # Agregar Feriados como eventos de fondo o bloqueados
-    festivos = DiasFestivos.objects.filter(fecha__range=[start, end]) if (start and end) else DiasFestivos.objects.all()
-    
-    for fest in festivos:
+    for fest_id, fecha, descripcion in festivos:
         eventos.append({
-            'id': f"fest-{fest.id}",
-            'title': f"🌴 {fest.descripcion}",
-            'start': fest.fecha.isoformat(),
+            'id': f"fest-{fest_id}",
+            'title': f"🌴 {descripcion}",
+            'start': fecha.isoformat(),
             'allDay': True,
             'display': 'background', # Mostrar como fondo
             'backgroundColor': '#ffe4e6', # Rosado suave
             'editable': False
         })
+    return eventos
+
 
-    return JsonResponse(eventos, safe=False)
+def _indice(diccionario, valor):
+    """Posición de 'valor' en el diccionario (dict valor -> índice), agregándolo si es nuevo."""
+    if valor not in diccionario:
+        diccionario[valor] = len(diccionario)
+    return diccionario[valor]
+
+
+def _payload_compacto(inicio, vacaciones, festivos):
+    """
+    Formato compacto (?formato=compacto): columnas en lugar de objetos y textos repetidos
+    reemplazados por índices a diccionarios. Las fechas son días enteros desde 'base'
+    (el inicio de la ventana; puede haber negativos si la vacación empezó antes).
+    'dias' es la duración en días corridos (fin inclusive). El decodificador está en
+    calendario_interactivo.html.
+    """
+    estados, departamentos, razones = {}, {}, {}
+    empleados = {}  # empleado_id -> índice
+    lista_empleados = []
+    columnas = {'id': [], 'empleado': [], 'inicio': [], 'dias': [], 'estado': [], 'razon': [], 'version': []}
+
+    for vac in vacaciones:
+        empleado_id = vac['empleado_id']
+        if empleado_id not in empleados:
+            empleados[empleado_id] = len(lista_empleados)
+            departamento = vac['empleado__departamento__nombre']
+            lista_empleados.append([
+                empleado_id,
+                f"{vac['empleado__nombre']} {vac['empleado__apellido']}",
+                _indice(departamentos, departamento) if departamento else -1,
+            ])
+        columnas['id'].append(vac['id'])
+        columnas['empleado'].append(empleados[empleado_id])
+        columnas['inicio'].append((vac['fecha_inicio'] - inicio).days)
+        columnas['dias'].append((vac['fecha_fin'] - vac['fecha_inicio']).days + 1)
+        columnas['estado'].append(_indice(estados, vac['estado']))
+        columnas['razon'].append(_indice(razones, vac['razon']) if vac['razon'] else -1)
+        columnas['version'].append(vac['version'])
+
+    descripciones = {}
+    columnas_festivos = {'id': [], 'dia': [], 'descripcion': []}
+    for fest_id, fecha, descripcion in festivos:
+        columnas_festivos['id'].append(fest_id)
+        columnas_festivos['dia'].append((fecha - inicio).days)
+        columnas_festivos['descripcion'].append(_indice(descripciones, descripcion))
+
+    return {
+        'v': 1,
+        'base': inicio.isoformat(),
+        'estados': list(estados),
+        'colores': [COLORES_ESTADO_API[estado] for estado in estados],
+        'departamentos': list(departamentos),
+        'razones': list(razones),
+        'empleados': lista_empleados,
+        'vacaciones': columnas,
+        'descripciones': list(descripciones),
+        'festivos': columnas_festivos,
+    }
+
+
+@comprimir_respuesta
+@login_required
+@condition(etag_func=_etag_vacaciones)
+def api_vacaciones_listar(request):
+    """
+    API JSON con las vacaciones (aprobadas y pendientes) y feriados de la ventana start/end de FullCalendar.
+    La ventana es obligatoria. Responde 304 si la huella (ETag) coincide con If-None-Match, así que
+    ir y volver entre meses en el planificador no vuelve a serializar nada.
+    Con ?formato=compacto devuelve columnas con diccionarios (ver _payload_compacto); en ambos
+    formatos la respuesta se comprime con brotli/gzip si el cliente lo acepta.
+    """
+    ventana = _consulta_ventana_vacaciones(request)
+    if ventana is None:
+        return JsonResponse(
+            {'error': f'Se requieren start y end (ISO) con un rango de hasta {MAX_DIAS_VENTANA_API} días.'},
+            status=400
+        )
+    inicio, fin, filtro = ventana
+
+    vacaciones = RegistroVacaciones.objects.filter(filtro).order_by().values(
+        'id', 'fecha_inicio', 'fecha_fin', 'estado', 'razon', 'empleado_id', 'version',
+        'empleado__nombre', 'empleado__apellido', 'empleado__departamento__nombre'
+    )
+    festivos = DiasFestivos.objects.filter(
+        fecha__gte=inicio, fecha__lt=fin
+    ).values_list('id', 'fecha', 'descripcion')
+
+    if _formato_vacaciones(request) == 'compacto':
+        # separators sin espacios: en el formato compacto cada byte cuenta
+        respuesta = JsonResponse(
+            _payload_compacto(inicio, vacaciones, festivos), json_dumps_params={'separators': (',', ':')}
+        )
+    else:
+        respuesta = JsonResponse(_eventos_fullcalendar(vacaciones, festivos), safe=False)
+    # El navegador guarda la respuesta pero revalida siempre: la próxima vez recibe 304 si nada cambió
+    respuesta['Cache-Control'] = 'private, no-cache'
+    return respuesta
 
 
 @csrf_exempt
@@ -3096,13 +2614,19 @@ def api_vacaciones_mover(request):
             if registro.estado in [RegistroVacaciones.ESTADO_RECHAZADA, RegistroVacaciones.ESTADO_CANCELADA]:
                  return JsonResponse({'success': False, 'error': 'No se pueden mover solicitudes canceladas/rechazadas'})
             
-            # UPDATE
-            registro.fecha_inicio = fecha_inicio_dt
-            registro.fecha_fin = fecha_fin_dt
-            # Recalcular días solicitados (método save lo hace)
-            registro.save()
-            
-            return JsonResponse({'success': True, 'msg': 'Fechas actualizadas correctamente'})
+            # UPDATE condicional a la versión que tenía el calendario: solo fechas y días, sin pisar
+            # una aprobación o un movimiento hecho por otro manager mientras tanto
+            try:
+                registro.actualizar_con_version(
+                    version=data.get('version'), fecha_inicio=fecha_inicio_dt, fecha_fin=fecha_fin_dt
+                )
+            except ConflictoDeVersion:
+                return JsonResponse({
+                    'success': False, 'conflicto': True,
+                    'error': 'Otra persona modificó estas vacaciones. Se recargará el calendario.'
+                }, status=409)
+
+            return JsonResponse({'success': True, 'msg': 'Fechas actualizadas correctamente', 'version': registro.version})
 
         except RegistroVacaciones.DoesNotExist:
              return JsonResponse({'success': False, 'error': 'Registro no encontrado'})
@@ -3110,3 +2634,35 @@ def api_vacaciones_mover(request):
              return JsonResponse({'success': False, 'error': str(e)})
 
     return JsonResponse({'success': False, 'error': 'Método no permitido'})
+
+
+@login_required
+@user_passes_test(is_manager)
+def api_vacaciones_mover_lote(request):
+    """
+    API para aplicar de una vez una replanificación del calendario interactivo.
+    Recibe {"movimientos": [{"id", "start", "end"}, ...], "todo_o_nada": true} (fechas como las manda
+    FullCalendar, fin exclusivo) y responde un resultado por movimiento. Todo corre en una transacción
+    con las solicitudes bloqueadas; ver planificacion.mover_en_lote.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Método no permitido'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'JSON inválido'}, status=400)
+
+    movimientos = data.get('movimientos') if isinstance(data, dict) else None
+    if not isinstance(movimientos, list) or not 0 < len(movimientos) <= MAX_MOVIMIENTOS_LOTE:
+        return JsonResponse(
+            {'success': False, 'error': f'Se esperan entre 1 y {MAX_MOVIMIENTOS_LOTE} movimientos'}, status=400
+        )
+
+    resultados = mover_en_lote(movimientos, todo_o_nada=bool(data.get('todo_o_nada', True)))
+    aplicados = sum(1 for r in resultados if r['success'])
+    return JsonResponse({
+        'success': aplicados == len(resultados),
+        'aplicados': aplicados,
+        'resultados': resultados,
+    })